@@ -31,6 +31,7 @@ import time
 
 import sensehatlive.log.logger as logger
 from sensehatlive.sensemanager.manager import SenseHatManager
+from metrics import MetricsServer, TextfileExporter
 
 sh = None
 
@@ -50,7 +51,10 @@ def main(args):
     sensehatlive.QUIET = args.quiet
 
     # Initialize the logger
-    logger.initLogger(console=not sensehatlive.QUIET, log_dir=os.path.dirname(__file__), verbose=sensehatlive.VERBOSE)
+    log_queue = args.log_queue_size if args.async_log else 0
+    logger.initLogger(console=not sensehatlive.QUIET, log_dir=os.path.dirname(__file__), verbose=sensehatlive.VERBOSE,
+                      async_queue=log_queue, rate_limit=args.log_rate_limit, buffered=args.buffered_log,
+                      staging_dir=args.log_staging_dir)
 
     if args.daemon:
         logger.warning('Overriding quiet option when daemonizing')
@@ -84,10 +88,31 @@ def main(args):
     if sensehatlive.DAEMON:
         sensehatlive.daemonize()
 
+        # Log writer threads do not survive the fork
+        logger.initLogger(console=False, log_dir=os.path.dirname(__file__), verbose=sensehatlive.VERBOSE,
+                          async_queue=log_queue, rate_limit=args.log_rate_limit, buffered=args.buffered_log,
+                          staging_dir=args.log_staging_dir)
+
     logger.info('Sense Hat Live!: Producer')
-    sh = SenseHatManager()
+    sh = SenseHatManager(imu_stream=args.imu_stream, imu_window=args.imu_window,
+                         publish_mode=args.publish_mode, keepalive=args.keepalive, encoding=args.encoding,
+                         batch_size=args.batch_size, batch_bytes=args.batch_bytes, batch_age=args.batch_age,
+                         outbox_dir=args.outbox_dir, outbox_bytes=args.outbox_bytes,
+                         queue_size=args.queue_size, queue_policy=args.queue_policy,
+                         confirm_window=args.confirm_window, event_loop=args.event_loop,
+                         window_stats=args.window_stats, simulate=args.simulate, sim_seed=args.sim_seed,
+                         sim_latency=args.sim_latency, profile=args.profile)
     sensehatlive.insert_thread(sh)
 
+    if args.profile:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: sh.dump_profile(args.profile_dir))
+
+    # Metrics exporters stop after the manager so the last values are written
+    if args.metrics_port:
+        sensehatlive.insert_thread(MetricsServer(args.metrics_port, args.metrics_host))
+    if args.metrics_file:
+        sensehatlive.insert_thread(TextfileExporter(args.metrics_file, args.metrics_interval))
+
     # Start all threads
     sensehatlive.start_threads()
 
@@ -118,5 +143,65 @@ if __name__ == '__main__':
                         help='Run as a daemon')
     parser.add_argument('--pidfile',
                         help='Create a pid file (only relevant when running as a daemon)')
+    parser.add_argument('--imu-stream', action='store_true',
+                        help='Capture the IMU at the hardware rate into a ring buffer')
+    parser.add_argument('--imu-window', type=int, default=1024,
+                        help='Number of IMU samples kept when streaming')
+    parser.add_argument('--publish-mode', choices=['interval', 'cos'], default='interval',
+                        help='Publish on a fixed interval or only when a sensor crosses its cos_threshold')
+    parser.add_argument('--keepalive', type=float, default=300,
+                        help='Maximum seconds between messages in cos publish mode')
+    parser.add_argument('--encoding', choices=['json', 'struct', 'gorilla'], default='json',
+                        help='Payload encoding, named in the message content type')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='Publish every sample in messages of up to this many samples')
+    parser.add_argument('--batch-bytes', type=int, default=64 * 1024,
+                        help='Maximum batched message size in bytes')
+    parser.add_argument('--batch-age', type=float, default=30,
+                        help='Maximum seconds a sample waits in a batch')
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help='Maximum samples waiting for the message broker thread')
+    parser.add_argument('--queue-policy', choices=['drop_oldest', 'drop_newest'], default='drop_oldest',
+                        help='Sample to drop when the message broker queue is full')
+    parser.add_argument('--outbox-dir',
+                        help='Store messages in this directory while the broker is unreachable')
+    parser.add_argument('--outbox-bytes', type=int, default=64 * 1024 * 1024,
+                        help='Maximum outbox size on disk, the oldest messages are dropped when full')
+    parser.add_argument('--confirm-window', type=int, default=256,
+                        help='Maximum unconfirmed messages before publishing waits for broker confirms')
+    parser.add_argument('--event-loop', action='store_true',
+                        help='Run the sampler and message broker on one asyncio event loop instead of threads')
+    parser.add_argument('--window-stats', choices=['off', 'with', 'only'], default='off',
+                        help='Publish min/max/mean/stddev of every sample since the last publish with the last '
+                             'value, or with the window mean in place of the last value. Not available with '
+                             'the struct encoding')
+    parser.add_argument('--async-log', action='store_true',
+                        help='Queue log records and write them from a background thread')
+    parser.add_argument('--log-queue-size', type=int, default=logger.ASYNC_QUEUE_SIZE,
+                        help='Maximum queued log records in async log mode, more are dropped and counted')
+    parser.add_argument('--log-rate-limit', type=float, default=0,
+                        help='Log each statement at most 5 times per this many seconds, repeats are counted')
+    parser.add_argument('--buffered-log', action='store_true',
+                        help='Write the log file in batches and compress rotated log files')
+    parser.add_argument('--log-staging-dir',
+                        help='Keep the active log file in this directory, such as a tmpfs, implies --buffered-log')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Use a simulated sense hat instead of the board')
+    parser.add_argument('--sim-seed', type=int, default=0,
+                        help='Seed of the simulated sensor signals')
+    parser.add_argument('--sim-latency', type=float, default=1.0,
+                        help='Scale of the simulated sensor read latencies, 0 for none')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics over HTTP on this port, 0 to disable')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='Address the metrics server listens on')
+    parser.add_argument('--metrics-file',
+                        help='Write Prometheus metrics to this file, e.g. for the node exporter textfile collector')
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help='Seconds between metrics file writes')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time every sensor read and sampler task, SIGUSR1 writes a folded stack profile')
+    parser.add_argument('--profile-dir', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='Directory of the profiles written on SIGUSR1')
     args = parser.parse_args()
     main(args)
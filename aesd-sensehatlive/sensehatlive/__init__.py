@@ -106,7 +106,7 @@ def daemonize():
     try:
         pid = os.fork()  # @UndefinedVariable - only available in UNIX
         if pid != 0:
-            sys.exit(0)
+            os._exit(0)  # Skip exit handlers, the daemon owns the log files
     except OSError as e:
         raise RuntimeError("1st fork failed: {} [{}]".format(e.strerror, e.errno))
 
@@ -120,7 +120,7 @@ def daemonize():
     try:
         pid = os.fork()  # @UndefinedVariable - only available in UNIX
         if pid != 0:
-            sys.exit(0)
+            os._exit(0)  # Skip exit handlers, the daemon owns the log files
     except OSError as e:
         raise RuntimeError("2nd fork failed: {} [{}]".format(e.strerror, e.errno))
 
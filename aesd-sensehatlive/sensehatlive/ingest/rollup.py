@@ -0,0 +1,247 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : rollup.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Incremental rollups of ingested sensor data. Count, sum, min and max are kept per device, field and
+              time bucket at several resolutions and updated as messages arrive, so long range queries read
+              buckets instead of samples. A message batch is reduced per bucket with NumPy in one pass and merged
+              into the existing buckets, samples arriving late update their bucket in place.
+
+Reference   : NumPy ufunc reduceat (https://numpy.org/doc/stable/reference/generated/numpy.ufunc.reduceat.html)
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import threading
+import numpy as np
+import log.logger as logger
+from ingest.store import FIELDS, device_columns, device_file_name, message_payloads
+
+# Bucket sizes in seconds
+RESOLUTION_MINUTE = 60
+RESOLUTION_HOUR = 3600
+RESOLUTION_DAY = 86400
+DEFAULT_RESOLUTIONS = (RESOLUTION_MINUTE, RESOLUTION_HOUR, RESOLUTION_DAY)
+
+INITIAL_BUCKETS = 1024
+ROLLUP_EXT = '.npz'
+
+
+class RollupSeries(object):
+    ''' Buckets of one device at one resolution, rows are kept in the order buckets were created
+
+    '''
+
+    def __init__(self, resolution, fields=FIELDS, capacity=INITIAL_BUCKETS):
+        ''' Class initialization
+
+        :param resolution: Bucket size in seconds
+        :param fields: Field names
+        :param capacity: Initial number of buckets
+        '''
+        self.resolution = resolution
+        self.fields = tuple(fields)
+        self.size = 0
+        self._rows = {}  # Bucket start to row
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        shape = (capacity, len(self.fields))
+        self.starts = np.empty(capacity, np.int64)
+        self.count = np.zeros(shape, np.int64)
+        self.sum = np.zeros(shape, np.float64)
+        self.min = np.full(shape, np.nan, np.float32)
+        self.max = np.full(shape, np.nan, np.float32)
+
+    def _grow(self, needed):
+        capacity = len(self.starts)
+        if needed <= capacity:
+            return
+        old = (self.starts, self.count, self.sum, self.min, self.max)
+        self._allocate(max(needed, capacity * 2))
+        for new, prev in zip((self.starts, self.count, self.sum, self.min, self.max), old):
+            new[:self.size] = prev[:self.size]
+
+    def _bucket_rows(self, starts):
+        ''' Get the rows of bucket starts, creating missing buckets
+
+        :param starts: Unique bucket starts
+        :return: Array of rows
+        '''
+        rows = np.fromiter((self._rows.get(start, -1) for start in starts.tolist()), np.int64, len(starts))
+        new = np.flatnonzero(rows < 0)
+        if len(new):
+            self._grow(self.size + len(new))
+            rows[new] = np.arange(self.size, self.size + len(new))
+            self.starts[rows[new]] = starts[new]
+            self._rows.update(zip(starts[new].tolist(), rows[new].tolist()))
+            self.size += len(new)
+        return rows
+
+    def update(self, ts, values):
+        ''' Merge a batch of samples into the buckets
+
+        :param ts: int64 array of timestamps
+        :param values: float array of shape (samples, fields), NaN where missing
+        :return:
+        '''
+        buckets = ts - ts % self.resolution
+        order = np.argsort(buckets, kind='stable')
+        buckets = buckets[order]
+        values = values[order]
+
+        # Reduce each run of samples in the same bucket
+        first = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        valid = ~np.isnan(values)
+        count = np.add.reduceat(valid, first, axis=0)
+        total = np.add.reduceat(np.where(valid, values, 0), first, axis=0, dtype=np.float64)
+        low = np.fmin.reduceat(values, first, axis=0)
+        high = np.fmax.reduceat(values, first, axis=0)
+
+        rows = self._bucket_rows(buckets[first])
+        self.count[rows] += count
+        self.sum[rows] += total
+        self.min[rows] = np.fmin(self.min[rows], low)
+        self.max[rows] = np.fmax(self.max[rows], high)
+
+    def query(self, start, end, fields=None):
+        ''' Get the buckets overlapping start to end
+
+        :param start: First timestamp
+        :param end: Last timestamp
+        :param fields: Field names, all when None
+        :return: Dictionary of 'ts' to bucket starts and each field to a dictionary of min, max, mean and count
+        '''
+        starts = self.starts[:self.size]
+        rows = np.flatnonzero((starts > start - self.resolution) & (starts <= end))
+        rows = rows[np.argsort(starts[rows], kind='stable')]
+
+        result = {'ts': starts[rows]}
+        for name in fields or self.fields:
+            i = self.fields.index(name)
+            count = self.count[rows, i]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = self.sum[rows, i] / count
+            result[name] = {'min': self.min[rows, i], 'max': self.max[rows, i], 'mean': mean, 'count': count}
+        return result
+
+    def save(self, path, device_id):
+        ''' Write the buckets to a file
+
+        :param path: File path
+        :param device_id: Device ID stored with the buckets
+        '''
+        n = self.size
+        tmp = path + '.tmp' + ROLLUP_EXT
+        np.savez(tmp, device=np.array(device_id), resolution=np.array(self.resolution),
+                 fields=np.array(self.fields), starts=self.starts[:n], count=self.count[:n], sum=self.sum[:n],
+                 min=self.min[:n], max=self.max[:n])
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        ''' Read buckets written by save()
+
+        :param path: File path
+        :return: Tuple of device ID and series
+        '''
+        with np.load(path) as data:
+            series = cls(int(data['resolution']), tuple(data['fields'].tolist()), max(len(data['starts']), 1))
+            n = len(data['starts'])
+            for name in ('starts', 'count', 'sum', 'min', 'max'):
+                getattr(series, name)[:n] = data[name]
+            series.size = n
+            series._rows = dict(zip(data['starts'].tolist(), range(n)))
+            return str(data['device']), series
+
+
+class RollupEngine(object):
+    ''' Rollups of every device at several resolutions
+
+    '''
+
+    def __init__(self, path=None, resolutions=DEFAULT_RESOLUTIONS):
+        ''' Class initialization
+
+        :param path: Directory the rollups are saved to by flush() and loaded from, kept in memory when None
+        :param resolutions: Bucket sizes in seconds
+        '''
+        self._path = path
+        self._resolutions = tuple(resolutions)
+        self._lock = threading.Lock()
+        self._series = {}  # (device ID, resolution) to series
+        self.rejected = 0
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            for name in sorted(os.listdir(path)):
+                if name.endswith(ROLLUP_EXT) and '.tmp' not in name:
+                    device_id, series = RollupSeries.load(os.path.join(path, name))
+                    if series.resolution in self._resolutions:
+                        self._series[(device_id, series.resolution)] = series
+            logger.info('Rollups {} opened with {} series'.format(path, len(self._series)))
+
+    def on_message(self, message):
+        ''' Consumer callback, takes a decoded payload or batch or JSON text
+
+        :param message: Message from the consumer
+        :return:
+        '''
+        self.append(message_payloads(message))
+
+    def append(self, payloads):
+        ''' Merge payloads into the rollups of their devices
+
+        :param payloads: List of payload dicts
+        :return:
+        '''
+        columns, rejected = device_columns(payloads)
+        with self._lock:
+            self.rejected += rejected
+            for device_id, (ts, values) in columns.items():
+                matrix = np.column_stack([values[name] for name in FIELDS])
+                for resolution in self._resolutions:
+                    series = self._series.get((device_id, resolution))
+                    if series is None:
+                        series = self._series[(device_id, resolution)] = RollupSeries(resolution)
+                    series.update(ts, matrix)
+
+    def query(self, device_id, resolution, start, end, fields=None):
+        ''' Get a device's buckets overlapping start to end
+
+        :param device_id: Device ID
+        :param resolution: One of the configured resolutions
+        :param start: First timestamp
+        :param end: Last timestamp
+        :param fields: Field names, all when None
+        :return: See RollupSeries.query(), None for an unknown device
+        '''
+        if resolution not in self._resolutions:
+            raise Exception("Unknown rollup resolution {}, expected one of {}".format(resolution, self._resolutions))
+
+        with self._lock:
+            series = self._series.get((device_id, resolution))
+            return None if series is None else series.query(start, end, fields)
+
+    def flush(self):
+        ''' Save every series when a path is set
+
+        :return:
+        '''
+        if self._path is None:
+            return
+
+        with self._lock:
+            for (device_id, resolution), series in self._series.items():
+                name = '{}-{}{}'.format(device_file_name(device_id), resolution, ROLLUP_EXT)
+                series.save(os.path.join(self._path, name), device_id)
+
+    def close(self):
+        self.flush()
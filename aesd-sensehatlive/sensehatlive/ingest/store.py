@@ -0,0 +1,313 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : store.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Columnar time series store for ingested sensor messages. Each device has a directory of append
+              only chunks, a chunk holds up to chunk_rows samples as one memory mapped .npy file per column: the
+              ts column is the time index and every payload field is a float32 column aligned with it. Missing
+              values are NaN. A meta file per chunk keeps the row count and time range so range queries only
+              map the chunks they overlap and binary search the time index.
+
+              Rows become visible once append() returns, flush() makes them durable.
+
+Reference   : NumPy memmap (https://numpy.org/doc/stable/reference/generated/numpy.lib.format.open_memmap.html)
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+import threading
+import numpy as np
+import log.logger as logger
+from numpy.lib.format import open_memmap
+from messagebroker.codec import StructCodec
+
+# Payload fields stored as columns, nested fields are named "key.axis"
+FIELDS = tuple(key if axis is None else '{}.{}'.format(key, axis) for key, axis in StructCodec.FIELDS)
+TS_COLUMN = 'ts'
+META_FILE = 'meta.npy'
+DEVICE_FILE = 'device'
+
+# Meta entries
+META_ROWS = 0
+META_MIN_TS = 1
+META_MAX_TS = 2
+META_SORTED = 3
+
+DEFAULT_CHUNK_ROWS = 65536
+
+
+def _column_file(name):
+    return name + '.npy'
+
+
+def device_file_name(device_id):
+    ''' File name of a device, hex encoded so distinct device IDs never share a file
+
+    :param device_id: Device ID
+    '''
+    return device_id.encode().hex()
+
+
+class Chunk(object):
+    ''' Fixed capacity set of aligned column files
+
+    '''
+
+    def __init__(self, path, capacity=None):
+        ''' Open a chunk, created with capacity rows when it does not exist
+
+        :param path: Chunk directory
+        :param capacity: Rows per column for a new chunk
+        '''
+        self.path = path
+        if capacity is not None and not os.path.exists(os.path.join(path, META_FILE)):
+            os.makedirs(path, exist_ok=True)
+            open_memmap(os.path.join(path, _column_file(TS_COLUMN)), 'w+', np.int64, (capacity,)).flush()
+            for name in FIELDS:
+                column = open_memmap(os.path.join(path, _column_file(name)), 'w+', np.float32, (capacity,))
+                column[:] = np.nan
+                column.flush()
+            meta = open_memmap(os.path.join(path, META_FILE), 'w+', np.int64, (4,))
+            meta[:] = (0, 0, 0, 1)
+            meta.flush()
+
+        self.meta = open_memmap(os.path.join(path, META_FILE), 'r+')
+        self._columns = None
+
+    @property
+    def rows(self):
+        return int(self.meta[META_ROWS])
+
+    @property
+    def capacity(self):
+        return self.columns[TS_COLUMN].shape[0]
+
+    @property
+    def columns(self):
+        ''' Column name to memory mapped array, mapped on first use
+
+        '''
+        if self._columns is None:
+            self._columns = {name: open_memmap(os.path.join(self.path, _column_file(name)), 'r+')
+                             for name in (TS_COLUMN,) + FIELDS}
+        return self._columns
+
+    def overlaps(self, start, end):
+        return self.rows > 0 and self.meta[META_MIN_TS] <= end and self.meta[META_MAX_TS] >= start
+
+    def append(self, ts, values):
+        ''' Append rows, the caller makes sure they fit
+
+        :param ts: int64 array of timestamps
+        :param values: Dictionary of column name to float32 array aligned with ts
+        '''
+        rows = self.rows
+        end = rows + len(ts)
+        columns = self.columns
+        columns[TS_COLUMN][rows:end] = ts
+        for name, column in values.items():
+            columns[name][rows:end] = column
+
+        meta = self.meta
+        last = meta[META_MAX_TS] if rows else ts[0]
+        if ts[0] < last or (len(ts) > 1 and np.any(np.diff(ts) < 0)):
+            meta[META_SORTED] = 0
+        meta[META_MIN_TS] = min(meta[META_MIN_TS], ts.min()) if rows else ts.min()
+        meta[META_MAX_TS] = max(meta[META_MAX_TS], ts.max()) if rows else ts.max()
+        meta[META_ROWS] = end  # Rows are visible once the count is updated
+
+    def select(self, start, end, fields):
+        ''' Get the rows with start <= ts <= end
+
+        :param start: First timestamp
+        :param end: Last timestamp
+        :param fields: Column names
+        :return: Dictionary of column name to array view
+        '''
+        columns = self.columns
+        rows = self.rows
+        ts = columns[TS_COLUMN][:rows]
+        if self.meta[META_SORTED]:
+            index = slice(np.searchsorted(ts, start, 'left'), np.searchsorted(ts, end, 'right'))
+        else:
+            index = (ts >= start) & (ts <= end)
+
+        selected = {TS_COLUMN: ts[index]}
+        for name in fields:
+            selected[name] = columns[name][:rows][index]
+        return selected
+
+    def flush(self):
+        if self._columns is not None:
+            for column in self._columns.values():
+                column.flush()
+        self.meta.flush()
+
+
+class ColumnStore(object):
+    ''' Per device columnar store of sensor payloads
+
+    '''
+
+    def __init__(self, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+        ''' Class initialization
+
+        :param path: Store directory
+        :param chunk_rows: Rows per chunk
+        '''
+        self._path = path
+        self._chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self._devices = {}  # Device ID to list of chunks in append order
+        self._dirty = {}  # Device ID to set of chunks appended to since the last flush
+        self.rejected = 0
+
+        os.makedirs(path, exist_ok=True)
+        for name in sorted(os.listdir(path)):
+            device_dir = os.path.join(path, name)
+            if os.path.exists(os.path.join(device_dir, DEVICE_FILE)):
+                with open(os.path.join(device_dir, DEVICE_FILE)) as f:
+                    device_id = f.read()
+                self._devices[device_id] = [
+                    Chunk(os.path.join(device_dir, chunk)) for chunk in sorted(os.listdir(device_dir))
+                    if os.path.exists(os.path.join(device_dir, chunk, META_FILE))]
+        logger.info('Ingest store {} opened with {} devices'.format(path, len(self._devices)))
+
+    def _device_dir(self, device_id):
+        ''' Get the directory of a device, created with a file holding the device ID
+
+        :param device_id: Device ID
+        '''
+        path = os.path.join(self._path, device_file_name(device_id))
+        if not os.path.exists(os.path.join(path, DEVICE_FILE)):
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, DEVICE_FILE), 'w') as f:
+                f.write(device_id)
+        return path
+
+    def devices(self):
+        return list(self._devices)
+
+    def on_message(self, message):
+        ''' Consumer callback, takes a decoded payload or batch or JSON text
+
+        :param message: Message from the consumer
+        :return:
+        '''
+        self.append(message_payloads(message))
+
+    def append(self, payloads):
+        ''' Append payloads, columns are built for each device in one pass
+
+        :param payloads: List of payload dicts
+        :return:
+        '''
+        columns, rejected = device_columns(payloads)
+        with self._lock:
+            self.rejected += rejected
+            for device_id, (ts, values) in columns.items():
+                self._append_device(device_id, ts, values)
+
+    def _append_device(self, device_id, ts, values):
+        chunks = self._devices.setdefault(device_id, [])
+        dirty = self._dirty.setdefault(device_id, set())
+        offset = 0
+        while offset < len(ts):
+            if not chunks or chunks[-1].rows == chunks[-1].capacity:
+                chunk_dir = os.path.join(self._device_dir(device_id), '{:08d}'.format(len(chunks)))
+                chunks.append(Chunk(chunk_dir, self._chunk_rows))
+            chunk = chunks[-1]
+            count = min(len(ts) - offset, chunk.capacity - chunk.rows)
+            chunk.append(ts[offset:offset + count],
+                         {name: column[offset:offset + count] for name, column in values.items()})
+            dirty.add(chunk)
+            offset += count
+
+    def query(self, device_id, start, end, fields=FIELDS):
+        ''' Get a device's samples with start <= ts <= end
+
+        :param device_id: Device ID
+        :param start: First timestamp
+        :param end: Last timestamp
+        :param fields: Column names, see FIELDS
+        :return: Dictionary of 'ts' and each field to an array, in append order
+        '''
+        with self._lock:
+            parts = [chunk.select(start, end, fields) for chunk in self._devices.get(device_id, ())
+                     if chunk.overlaps(start, end)]
+
+        if not parts:
+            return {name: np.empty(0, np.int64 if name == TS_COLUMN else np.float32)
+                    for name in (TS_COLUMN,) + tuple(fields)}
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    def flush(self):
+        ''' Make appended rows durable, including rows in chunks that filled up since the last flush
+
+        :return:
+        '''
+        with self._lock:
+            for chunks in self._dirty.values():
+                for chunk in chunks:
+                    chunk.flush()
+            self._dirty.clear()
+
+    def close(self):
+        self.flush()
+
+
+def message_payloads(message):
+    ''' Get the list of payloads in a consumer message
+
+    :param message: Decoded payload or batch or JSON text
+    :return: List of payload dicts
+    '''
+    if isinstance(message, (str, bytes)):
+        message = json.loads(message)
+    return message if isinstance(message, list) else [message]
+
+
+def device_columns(payloads):
+    ''' Split payloads into columns per device
+
+    :param payloads: List of payload dicts
+    :return: Tuple of dictionary of device ID to (int64 ts array, dictionary of field to float32 array) and the
+             number of payloads without an id or ts
+    '''
+    by_device = {}
+    rejected = 0
+    for payload in payloads:
+        device_id = payload.get('id')
+        if device_id is None or payload.get('ts') is None:
+            rejected += 1
+            continue
+        by_device.setdefault(device_id, []).append(payload)
+
+    columns = {}
+    for device_id, samples in by_device.items():
+        ts = np.fromiter((p['ts'] for p in samples), np.int64, len(samples))
+        values = {name: np.fromiter((_field(p, name) for p in samples), np.float32, len(samples))
+                  for name in FIELDS}
+        columns[device_id] = (ts, values)
+    return columns, rejected
+
+
+def _field(payload, name):
+    ''' Get a column value from a payload, NaN when missing
+
+    '''
+    key, _, axis = name.partition('.')
+    val = payload.get(key)
+    if axis and val is not None:
+        val = val.get(axis)
+    return np.nan if val is None else val
@@ -18,15 +18,19 @@ A PARTICULAR PURPOSE.
 
 import os
 import sys
+import atexit
 import multiprocessing
 import contextlib
 import threading
 import traceback
 import logging
 import errno
+import time
 
 from logging import handlers
+from queue import Queue, Full
 from logutils.queue import QueueHandler, QueueListener
+from .rotating import BufferedRotatingFileHandler
 
 # These settings are for file log only
 FILENAME = "sensehatlive.log"
@@ -39,6 +43,17 @@ logger = logging.getLogger("SenseHatLive")
 # Global queue for multiprocessing log
 queue = None
 
+# Async log listener, when enabled
+async_listener = None
+ASYNC_QUEUE_SIZE = 10000
+ERROR_PUT_TIMEOUT = 0.5  # Seconds an error waits for room in a full queue
+
+# Log rate limiter, when enabled
+rate_limiter = None
+
+# Records allowed per log statement in each rate limit interval
+RATE_LIMIT_BURST = 5
+
 
 class LogListHandler(logging.Handler):
     """
@@ -52,6 +67,154 @@ class LogListHandler(logging.Handler):
         # hmi.LOG_LIST.insert(0, (helpers.now(), message, record.levelname, record.threadName))
 
 
+class RateLimitFilter(logging.Filter):
+    """
+    Rate limits each log statement, keyed by its file and line since the
+    messages are formatted by the caller. Up to burst records pass per
+    interval, the rest are suppressed and counted. The first record of the
+    next interval carries the number suppressed. Once started, a background
+    thread logs the count of statements that stopped logging after their
+    interval ended. Errors always pass.
+    """
+
+    def __init__(self, interval, burst=RATE_LIMIT_BURST, exempt_level=logging.ERROR):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.burst = burst
+        self.exempt_level = exempt_level
+        self.suppressed = 0
+        self._sites = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level:
+            return True
+
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is not None and record.created - site[0] < self.interval:
+                site[1] += 1
+                if site[1] <= self.burst:
+                    return True
+                site[2] += 1
+                site[3] = record
+                self.suppressed += 1
+                return False
+
+            # New interval: [start, records, suppressed, last suppressed record]
+            self._sites[key] = [record.created, 1, 0, None]
+            suppressed = site[2] if site is not None else 0
+
+        if suppressed:
+            self._summarize(record, suppressed)
+        return True
+
+    @staticmethod
+    def _summarize(record, suppressed):
+        record.msg = "{} ({} similar messages suppressed)".format(record.getMessage(), suppressed)
+        record.args = None
+
+    def flush(self, all_sites=False):
+        """
+        Log the last suppressed record with the suppressed count of every
+        statement whose interval ended, or of every statement with all_sites.
+        """
+
+        now = time.time()
+        records = []
+        with self._lock:
+            for key, site in list(self._sites.items()):
+                if not all_sites and now - site[0] < self.interval:
+                    continue
+                del self._sites[key]
+                if site[2]:
+                    records.append((site[3], site[2]))
+
+        for record, suppressed in records:
+            self._summarize(record, suppressed)
+            logger.callHandlers(record)
+
+    def start(self):
+        """
+        Start flushing every interval from a background thread.
+        """
+
+        self._thread = threading.Thread(target=self._run, name='logger')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """
+        Stop the background thread and log every pending count.
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush(all_sites=True)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Queue handler for async log. Records are queued as is, so formatting and
+    I/O happen on the listener thread. When the queue is full the record is
+    dropped and counted instead of blocking the caller, errors wait up to
+    ERROR_PUT_TIMEOUT for room first.
+    """
+
+    def __init__(self, queue):
+        QueueHandler.__init__(self, queue)
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            if record.levelno >= logging.ERROR:
+                self.queue.put(record, timeout=ERROR_PUT_TIMEOUT)
+            else:
+                self.queue.put_nowait(record)
+        except Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+
+class AsyncListener(QueueListener):
+    """
+    Listener for async log. Logs how many records were dropped since the
+    last record it handled.
+    """
+
+    def __init__(self, queue_handler, *handlers):
+        QueueListener.__init__(self, queue_handler.queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self._reported = 0
+
+    def handle(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped != self._reported:
+            message = "Log queue full, dropped {} records".format(dropped - self._reported)
+            self._reported = dropped
+            QueueListener.handle(self, logging.makeLogRecord({
+                'name': logger.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': message, 'threadName': 'logger'}))
+        QueueListener.handle(self, record)
+
+    def enqueue_sentinel(self):
+        # Wait for room, records already queued are handled before stopping
+        self.queue.put(self._sentinel)
+
+
 @contextlib.contextmanager
 def listener():
     """
@@ -112,7 +275,27 @@ def initMultiprocessing():
     threading.current_thread().name = multiprocessing.current_process().name
 
 
-def initLogger(console=False, log_dir=False, verbose=False):
+def stopLogger():
+    """
+    Log pending rate limit counts and stop the async log listener after it
+    handled every queued record.
+    """
+
+    global async_listener, rate_limiter
+
+    if rate_limiter is not None:
+        rate_limiter.close()
+        rate_limiter = None
+
+    if async_listener is not None:
+        async_listener.stop()
+        for handler in async_listener.handlers:
+            handler.close()
+        async_listener = None
+
+
+def initLogger(console=False, log_dir=False, verbose=False, async_queue=0, rate_limit=0, buffered=False,
+               staging_dir=None):
     """
     Setup log It uses the logger instance with the name
     'MonitorMaster'. Three log handlers are added:
@@ -121,19 +304,37 @@ def initLogger(console=False, log_dir=False, verbose=False):
     * StreamHandler: for console (if console)
     Console log is only enabled if console is set to True. This method can
     be invoked multiple times, during different stages of MonitorMaster.
+    With async_queue set the handlers run on a listener thread and callers
+    only queue records, at most async_queue of them before records are
+    dropped. With rate_limit set each log statement logs at most
+    RATE_LIMIT_BURST records per rate_limit seconds. With buffered or
+    staging_dir set the file log is written in batches and rotated files
+    are compressed, see BufferedRotatingFileHandler.
     """
 
+    global async_listener, rate_limiter
+
+    # Handle queued records with the old handlers before replacing them
+    stopLogger()
+
     # Close and remove old handlers. This is required to reinit the loggers
     # at runtime
     for handler in logger.handlers[:]:
         # Just make sure it is cleaned up.
-        if isinstance(handler, handlers.RotatingFileHandler):
+        if isinstance(handler, (handlers.RotatingFileHandler, BufferedRotatingFileHandler, QueueHandler)):
             handler.close()
         elif isinstance(handler, logging.StreamHandler):
             handler.flush()
 
         logger.removeHandler(handler)
 
+    for log_filter in logger.filters[:]:
+        logger.removeFilter(log_filter)
+
+    if rate_limit:
+        rate_limiter = RateLimitFilter(rate_limit)
+        logger.addFilter(rate_limiter)
+
     # Configure the logger to accept all messages
     logger.propagate = False
     logger.setLevel(logging.DEBUG if verbose else logging.INFO)
@@ -142,7 +343,7 @@ def initLogger(console=False, log_dir=False, verbose=False):
     loglist_handler = LogListHandler()
     loglist_handler.setLevel(logging.DEBUG)
 
-    logger.addHandler(loglist_handler)
+    log_handlers = [loglist_handler]
 
     # Setup file logger
     if log_dir:
@@ -150,12 +351,16 @@ def initLogger(console=False, log_dir=False, verbose=False):
 
         file_formatter = logging.Formatter(
             '%(asctime)s - %(levelname)s :: %(threadName)s :: %(message)s', '%Y%m%d-%H:%M:%S')
-        file_handler = handlers.RotatingFileHandler(filename, maxBytes=MAX_SIZE,
-                                                    backupCount=MAX_FILES)
+        if buffered or staging_dir:
+            file_handler = BufferedRotatingFileHandler(filename, maxBytes=MAX_SIZE, backupCount=MAX_FILES,
+                                                       stagingDir=staging_dir)
+        else:
+            file_handler = handlers.RotatingFileHandler(filename, maxBytes=MAX_SIZE,
+                                                        backupCount=MAX_FILES)
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(file_formatter)
 
-        logger.addHandler(file_handler)
+        log_handlers.append(file_handler)
 
     # Setup console logger
     if console:
@@ -165,12 +370,31 @@ def initLogger(console=False, log_dir=False, verbose=False):
         console_handler.setFormatter(console_formatter)
         console_handler.setLevel(logging.DEBUG)
 
-        logger.addHandler(console_handler)
+        log_handlers.append(console_handler)
+
+    if async_queue:
+        # Callers only queue records, one listener thread formats and writes them
+        queue_handler = BoundedQueueHandler(Queue(async_queue))
+        queue_handler.setLevel(logging.DEBUG)
+        logger.addHandler(queue_handler)
+
+        async_listener = AsyncListener(queue_handler, *log_handlers)
+        async_listener.start()
+    else:
+        for handler in log_handlers:
+            logger.addHandler(handler)
+
+    if rate_limiter is not None:
+        rate_limiter.start()
 
     # Install exception hooks
     initHooks()
 
 
+# Queued records are written before exit
+atexit.register(stopLogger)
+
+
 def initHooks(global_exceptions=True, thread_exceptions=True, pass_original=True):
     """
     This method installs exception catching mechanisms. Any exception caught
@@ -219,6 +443,13 @@ def initHooks(global_exceptions=True, thread_exceptions=True, pass_original=True
         threading.Thread.__init__ = new_init
 
 
+def isDebug():
+    """
+    Check if debug messages are logged, so hot paths can skip formatting them.
+    """
+    return logger.isEnabledFor(logging.DEBUG)
+
+
 # Expose logger methods
 info = logger.info
 warn = logger.warning
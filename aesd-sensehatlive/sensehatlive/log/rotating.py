@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Flash friendly rotating log file. Records are buffered in memory and
+    written by a background thread when the buffer is full, a record at or
+    above the flush level arrives or the flush interval passes. Rotated
+    segments are gzip compressed by the same thread. The active file can be
+    kept in a staging directory on tmpfs so only compressed segments are
+    written to flash.
+
+@Reference
+    Python logging handlers (https://docs.python.org/3/library/logging.handlers.html)
+
+"""
+
+import os
+import gzip
+import shutil
+import logging
+import threading
+
+BUFFER_BYTES = 64 * 1024
+FLUSH_INTERVAL = 5.0
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """
+    Rotating file handler that writes in batches and compresses rotated
+    segments in the background.
+    """
+
+    def __init__(self, filename, maxBytes, backupCount, bufferBytes=BUFFER_BYTES, flushInterval=FLUSH_INTERVAL,
+                 flushLevel=logging.WARNING, compress=True, stagingDir=None):
+        """
+        Rotated segments are named filename.1 to filename.backupCount, with
+        a .gz suffix when compressed. With stagingDir the active file is
+        stagingDir/basename and only rotated segments are stored next to
+        filename. The active file is rotated on close so a clean shutdown
+        keeps it.
+        """
+        logging.Handler.__init__(self)
+        self.baseFilename = os.path.abspath(filename)
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.bufferBytes = bufferBytes
+        self.flushInterval = flushInterval
+        self.flushLevel = flushLevel
+        self.compress = compress
+        self.stagingDir = stagingDir
+
+        if stagingDir:
+            os.makedirs(stagingDir, exist_ok=True)
+            self.activeFilename = os.path.join(stagingDir, os.path.basename(self.baseFilename))
+        else:
+            self.activeFilename = self.baseFilename
+
+        self._buffer = []
+        self._buffered = 0
+        self._closed = False
+        self._pid = os.getpid()
+        self._buffer_lock = threading.Lock()  # Not the handler lock, close() joins the writer while holding it
+        self._io_lock = threading.Lock()
+        self._stream = open(self.activeFilename, 'ab')
+        self._size = self._stream.tell()
+
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._buffer_lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            full = self._buffered >= self.bufferBytes
+        if full or record.levelno >= self.flushLevel:
+            self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flushInterval)
+            self._wake.clear()
+            self._write()
+
+    def _write(self):
+        """
+        Write buffered records and rotate when the file is full.
+        """
+        with self._buffer_lock:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+
+        with self._io_lock:
+            if not data or self._stream is None:
+                return
+            self._stream.write(data)
+            self._stream.flush()
+            self._size += len(data)
+            if self._size >= self.maxBytes:
+                self._rotate()
+
+    def _backup_name(self, index):
+        name = '{}.{}'.format(self.baseFilename, index)
+        return name + '.gz' if self.compress else name
+
+    def _rotate(self):
+        """
+        Move the active file to the first backup, compressing it on the way.
+        """
+        self._stream.close()
+        self._stream = None
+
+        if self.backupCount > 0:
+            for i in range(self.backupCount - 1, 0, -1):
+                if os.path.exists(self._backup_name(i)):
+                    os.replace(self._backup_name(i), self._backup_name(i + 1))
+
+            target = self._backup_name(1)
+            if self.compress:
+                with open(self.activeFilename, 'rb') as src, gzip.open(target + '.tmp', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(target + '.tmp', target)
+                os.remove(self.activeFilename)
+            else:
+                shutil.move(self.activeFilename, target)
+        else:
+            os.remove(self.activeFilename)
+
+        self._stream = open(self.activeFilename, 'ab')
+        self._size = 0
+
+    def flush(self):
+        """
+        Write buffered records now.
+        """
+        self._write()
+
+    def close(self):
+        """
+        Write buffered records, stop the writer and keep a staged file. A
+        forked process only writes the records it inherited, the staged file
+        is rotated by the process that opened it.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._write()
+
+        with self._io_lock:
+            if self._stream is not None:
+                if self.stagingDir and self._size > 0 and os.getpid() == self._pid:
+                    self._rotate()
+                self._stream.close()
+                self._stream = None
+
+        logging.Handler.close(self)
@@ -0,0 +1,296 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : aio.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Asyncio RabbitMQ consumer and producer. The connection runs on an existing event loop through the
+              pika asyncio adapter so the sampler, the broker and other local services share one thread. The
+              publish, is_ready and stop surface matches the threaded classes, serve() replaces run().
+
+Reference   : Pika asyncio adapter (https://pika.readthedocs.io/en/stable/modules/adapters/asyncio.html)
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import asyncio
+import log.logger as logger
+from pika.adapters.asyncio_connection import AsyncioConnection
+from messagebroker.rabbitmq import RabbitMQConsumer, RabbitMQProducer, DEFAULT_RETRY_TIMEOUT_SEC
+
+
+def _on_loop(loop):
+    ''' Check if the caller is running on the event loop
+
+    :param loop: Event loop
+    :return:
+    '''
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+class AsyncioBrokerMixin(object):
+    ''' Replaces the SelectConnection ioloop and its reconnect thread with the asyncio event loop
+
+    '''
+
+    def _init_event_loop(self, loop):
+        ''' Initialize event loop state
+
+        :param loop: Event loop, the running loop is used by serve() when None
+        '''
+        self._loop = loop
+        self._waiter = None  # Resolved when the connection closes or stop() is called
+
+    def connect(self):
+        ''' Establish connection with the RabbitMQ server on the event loop
+
+        :return:
+        '''
+        parameters = self.connection_parameters()
+        logger.info('Connecting to {}:{} ...'.format(parameters.host, parameters._port))
+        return AsyncioConnection(parameters,
+                                 on_open_callback=self.on_connection_open,
+                                 on_open_error_callback=self.on_connection_open_error,
+                                 on_close_callback=self.on_connection_closed,
+                                 custom_ioloop=self._loop)
+
+    def on_connection_open_error(self, connection, err):
+        '''
+
+        :param connection: The connection
+        :param err: Error reason
+        :return:
+        '''
+        logger.error('Failed to open connection. Reason={}'.format(err))
+        self._wake()
+
+    def on_connection_closed(self, connection, reason):
+        ''' Callback method for connection closed, serve() reconnects unless stopped
+
+        :param connection: The connection
+        :param reason: Reason whey connection was close
+        :return:
+        '''
+        self._channel = None
+        self._ready = False
+        if not self._shutdown:
+            logger.warning('Connection closed. Reason={}'.format(reason))
+        self._wake()
+
+    def on_channel_closed(self, channel, reason):
+        ''' Callback to handle channel closed, the connection is closed with it when stopping
+
+        :param channel: The channel
+        :param reason: Reason channel was closed
+        :return:
+        '''
+        super(AsyncioBrokerMixin, self).on_channel_closed(channel, reason)
+        if self._shutdown:
+            self._close_connection()
+
+    def _close_connection(self):
+        ''' Close the connection if it is open or opening, otherwise wake serve()
+
+        :return:
+        '''
+        connection = self._connection
+        if connection is None or connection.is_closing or connection.is_closed:
+            self._wake()
+        else:
+            self.close_connection()
+
+    def _wake(self):
+        ''' Resolve the waiter of serve()
+
+        :return:
+        '''
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _call(self, callback):
+        ''' Run a callback on the event loop from any thread
+
+        :param callback: Function to call
+        :return:
+        '''
+        if self._loop is None:
+            return
+        if _on_loop(self._loop):
+            callback()
+        else:
+            self._loop.call_soon_threadsafe(callback)
+
+    def _call_threadsafe(self, callback):
+        ''' Run a callback on the event loop, safe to call from any thread
+
+        :param callback: Function to call
+        :return:
+        '''
+        self._loop.call_soon_threadsafe(callback)
+
+    def _call_later(self, delay, callback):
+        ''' Run a callback on the event loop after a delay, call from the event loop
+
+        :param delay: Seconds to wait
+        :param callback: Function to call
+        :return: Timer for _cancel_timer()
+        '''
+        return self._loop.call_later(delay, callback)
+
+    def _cancel_timer(self, timer):
+        ''' Cancel a timer of _call_later()
+
+        :param timer: Timer
+        :return:
+        '''
+        timer.cancel()
+
+    async def serve(self):
+        ''' Connect and keep reconnecting until stopped, runs on the event loop
+
+        :return:
+        '''
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+        logger.info("---- {} started on the event loop".format(type(self).__name__))
+        while not self._shutdown:
+            self._waiter = self._loop.create_future()
+            self._connection = self.connect()
+            await self._waiter
+
+            if not self._shutdown:
+                logger.warning('Reconnecting in {}s ...'.format(DEFAULT_RETRY_TIMEOUT_SEC))
+                self._waiter = self._loop.create_future()
+                self._loop.call_later(DEFAULT_RETRY_TIMEOUT_SEC, self._wake)
+                await self._waiter
+
+        self.on_serve_done()
+        logger.info("[z] {} stopped".format(type(self).__name__))
+
+    def on_serve_done(self):
+        ''' Called when serve() returns
+
+        :return:
+        '''
+        pass
+
+    def run(self):
+        ''' Override for threading start(), serves on a new event loop owned by the thread
+
+        :return:
+        '''
+        asyncio.run(self.serve())
+
+
+class AsyncRabbitMQConsumer(AsyncioBrokerMixin, RabbitMQConsumer):
+    ''' RabbitMQ consumer on an asyncio event loop
+
+    '''
+
+    def __init__(self, queue, on_msg_callback, path=None, loop=None, **kwargs):
+        ''' Class initialization
+
+        :param queue: Name of queue
+        :param on_msg_callback: Callback for new messages, called on the event loop
+        :param path: Path to credentials file
+        :param loop: Event loop, the running loop is used by serve() when None
+        '''
+        super(AsyncRabbitMQConsumer, self).__init__(queue, on_msg_callback, path, **kwargs)
+        self._init_event_loop(loop)
+
+    def stop(self):
+        ''' Stop consuming and close the connection, safe to call from any thread
+
+        :return:
+        '''
+        if self._closing:
+            return
+
+        logger.info('Stopping consumer ...')
+        self._shutdown = True
+        self._closing = True
+        self._call(self._stop_on_loop)
+
+    def on_serve_done(self):
+        if self._pool is not None:
+            self._pool.close()
+
+    def _stop_on_loop(self):
+        if self._consuming:
+            self.stop_consuming()  # The channel and connection close once the cancel is confirmed
+        else:
+            self._close_connection()
+
+
+class AsyncRabbitMQProducer(AsyncioBrokerMixin, RabbitMQProducer):
+    ''' RabbitMQ producer on an asyncio event loop. Samples published from the event loop are drained by a
+    callback on the same loop without a thread hop.
+
+    '''
+
+    def __init__(self, queue, path=None, loop=None, **kwargs):
+        ''' Class initialization
+
+        :param queue: Name of queue
+        :param path: Path to credentials file
+        :param loop: Event loop, the running loop is used by serve() when None
+        :param kwargs: See RabbitMQProducer
+        '''
+        super(AsyncRabbitMQProducer, self).__init__(queue, path, **kwargs)
+        self._init_event_loop(loop)
+
+    def _wake_ioloop(self):
+        ''' Schedule a drain of the queue on the event loop, at most one is scheduled at a time
+
+        :return:
+        '''
+        if self._drain_scheduled or self._loop is None:
+            return
+
+        self._drain_scheduled = True
+        if _on_loop(self._loop):
+            self._loop.call_soon(self._drain_pending)
+        else:
+            self._loop.call_soon_threadsafe(self._drain_pending)
+
+    def stop(self):
+        ''' Publish what is pending and close the connection, safe to call from any thread
+
+        :return:
+        '''
+        logger.info("Stopping producer ...")
+        self._shutdown = True
+        self._call(self._stop_on_loop)
+
+    def _stop_on_loop(self):
+        if self._ready:
+            self._close_on_ioloop()
+        else:
+            with self._lock:
+                self._drain_pending(limit=None)
+                self._flush(False)
+            self._close_connection()
+
+    def _close_on_ioloop(self):
+        ''' Publish pending samples and close the channel, the connection follows
+
+        :return:
+        '''
+        self._drain_pending(limit=None)
+        with self._lock:
+            self._flush(True)
+        self.close_channel()
+
+    def on_serve_done(self):
+        if self._outbox is not None:
+            with self._lock:
+                self._outbox.close()
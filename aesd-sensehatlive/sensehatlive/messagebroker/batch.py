@@ -0,0 +1,89 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : batch.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Accumulates encoded samples so several can be published as one message
+
+Reference   : None
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import time
+from messagebroker.codec import JsonCodec
+
+# Defaults
+DEFAULT_BATCH_BYTES = 64 * 1024
+DEFAULT_BATCH_AGE_SEC = 30
+
+
+class SampleBatch(object):
+    ''' Batch of encoded samples bounded by count, size and age
+
+    '''
+
+    def __init__(self, max_samples, max_bytes=DEFAULT_BATCH_BYTES, max_age=DEFAULT_BATCH_AGE_SEC,
+                 codec=JsonCodec(), clock=time.monotonic):
+        ''' Class initialization
+
+        :param max_samples: Maximum number of samples per message
+        :param max_bytes: Maximum encoded message size in bytes
+        :param max_age: Maximum seconds the oldest sample may wait
+        :param codec: Payload codec used to combine samples
+        :param clock: Monotonic clock function returning seconds
+        '''
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._codec = codec
+        self._clock = clock
+        self._samples = []
+        self._size = codec.overhead
+        self._started = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def fits(self, encoded):
+        ''' Check if an encoded sample can be added without exceeding the size limit
+
+        :param encoded: Encoded sample
+        '''
+        return not self._samples or self._size + self._codec.size(encoded) + self._codec.separator <= self.max_bytes
+
+    def add(self, encoded):
+        ''' Add an encoded sample
+
+        :param encoded: Encoded sample
+        :return: True when the batch is due to be sent
+        '''
+        if not self._samples:
+            self._started = self._clock()
+        else:
+            self._size += self._codec.separator
+        self._samples.append(encoded)
+        self._size += self._codec.size(encoded)
+        return self.is_due()
+
+    def is_due(self):
+        ''' Check if the batch reached its count, size or age limit
+
+        '''
+        if not self._samples:
+            return False
+        return (len(self._samples) >= self.max_samples or self._size >= self.max_bytes or
+                self._clock() - self._started >= self.max_age)
+
+    def drain(self):
+        ''' Remove all samples as one message body
+
+        :return: Tuple of message body and number of samples
+        '''
+        body = self._codec.pack(self._samples, True)
+        count = len(self._samples)
+        self._samples = []
+        self._size = self._codec.overhead
+        self._started = None
+        return body, count
@@ -0,0 +1,274 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : codec.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Payload encodings. The encoding of a message is named by its AMQP content type so the consumer
+              can pick the matching decoder.
+
+Reference   : Python struct (https://docs.python.org/3/library/struct.html)
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import json
+import math
+import struct
+from messagebroker.gorilla import RowEncoder, iter_rows
+
+# Registered codecs by name and content type
+CODECS = {}
+CONTENT_TYPES = {}
+
+
+def register_codec(cls):
+    ''' Class decorator to register a codec
+
+    :param cls: Codec class
+    '''
+    codec = cls()
+    CODECS[codec.name] = codec
+    CONTENT_TYPES[codec.content_type] = codec
+    return cls
+
+
+def get_codec(name):
+    ''' Get a codec by name
+
+    :param name: Codec name
+    '''
+    codec = CODECS.get(name)
+    if codec is None:
+        raise Exception("Unknown payload encoding {}, expected one of {}".format(name, ', '.join(CODECS)))
+    return codec
+
+
+def get_codec_for(content_type):
+    ''' Get the codec for a content type, messages without one are JSON
+
+    :param content_type: AMQP content type
+    '''
+    codec = CONTENT_TYPES.get(content_type or JsonCodec.content_type)
+    if codec is None:
+        raise Exception("Unknown content type {}".format(content_type))
+    return codec
+
+
+def decode_message(content_type, body, decode_payload=True):
+    ''' Decode a message body using the codec named by its content type
+
+    :param content_type: AMQP content type
+    :param body: Message body
+    :param decode_payload: Return the decoded payload, otherwise JSON text whatever the encoding
+    :return: JSON text or decoded payload
+    '''
+    codec = get_codec_for(content_type)
+    if not decode_payload:
+        if codec.name == 'json':
+            return body.decode()
+        return json.dumps(codec.decode(body))
+    return codec.decode(body)
+
+
+@register_codec
+class JsonCodec(object):
+    ''' JSON text encoding, a batch is a JSON array
+
+    '''
+    name = 'json'
+    content_type = 'application/json'
+    fixed_layout = False  # Every payload field is sent
+    overhead = 2     # Batch brackets
+    separator = 1    # Comma between batched samples
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def size(self, encoded):
+        ''' Number of bytes an encoded sample adds to a message
+
+        :param encoded: Encoded sample
+        '''
+        return len(encoded)
+
+    def pack(self, encoded, batch):
+        ''' Combine encoded samples into a message body
+
+        :param encoded: List of encoded samples
+        :param batch: Body is a batch even with a single sample
+        '''
+        if not batch:
+            return encoded[0]
+        return '[' + ','.join(encoded) + ']'
+
+    def decode(self, body):
+        ''' Decode a message body
+
+        :param body: Message body
+        :return: Payload dict or list of payloads for a batch
+        '''
+        return json.loads(body)
+
+
+@register_codec
+class StructCodec(object):
+    ''' Fixed little endian layout. The header is <version:u8><flags:u8><count:u16> followed by count
+    records of <mac:6s><ts:u32> and one float32 per field. Missing fields are sent as NaN and decoded as
+    None, fields not in the layout are not sent. Decoded values are rounded to float32 precision.
+
+    '''
+    name = 'struct'
+    version = 1
+    content_type = 'application/vnd.sensehatlive.struct'
+    fixed_layout = True
+    FLAG_BATCH = 0x01
+    FIELDS = (('temperature', None), ('humidity', None), ('pressure', None), ('compass', None),
+              ('orientation', 'pitch'), ('orientation', 'roll'), ('orientation', 'yaw'),
+              ('acceleration', 'pitch'), ('acceleration', 'roll'), ('acceleration', 'yaw'))
+    HEADER = struct.Struct('<BBH')
+    RECORD = struct.Struct('<6sI' + 'f' * len(FIELDS))
+    overhead = HEADER.size
+    separator = 0
+
+    def encode(self, payload):
+        values = []
+        for key, axis in self.FIELDS:
+            val = payload.get(key)
+            if axis is not None and val is not None:
+                val = val.get(axis)
+            values.append(float('nan') if val is None else val)
+        mac = bytes.fromhex(payload.get('id', '00:00:00:00:00:00').replace(':', ''))
+        return self.RECORD.pack(mac, payload.get('ts', 0), *values)
+
+    def size(self, encoded):
+        return len(encoded)
+
+    def pack(self, encoded, batch):
+        flags = self.FLAG_BATCH if batch else 0
+        return self.HEADER.pack(self.version, flags, len(encoded)) + b''.join(encoded)
+
+    def decode(self, body):
+        version, flags, count = self.HEADER.unpack_from(body)
+        if version != self.version:
+            raise Exception("Unsupported struct payload version {}".format(version))
+
+        payloads = []
+        for record in self.RECORD.iter_unpack(body[self.HEADER.size:self.HEADER.size + count * self.RECORD.size]):
+            mac, ts = record[0], record[1]
+            payload = {'id': ':'.join('{:02x}'.format(b) for b in mac), 'ts': ts}
+            for (key, axis), val in zip(self.FIELDS, record[2:]):
+                val = None if math.isnan(val) else float('{:.6g}'.format(val))
+                if axis is None:
+                    payload[key] = val
+                else:
+                    payload.setdefault(key, {})[axis] = val
+            payloads.append(payload)
+
+        return payloads if flags & self.FLAG_BATCH else payloads[0]
+
+
+
+@register_codec
+class GorillaCodec(object):
+    ''' Time series compression for batches from one device. The header is
+    <version:u8><flags:u8><count:u16><id length:u8><id> then <columns:u8> and per column
+    <int flag:u8><name length:u8><name>, followed by the gorilla bit stream of the rows. Nested payload
+    fields are flattened into columns named "key.axis". Missing values are sent as NaN and decoded as None.
+
+    '''
+    name = 'gorilla'
+    version = 1
+    content_type = 'application/vnd.sensehatlive.gorilla'
+    fixed_layout = False
+    FLAG_BATCH = 0x01
+    FLAG_INT = 0x01
+    HEADER = struct.Struct('<BBH')
+    overhead = HEADER.size + 256  # Header with device id and column names
+    separator = 0
+    VALUE_BYTES = 10              # Worst case bytes per value for the size limit
+
+    def encode(self, payload):
+        return payload.get('id', ''), payload.get('ts', 0), list(self._flatten(payload, ''))
+
+    def size(self, encoded):
+        return self.VALUE_BYTES * (len(encoded[2]) + 1)
+
+    def _flatten(self, payload, prefix):
+        for key, val in payload.items():
+            if not prefix and key in ('id', 'ts'):
+                continue
+            if isinstance(val, dict):
+                for item in self._flatten(val, prefix + key + '.'):
+                    yield item
+            else:
+                yield prefix + key, val
+
+    def pack(self, encoded, batch):
+        device_id = encoded[0][0].encode()
+
+        # Columns in order of first appearance across the batch
+        columns = {}
+        for _, _, fields in encoded:
+            for name, val in fields:
+                is_int = columns.get(name, True)
+                columns[name] = is_int and (val is None or (isinstance(val, int) and not isinstance(val, bool)))
+
+        header = bytearray(self.HEADER.pack(self.version, self.FLAG_BATCH if batch else 0, len(encoded)))
+        header.append(len(device_id))
+        header += device_id
+        header.append(len(columns))
+        for name, is_int in columns.items():
+            header.append(self.FLAG_INT if is_int else 0)
+            header.append(len(name))
+            header += name.encode()
+
+        index = {name: i for i, name in enumerate(columns)}
+        encoder = RowEncoder(len(columns))
+        nan = float('nan')
+        for _, ts, fields in encoded:
+            values = [nan] * len(columns)
+            for name, val in fields:
+                if val is not None:
+                    values[index[name]] = float(val)
+            encoder.append(ts, values)
+
+        return bytes(header) + encoder.getvalue()
+
+    def iter_payloads(self, body):
+        ''' Stream payloads out of a message body
+
+        :param body: Message body
+        :return: Generator of payload dicts
+        '''
+        version, flags, count = self.HEADER.unpack_from(body)
+        if version != self.version:
+            raise Exception("Unsupported gorilla payload version {}".format(version))
+
+        pos = self.HEADER.size
+        device_id = body[pos + 1:pos + 1 + body[pos]].decode()
+        pos += 1 + body[pos]
+
+        columns = []
+        for _ in range(body[pos]):
+            pos += 1
+            is_int = body[pos] & self.FLAG_INT
+            name = body[pos + 2:pos + 2 + body[pos + 1]].decode()
+            pos += 1 + body[pos + 1]
+            columns.append((name.split('.'), is_int))
+        pos += 1
+
+        for ts, values in iter_rows(body, len(columns), count, pos):
+            payload = {'id': device_id, 'ts': ts}
+            for (path, is_int), val in zip(columns, values):
+                val = None if math.isnan(val) else (int(val) if is_int else val)
+                target = payload
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = val
+            yield payload
+
+    def decode(self, body):
+        flags = self.HEADER.unpack_from(body)[1]
+        payloads = list(self.iter_payloads(body))
+        return payloads if flags & self.FLAG_BATCH else payloads[0]
@@ -0,0 +1,134 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : confirms.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Publisher confirm tracking. Unconfirmed messages are kept by delivery tag so they can be
+              published again after a nack or a lost connection, and publish to confirm latency is recorded.
+
+Reference   : RabbitMQ publisher confirms (https://www.rabbitmq.com/confirms.html)
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import bisect
+import collections
+
+# Latency histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class Delivery(object):
+    ''' A published message waiting for its confirm
+
+    '''
+    __slots__ = ('body', 'properties', 'position', 'sent', 'attempts', 'confirmed')
+
+    def __init__(self, body, properties, position=None):
+        ''' Class initialization
+
+        :param body: Message body
+        :param properties: Message properties
+        :param position: Outbox position when the message came from the outbox
+        '''
+        self.body = body
+        self.properties = properties
+        self.position = position
+        self.sent = None
+        self.attempts = 0
+        self.confirmed = False
+
+
+class InflightTable(object):
+    ''' Unconfirmed deliveries in delivery tag order
+
+    '''
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, delivery_tag, delivery):
+        ''' Track a published delivery, tags must increase
+
+        :param delivery_tag: Channel delivery tag
+        :param delivery: Delivery
+        '''
+        self._entries[delivery_tag] = delivery
+
+    def confirm(self, delivery_tag, multiple):
+        ''' Remove confirmed deliveries, a multiple confirm only visits the k entries it covers
+
+        :param delivery_tag: Confirmed delivery tag
+        :param multiple: Confirm covers every tag up to delivery_tag
+        :return: List of deliveries
+        '''
+        entries = self._entries
+        if not multiple:
+            delivery = entries.pop(delivery_tag, None)
+            return [] if delivery is None else [delivery]
+
+        confirmed = []
+        while entries:
+            tag = next(iter(entries))
+            if tag > delivery_tag:
+                break
+            confirmed.append(entries.popitem(last=False)[1])
+        return confirmed
+
+    def clear(self):
+        ''' Remove every delivery, used when the channel is lost
+
+        :return: List of deliveries in publish order
+        '''
+        deliveries = list(self._entries.values())
+        self._entries.clear()
+        return deliveries
+
+
+class LatencyHistogram(object):
+    ''' Fixed bucket histogram of latencies in seconds
+
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        ''' Class initialization
+
+        :param buckets: Sorted bucket upper bounds, one overflow bucket is added
+        '''
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        ''' Record a latency
+
+        :param value: Latency in seconds
+        '''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, pct):
+        ''' Estimate a percentile as the upper bound of the bucket it falls in
+
+        :param pct: Percentile 0 - 100
+        :return: Latency in seconds, None when empty, infinity when in the overflow bucket
+        '''
+        if self.count == 0:
+            return None
+
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def mean(self):
+        return self.total / self.count if self.count else None
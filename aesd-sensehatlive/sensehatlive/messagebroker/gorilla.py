@@ -0,0 +1,277 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : gorilla.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Gorilla style time series compression for sample batches. Timestamps are stored as delta of
+              deltas and every column as the XOR of its value with the previous one. Rows are interleaved in
+              one bit stream so samples can be decoded one at a time as the stream is read.
+
+Reference   : Pelkonen et al., Gorilla: A Fast, Scalable, In-Memory Time Series Database, VLDB 2015
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import struct
+
+# Delta of delta buckets as (control bits, control length, two's complement value bits)
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+DOD_LARGE = (0b1111, 4, 32)
+
+FLOAT = struct.Struct('>d')
+
+
+def float_to_bits(val):
+    return int.from_bytes(FLOAT.pack(val), 'big')
+
+
+def bits_to_float(bits):
+    return FLOAT.unpack(bits.to_bytes(8, 'big'))[0]
+
+
+class BitWriter(object):
+    ''' Writes values MSB first into a byte array
+
+    '''
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, nbits):
+        ''' Write the low nbits of value
+
+        :param value: Unsigned value
+        :param nbits: Number of bits
+        '''
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._bits += nbits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._buf.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def __len__(self):
+        ''' Number of bytes including a partial byte
+
+        '''
+        return len(self._buf) + (1 if self._bits else 0)
+
+    def getvalue(self):
+        ''' Get the written bytes, the last byte is zero padded
+
+        '''
+        if self._bits:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self._buf)
+
+
+class BitReader(object):
+    ''' Reads values MSB first from bytes
+
+    '''
+
+    def __init__(self, data, offset=0):
+        self._data = data
+        self._pos = offset
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, nbits):
+        ''' Read nbits as an unsigned value
+
+        :param nbits: Number of bits
+        '''
+        while self._bits < nbits:
+            if self._pos >= len(self._data):
+                raise EOFError("Bit stream ended")
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._bits += 8
+        self._bits -= nbits
+        value = self._acc >> self._bits
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+
+class TimestampEncoder(object):
+    ''' Delta of delta timestamp compression
+
+    '''
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._prev = None
+        self._delta = 0
+
+    def append(self, ts):
+        w = self._writer
+        if self._prev is None:
+            w.write(ts, 64)
+            self._prev = ts
+            return
+
+        delta = ts - self._prev
+        dod = delta - self._delta
+        self._prev, self._delta = ts, delta
+        if dod == 0:
+            w.write(0, 1)
+            return
+
+        for control, clen, vbits in DOD_BUCKETS:
+            if -(1 << (vbits - 1)) <= dod < (1 << (vbits - 1)):
+                break
+        else:
+            control, clen, vbits = DOD_LARGE
+            if not -(1 << (vbits - 1)) <= dod < (1 << (vbits - 1)):
+                raise ValueError("Timestamp delta of delta {} out of range".format(dod))
+        w.write(control, clen)
+        w.write(dod, vbits)
+
+
+class TimestampDecoder(object):
+    ''' Delta of delta timestamp decompression
+
+    '''
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._prev = None
+        self._delta = 0
+
+    def next(self):
+        r = self._reader
+        if self._prev is None:
+            self._prev = r.read(64)
+            return self._prev
+
+        # Count leading ones of the control prefix, at most 4
+        ones = 0
+        while ones < 4 and r.read(1):
+            ones += 1
+
+        if ones == 0:
+            dod = 0
+        else:
+            vbits = DOD_LARGE[2] if ones == 4 else DOD_BUCKETS[ones - 1][2]
+            dod = r.read(vbits)
+            if dod >= 1 << (vbits - 1):
+                dod -= 1 << vbits  # Two's complement
+
+        self._delta += dod
+        self._prev += self._delta
+        return self._prev
+
+
+class ValueEncoder(object):
+    ''' XOR float compression for one column
+
+    '''
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._prev = None
+        self._leading = None
+        self._trailing = 0
+
+    def append(self, val):
+        w = self._writer
+        bits = float_to_bits(val)
+        if self._prev is None:
+            w.write(bits, 64)
+            self._prev = bits
+            return
+
+        xor = bits ^ self._prev
+        self._prev = bits
+        if xor == 0:
+            w.write(0, 1)
+            return
+
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        w.write(1, 1)
+        if self._leading is not None and leading >= self._leading and trailing >= self._trailing:
+            # Meaningful bits fit in the previous window
+            w.write(0, 1)
+            w.write(xor >> self._trailing, 64 - self._leading - self._trailing)
+        else:
+            self._leading, self._trailing = leading, trailing
+            meaningful = 64 - leading - trailing
+            w.write(1, 1)
+            w.write(leading, 5)
+            w.write(meaningful - 1, 6)
+            w.write(xor >> trailing, meaningful)
+
+
+class ValueDecoder(object):
+    ''' XOR float decompression for one column
+
+    '''
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._prev = None
+        self._leading = 0
+        self._trailing = 0
+
+    def next(self):
+        r = self._reader
+        if self._prev is None:
+            self._prev = r.read(64)
+        elif r.read(1):
+            if r.read(1):
+                self._leading = r.read(5)
+                meaningful = r.read(6) + 1
+                self._trailing = 64 - self._leading - meaningful
+            xor = r.read(64 - self._leading - self._trailing) << self._trailing
+            self._prev ^= xor
+        return bits_to_float(self._prev)
+
+
+class RowEncoder(object):
+    ''' Encodes rows of (timestamp, values) into one interleaved bit stream
+
+    '''
+
+    def __init__(self, columns):
+        ''' Class initialization
+
+        :param columns: Number of value columns
+        '''
+        self.writer = BitWriter()
+        self._ts = TimestampEncoder(self.writer)
+        self._values = [ValueEncoder(self.writer) for _ in range(columns)]
+        self.rows = 0
+
+    def append(self, ts, values):
+        ''' Append a row
+
+        :param ts: Integer timestamp
+        :param values: Sequence of floats, one per column
+        '''
+        self._ts.append(ts)
+        for encoder, val in zip(self._values, values):
+            encoder.append(val)
+        self.rows += 1
+
+    def getvalue(self):
+        return self.writer.getvalue()
+
+
+def iter_rows(data, columns, rows, offset=0):
+    ''' Stream rows out of an interleaved bit stream
+
+    :param data: Encoded bytes
+    :param columns: Number of value columns
+    :param rows: Number of rows to read
+    :param offset: Byte offset of the bit stream
+    :return: Generator of (timestamp, list of values)
+    '''
+    reader = BitReader(data, offset)
+    ts = TimestampDecoder(reader)
+    values = [ValueDecoder(reader) for _ in range(columns)]
+    for _ in range(rows):
+        yield ts.next(), [decoder.next() for decoder in values]
@@ -0,0 +1,316 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : outbox.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Append only, segmented on-disk outbox that holds messages while the broker is unreachable.
+
+              Each record is framed as <length:u32><crc32:u32><content type length:u16><content type><body>.
+              A torn record at the tail of the last segment is truncated when the outbox is opened. The
+              committed read position is kept in a cursor file that is replaced atomically. Delivery is at
+              least once, records confirmed after the last cursor sync are sent again after a crash.
+
+Reference   : None
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import struct
+import time
+import zlib
+import log.logger as logger
+
+# Record framing
+HEADER = struct.Struct('<IIH')
+CURSOR = struct.Struct('<QQ')
+SEGMENT_EXT = '.seg'
+CURSOR_FILE = 'cursor'
+
+# Defaults
+DEFAULT_SEGMENT_BYTES = 1024 * 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_SYNC_RECORDS = 64
+DEFAULT_SYNC_INTERVAL_SEC = 1.0
+
+
+class Outbox(object):
+    ''' Bounded store and forward queue of messages on disk
+
+    '''
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 sync_records=DEFAULT_SYNC_RECORDS, sync_interval=DEFAULT_SYNC_INTERVAL_SEC):
+        ''' Class initialization
+
+        :param path: Outbox directory
+        :param max_bytes: Maximum bytes on disk, the oldest segments are dropped when exceeded
+        :param segment_bytes: Segment size before rolling to a new file
+        :param sync_records: fsync after this many appended records
+        :param sync_interval: fsync when this many seconds passed since the last sync
+        '''
+        self._path = path
+        self._max_bytes = max_bytes
+        self._segment_bytes = segment_bytes
+        self._sync_records = sync_records
+        self._sync_interval = sync_interval
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._writer = None
+        self._reader = None
+        self.dropped = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._segments = sorted(int(f[:-len(SEGMENT_EXT)]) for f in os.listdir(path) if f.endswith(SEGMENT_EXT))
+        self._sizes = {seg: os.path.getsize(self._segment_path(seg)) for seg in self._segments}
+
+        # Committed position and read position as (segment, offset)
+        self._commit_pos = self._load_cursor()
+
+        self._recover()
+        if self._commit_pos[0] in self._sizes and self._commit_pos[1] > self._sizes[self._commit_pos[0]]:
+            self._commit_pos = (self._commit_pos[0], self._sizes[self._commit_pos[0]])
+        self._read_pos = self._commit_pos
+        self._open_writer()
+        logger.info('Outbox {} opened with {} segments, {} bytes'.format(path, len(self._segments), self.size()))
+
+    def _segment_path(self, seg):
+        return os.path.join(self._path, '{:016d}{}'.format(seg, SEGMENT_EXT))
+
+    def _load_cursor(self):
+        ''' Load the committed position, defaults to the start of the oldest segment
+
+        '''
+        try:
+            with open(os.path.join(self._path, CURSOR_FILE), 'rb') as f:
+                seg, offset = CURSOR.unpack(f.read(CURSOR.size))
+            if seg in self._sizes:
+                return seg, offset
+        except (IOError, struct.error):
+            pass
+        return (self._segments[0], 0) if self._segments else (1, 0)
+
+    def _save_cursor(self, sync):
+        ''' Atomically replace the cursor file
+
+        :param sync: fsync the cursor before renaming
+        '''
+        tmp = os.path.join(self._path, CURSOR_FILE + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(CURSOR.pack(*self._commit_pos))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self._path, CURSOR_FILE))
+
+    def _recover(self):
+        ''' Truncate a torn record at the tail of the last segment
+
+        '''
+        if not self._segments:
+            return
+
+        seg = self._segments[-1]
+        valid = 0
+        with open(self._segment_path(seg), 'rb') as f:
+            while True:
+                record = self._read_record(f)
+                if record is None:
+                    break
+                valid = f.tell()
+
+        if valid != self._sizes[seg]:
+            logger.warning('Outbox segment {} truncated from {} to {} bytes'.format(seg, self._sizes[seg], valid))
+            with open(self._segment_path(seg), 'r+b') as f:
+                f.truncate(valid)
+            self._sizes[seg] = valid
+
+    def _open_writer(self):
+        ''' Open the last segment for appending or create the first one
+
+        '''
+        if not self._segments:
+            self._segments.append(self._commit_pos[0])
+            self._sizes[self._commit_pos[0]] = 0
+        self._writer = open(self._segment_path(self._segments[-1]), 'ab')
+
+    @staticmethod
+    def _read_record(f):
+        ''' Read one record from a segment file
+
+        :param f: Segment file positioned at a record
+        :return: Tuple of content type and body or None at the end or on a torn record
+        '''
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length, crc, ctype_len = HEADER.unpack(header)
+        data = f.read(length)
+        if len(data) < length or zlib.crc32(data) != crc or ctype_len > length:
+            return None
+        return data[:ctype_len].decode(), data[ctype_len:]
+
+    def size(self):
+        ''' Total bytes held in segments
+
+        '''
+        return sum(self._sizes.values())
+
+    def is_empty(self):
+        ''' Check if every record has been committed
+
+        '''
+        return self._commit_pos == (self._segments[-1], self._sizes[self._segments[-1]])
+
+    def has_unread(self):
+        ''' Check if records remain after the read position
+
+        '''
+        return self._read_pos != (self._segments[-1], self._sizes[self._segments[-1]])
+
+    def append(self, body, content_type='application/json'):
+        ''' Append a message
+
+        :param body: Message body as str or bytes
+        :param content_type: Message content type
+        '''
+        if isinstance(body, str):
+            body = body.encode()
+        ctype = content_type.encode()
+        data = ctype + body
+
+        if self._sizes[self._segments[-1]] >= self._segment_bytes:
+            self._roll()
+
+        self._writer.write(HEADER.pack(len(data), zlib.crc32(data), len(ctype)))
+        self._writer.write(data)
+        self._sizes[self._segments[-1]] += HEADER.size + len(data)
+        self._unsynced += 1
+
+        if self._unsynced >= self._sync_records or time.monotonic() - self._last_sync >= self._sync_interval:
+            self.sync()
+
+        self._enforce_limit()
+
+    def sync(self):
+        ''' Flush and fsync appended records and the cursor
+
+        '''
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._save_cursor(True)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _roll(self):
+        ''' Start a new segment
+
+        '''
+        self.sync()
+        self._writer.close()
+        seg = self._segments[-1] + 1
+        self._segments.append(seg)
+        self._sizes[seg] = 0
+        self._writer = open(self._segment_path(seg), 'ab')
+
+    def _enforce_limit(self):
+        ''' Drop the oldest segments while over the size limit. Only records not read yet are counted as
+        dropped, records already read are in flight and may still be confirmed.
+
+        '''
+        while self.size() > self._max_bytes and len(self._segments) > 1:
+            seg = self._segments[0]
+            dropped = self._count_records(seg, self._read_pos[1]) if self._read_pos[0] == seg else 0
+            self.dropped += dropped
+            logger.warning('Outbox full, dropped segment {} with {} unsent messages'.format(seg, dropped))
+            self._remove_segment(seg)
+            if self._commit_pos[0] <= seg:
+                self._commit_pos = (self._segments[0], 0)
+            if self._read_pos[0] <= seg:
+                self._read_pos = (self._segments[0], 0)
+
+    def _count_records(self, seg, offset):
+        count = 0
+        with open(self._segment_path(seg), 'rb') as f:
+            f.seek(offset)
+            while self._read_record(f) is not None:
+                count += 1
+        return count
+
+    def _remove_segment(self, seg):
+        if self._reader is not None and self._reader[0] == seg:
+            self._reader[1].close()
+            self._reader = None
+        os.remove(self._segment_path(seg))
+        self._segments.remove(seg)
+        del self._sizes[seg]
+
+    def read(self, count):
+        ''' Read records after the read position without committing them
+
+        :param count: Maximum number of records
+        :return: List of (position, content type, body), commit a position once it is delivered
+        '''
+        records = []
+        self._writer.flush()
+        while len(records) < count and self.has_unread():
+            seg, offset = self._read_pos
+            if offset >= self._sizes[seg]:
+                # Move on to the next segment
+                self._read_pos = (self._segments[self._segments.index(seg) + 1], 0)
+                continue
+
+            if self._reader is None or self._reader[0] != seg:
+                if self._reader is not None:
+                    self._reader[1].close()
+                self._reader = (seg, open(self._segment_path(seg), 'rb'))
+
+            f = self._reader[1]
+            f.seek(offset)
+            record = self._read_record(f)
+            if record is None:
+                logger.error('Outbox segment {} corrupt at {}, skipping rest of segment'.format(seg, offset))
+                self._read_pos = (seg, self._sizes[seg])
+                continue
+
+            self._read_pos = (seg, f.tell())
+            records.append((self._read_pos, record[0], record[1]))
+
+        return records
+
+    def commit(self, position):
+        ''' Mark all records up to and including position as delivered
+
+        :param position: Position returned by read(), ignored when not after the committed position such as
+                         a position in a segment dropped by the size limit
+        '''
+        if position <= self._commit_pos:
+            return
+        self._commit_pos = position
+
+        # Remove segments that are fully delivered, the segment being written is kept
+        while self._segments[0] < position[0] or (len(self._segments) > 1 and
+                                                 position == (self._segments[0], self._sizes[self._segments[0]])):
+            self._remove_segment(self._segments[0])
+        if self._commit_pos[0] not in self._sizes:
+            self._commit_pos = (self._segments[0], 0)
+        if self._read_pos[0] not in self._sizes:
+            self._read_pos = self._commit_pos
+
+        if time.monotonic() - self._last_sync >= self._sync_interval:
+            self.sync()
+
+    def close(self):
+        ''' Sync and close the outbox
+
+        '''
+        self.sync()
+        self._writer.close()
+        if self._reader is not None:
+            self._reader[1].close()
+            self._reader = None
@@ -23,21 +23,38 @@ import time
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 import threading
+import collections
 import pika
 import json
+import metrics
 import log.logger as logger
 from pika.exchange_type import ExchangeType
+from messagebroker.batch import SampleBatch, DEFAULT_BATCH_BYTES, DEFAULT_BATCH_AGE_SEC
+from messagebroker.outbox import Outbox, DEFAULT_MAX_BYTES
+from messagebroker.codec import get_codec, decode_message
+from messagebroker.confirms import Delivery, InflightTable, LatencyHistogram
+from messagebroker.workers import WorkerPool, WORKER_THREAD, DEFAULT_PREFETCH_PER_WORKER
 
 # Default location for credential file
 DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
 DEFAULT_RETRY_TIMEOUT_SEC = 5
 DEFAULT_QUEUE = "samples"
+DEFAULT_CONFIRM_WINDOW = 256
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_DRAIN_BATCH = 100
+DEFAULT_ACK_INTERVAL_SEC = 0.5
+DEFAULT_OFFLINE_DRAIN_SEC = 0.5
+
+# Policies when the publish queue is full
+QUEUE_DROP_OLDEST = 'drop_oldest'
+QUEUE_DROP_NEWEST = 'drop_newest'
 
 
 class RabbitMQBase(threading.Thread):
     ''' Base class for message broker
 
     '''
+    role = None  # Metrics label
 
     def __init__(self, queue_name, path, **kwargs):
         '''
@@ -56,6 +73,9 @@ class RabbitMQBase(threading.Thread):
         self._ready = False
         self._channel = None
         self._config = self.load_config(DEFAULT_PATH if path is None else path)
+        self._opened = 0
+        self._metric_reconnects = metrics.counter('sensehatlive_broker_reconnects',
+                                                  'Connections opened after the first', {'role': self.role})
 
     def load_config(self, path):
         ''' Loads RabbitMQ connection parameters if present or creates
@@ -73,8 +93,8 @@ class RabbitMQBase(threading.Thread):
         except Exception as e:
             raise Exception(str(e))
 
-    def connect(self):
-        ''' Establish connection with the RabbitMQ server
+    def connection_parameters(self):
+        ''' Build connection parameters from the config
 
         :return:
         '''
@@ -86,7 +106,14 @@ class RabbitMQBase(threading.Thread):
                                                    credentials=credentials)
         else:
             parameters = pika.URLParameters(url)
+        return parameters
+
+    def connect(self):
+        ''' Establish connection with the RabbitMQ server
 
+        :return:
+        '''
+        parameters = self.connection_parameters()
         logger.info('Connecting to {}:{} ...'.format(parameters.host, parameters._port))
         return pika.SelectConnection(parameters,
                                      on_open_callback=self.on_connection_open,
@@ -101,6 +128,9 @@ class RabbitMQBase(threading.Thread):
         '''
 
         logger.info('Connection opened')
+        self._opened += 1
+        if self._opened > 1:
+            self._metric_reconnects.inc()
         self.open_channel()
 
     def on_connection_open_error(self, connection, err):
@@ -148,6 +178,31 @@ class RabbitMQBase(threading.Thread):
 
         self._connection.channel(on_open_callback=self.on_channel_open)
 
+    def _call_threadsafe(self, callback):
+        ''' Run a callback on the ioloop thread, safe to call from any thread
+
+        :param callback: Function to call
+        :return:
+        '''
+        self._connection.ioloop.add_callback_threadsafe(callback)
+
+    def _call_later(self, delay, callback):
+        ''' Run a callback on the ioloop thread after a delay, call from the ioloop thread
+
+        :param delay: Seconds to wait
+        :param callback: Function to call
+        :return: Timer for _cancel_timer()
+        '''
+        return self._connection.ioloop.call_later(delay, callback)
+
+    def _cancel_timer(self, timer):
+        ''' Cancel a timer of _call_later()
+
+        :param timer: Timer
+        :return:
+        '''
+        self._connection.ioloop.remove_timeout(timer)
+
     def close_channel(self):
         ''' Closes channel
 
@@ -273,6 +328,7 @@ class RabbitMQConsumer(RabbitMQBase):
     ''' Class for rabbitMQ consumer
 
     '''
+    role = 'consumer'
 
     def __init__(self, queue, on_msg_callback, path=None, **kwargs):
         ''' Class initialization
@@ -280,11 +336,25 @@ class RabbitMQConsumer(RabbitMQBase):
         :param queue: Name of queue
         :parm on_msg_callback: Callback for new messages
         :param path: Path to credentials file
+        :param decode_payload: Pass decoded payloads to the callback instead of JSON text
+        :param workers: Run the callback on this many workers, 0 runs it on the ioloop thread
+        :param worker_type: WORKER_THREAD or WORKER_PROCESS, a process pool needs a module level callback
+        :param ordered: With workers, run messages from the same device one at a time in delivery order
+        :param qos: Prefetch count, defaults to DEFAULT_PREFETCH_PER_WORKER per worker
+        :param ack_batch: Acknowledge after the callback with one multiple ack per this many messages. Above 1
+                          messages are only logged at debug level and a failed callback rejects its message.
+        :param ack_interval: Maximum seconds a finished message waits for its batched acknowledgement
 
         '''
         super(RabbitMQConsumer, self).__init__(queue, path, **kwargs)  # Base class initialization
-        self._qos = kwargs.get('qos', 1)
+        workers = kwargs.get('workers', 0)
+        self._qos = kwargs.get('qos', workers * DEFAULT_PREFETCH_PER_WORKER if workers else 1)
+        self._decode_payload = kwargs.get('decode_payload', False)
         self._on_msg_callback = on_msg_callback
+        self._pool = None
+        if workers and on_msg_callback is not None:
+            self._pool = WorkerPool(on_msg_callback, workers, kwargs.get('worker_type', WORKER_THREAD),
+                                    kwargs.get('ordered', False), self._decode_payload)
         self._allow_reconnect = False
         self.was_consuming = False
         self._consumer_tag = None
@@ -292,6 +362,16 @@ class RabbitMQConsumer(RabbitMQBase):
         self._closing = False
         self._consumed = 0
         self._acked = 0
+        self._rejected = 0
+
+        # Batched acknowledgements, tags up to _ack_tag are finished and up to _ack_sent are acknowledged
+        self._ack_batch = kwargs.get('ack_batch', 1)
+        self._ack_interval = kwargs.get('ack_interval', DEFAULT_ACK_INTERVAL_SEC)
+        self._ack_tag = 0
+        self._ack_sent = 0
+        self._ack_timer = None
+        self._nacked = []  # Rejected tags after _ack_sent, not counted as acknowledged by a multiple ack
+        self._metric_consumed = metrics.counter('sensehatlive_messages_consumed', 'Messages received')
         self.reset_stats()
 
     def on_connection_open_error(self, connection, err):
@@ -385,6 +465,14 @@ class RabbitMQConsumer(RabbitMQBase):
         :return:
         '''
         logger.info('QOS set to {}'.format(self._qos))
+
+        # Delivery tags restart on a new channel
+        self._ack_tag = 0
+        self._ack_sent = 0
+        self._ack_timer = None
+        self._nacked = []
+        if self._pool is not None:
+            self._pool.attach(self._call_threadsafe, self._queue_ack, self.reject_message)
         self.start_consuming()
 
     def start_consuming(self):
@@ -421,14 +509,44 @@ class RabbitMQConsumer(RabbitMQBase):
         :param body: Message body
         :return:
         '''
-        logger.info('Received message: exchange = "{}" route key = "{}" tag = {} '.format(
-            basic_deliver.exchange, basic_deliver.routing_key, basic_deliver.delivery_tag))
-        logger.debug('Body = {}'.format(body))
         self._consumed += 1
-        self.acknowledge_message(basic_deliver.delivery_tag)
+        self._metric_consumed.inc()
+        if self._ack_batch <= 1:
+            logger.info('Received message: exchange = "{}" route key = "{}" tag = {} '.format(
+                basic_deliver.exchange, basic_deliver.routing_key, basic_deliver.delivery_tag))
+        if logger.isDebug():
+            logger.debug('Received message tag = {} body = {}'.format(basic_deliver.delivery_tag, body))
+
+        if self._pool is not None:
+            # Acknowledged once the callback has finished on a worker
+            self._pool.submit(basic_deliver.delivery_tag, properties, body)
+            return
+
+        if self._ack_batch <= 1:
+            self.acknowledge_message(basic_deliver.delivery_tag)
+            if self._on_msg_callback is not None:
+                self._on_msg_callback(self.decode_body(properties, body))
+            return
+
+        try:
+            if self._on_msg_callback is not None:
+                self._on_msg_callback(self.decode_body(properties, body))
+        except Exception as e:
+            logger.error('Message callback failed for tag = {}: {}'.format(basic_deliver.delivery_tag, e))
+            self.reject_message(basic_deliver.delivery_tag)  # Not folded into the next multiple ack
+            return
+        self._queue_ack(basic_deliver.delivery_tag)
+
+    def decode_body(self, properties, body):
+        ''' Decode a message body using the codec named by its content type
 
-        if self._on_msg_callback is not None:
-            self._on_msg_callback(body.decode())
+        Without decode_payload the callback keeps receiving JSON text whatever the encoding.
+
+        :param properties: Message properties
+        :param body: Message body
+        :return: JSON text or decoded payload
+        '''
+        return decode_message(properties.content_type, body, self._decode_payload)
 
     def acknowledge_message(self, delivery_tag):
         ''' Acknowledge the message delivery
@@ -440,12 +558,70 @@ class RabbitMQConsumer(RabbitMQBase):
         self._channel.basic_ack(delivery_tag)
         self._acked += 1
 
+    def _queue_ack(self, delivery_tag):
+        ''' Mark every delivery up to delivery_tag finished, acknowledged together once ack_batch are
+        waiting or after ack_interval
+
+        :param delivery_tag: Delivery tag
+        :return:
+        '''
+        self._ack_tag = delivery_tag
+        if self._ack_tag - self._ack_sent >= self._ack_batch:
+            self._flush_acks()
+        elif self._ack_timer is None:
+            self._ack_timer = self._call_later(self._ack_interval, self._flush_acks)
+
+    def _flush_acks(self):
+        ''' Send one multiple ack for every finished delivery not acknowledged yet
+
+        :return:
+        '''
+        if self._ack_timer is not None:
+            self._cancel_timer(self._ack_timer)
+            self._ack_timer = None
+
+        if self._channel is None or self._ack_tag <= self._ack_sent:
+            return
+
+        if logger.isDebug():
+            logger.debug('Acknowledging message tags {} - {}'.format(self._ack_sent + 1, self._ack_tag))
+        self._channel.basic_ack(self._ack_tag, multiple=True)
+        rejected = sum(1 for tag in self._nacked if tag <= self._ack_tag)
+        self._nacked = [tag for tag in self._nacked if tag > self._ack_tag]
+        self._acked += self._ack_tag - self._ack_sent - rejected
+        self._ack_sent = self._ack_tag
+
+    def reject_message(self, delivery_tag):
+        ''' Reject a delivery whose callback failed without requeue, the broker dead letters it. Finished
+        deliveries before it are acknowledged first.
+
+        :param delivery_tag: Delivery tag
+        :return:
+        '''
+        self._flush_acks()
+        if self._channel is None:
+            return
+
+        logger.warning('Rejecting message tag = {}'.format(delivery_tag))
+        self._channel.basic_nack(delivery_tag, multiple=False, requeue=False)
+        self._rejected += 1
+        if delivery_tag > self._ack_sent:
+            self._nacked.append(delivery_tag)
+
+    def get_worker_stats(self):
+        ''' Get worker pool throughput and lag gauges
+
+        :return: See WorkerPool.get_stats(), None without workers
+        '''
+        return None if self._pool is None else self._pool.get_stats()
+
     def stop_consuming(self):
         ''' Tell server to stop consuming
 
         :return:
         '''
         if self._channel:
+            self._flush_acks()
             logger.info('Sending consume stop to server ...')
             self._channel.basic_cancel(self._consumer_tag, self.on_cancel_ok)
 
@@ -477,6 +653,9 @@ class RabbitMQConsumer(RabbitMQBase):
             except:
                 break
 
+        if self._pool is not None:
+            self._pool.close()
+
         logger.info("[z] Consumer thread stopped")
 
     def stop(self):
@@ -503,26 +682,82 @@ class RabbitMQConsumer(RabbitMQBase):
                 '''
         self._consumed = 0
         self._acked = 0
+        self._rejected = 0
 
 
 class RabbitMQProducer(RabbitMQBase):
     '''
     Class for rabbitMQ producer
     '''
+    role = 'producer'
 
     def __init__(self, queue, path=None, **kwargs):
         ''' Class initialization
 
         :param queue: Name of queue
         :param path: Path to credentials file
+        :param encoding: Payload encoding name, see codec.CODECS
+        :param batch_size: Samples per message, batching is disabled when less than 2
+        :param batch_bytes: Maximum batched message size in bytes
+        :param batch_age: Maximum seconds a sample waits in a batch
+        :param outbox_dir: Directory to store messages while the broker is unreachable, disabled when None
+        :param outbox_bytes: Maximum size of the outbox on disk
+        :param confirm_window: Maximum unconfirmed messages, more wait until confirms arrive
+        :param queue_size: Maximum samples waiting to be handed to the ioloop thread
+        :param queue_policy: QUEUE_DROP_OLDEST or QUEUE_DROP_NEWEST when the queue is full
+        :param app_id: Device ID sent as the message app_id, consumers use it to keep a device's messages in order
         '''
         super(RabbitMQProducer, self).__init__(queue, path, **kwargs)  # Base class initialization
         self._publish_count = None
         self._allow_reconnect = True
         self._ack = None
         self._nack = None
+        self._dropped = None
+        self._codec = get_codec(kwargs.get('encoding', 'json'))
+        self._app_id = kwargs.get('app_id')
+        self._batch = None
+        if kwargs.get('batch_size', 0) > 1:
+            self._batch = SampleBatch(kwargs['batch_size'], kwargs.get('batch_bytes', DEFAULT_BATCH_BYTES),
+                                      kwargs.get('batch_age', DEFAULT_BATCH_AGE_SEC), self._codec)
+
+        # Samples are handed to the ioloop thread through a bounded queue
+        self._pending = collections.deque(maxlen=kwargs.get('queue_size', DEFAULT_QUEUE_SIZE))
+        self._queue_policy = kwargs.get('queue_policy', QUEUE_DROP_OLDEST)
+        self._queue_dropped = None
+        self._drain_scheduled = False
+
+        # Batch, outbox and confirm state are only changed on the producer thread, the publishing thread only
+        # appends to the queue
+        self._lock = threading.RLock()
+
+        # Store and forward
+        self._outbox = None
+        if kwargs.get('outbox_dir'):
+            self._outbox = Outbox(kwargs['outbox_dir'], kwargs.get('outbox_bytes', DEFAULT_MAX_BYTES))
+        self._outbox_order = collections.deque()  # Outbox deliveries in outbox order
+
+        # Publisher confirms
+        self._delivery_tag = 0
+        self._window = kwargs.get('confirm_window', DEFAULT_CONFIRM_WINDOW)
+        self._inflight = InflightTable()
+        self._resend = collections.deque()  # Deliveries waiting for room in the window
+        self._resend_limit = kwargs.get('queue_size', DEFAULT_QUEUE_SIZE)
+        self._latency = LatencyHistogram()
+        self._republished = None
         self.reset_stats()
 
+        self._metric_samples = metrics.counter('sensehatlive_samples_published', 'Samples handed to the producer')
+        self._metric_messages = metrics.counter('sensehatlive_messages_published', 'Messages sent to the broker')
+        self._metric_nacks = metrics.counter('sensehatlive_messages_nacked', 'Messages rejected by the broker')
+        self._metric_confirm = metrics.histogram('sensehatlive_confirm_latency_seconds',
+                                                 'Time from publish to broker confirm')
+        metrics.gauge('sensehatlive_publish_queue_depth',
+                      'Samples waiting for the ioloop thread').set_function(self.get_queue_depth)
+        metrics.gauge('sensehatlive_inflight_messages',
+                      'Messages waiting for a broker confirm').set_function(lambda: len(self._inflight))
+        self._metric_dropped = metrics.counter('sensehatlive_samples_dropped',
+                                               'Samples or messages dropped by the queue policy or while offline')
+
     def on_queue_ok(self, userdata):
         ''' Callback for queue declaration
 
@@ -541,8 +776,22 @@ class RabbitMQProducer(RabbitMQBase):
         logger.info('Enabling delivery confirmation for {}'.format(self._queue_name))
         self._channel.confirm_delivery(self.on_delivery_confirmation)
 
+        # Delivery tags restart on a new channel, unconfirmed messages are published again first
+        self._delivery_tag = 0
+        with self._lock:
+            unconfirmed = self._inflight.clear()
+            if unconfirmed:
+                logger.warning('Publishing {} unconfirmed messages again'.format(len(unconfirmed)))
+                self._republished += len(unconfirmed)
+            self._resend.extendleft(reversed(unconfirmed))
+
         logger.info('Ready to publish')
         self._ready = True
+        self._drain_scheduled = False
+        with self._lock:
+            self._send_backlog()
+            self._drain_outbox()
+        self._drain_pending()
 
     def on_delivery_confirmation(self, frame):
         ''' Call back for delivery confirmations
@@ -553,27 +802,232 @@ class RabbitMQProducer(RabbitMQBase):
 
         ack_type = frame.method.NAME.split('.')[1].lower()
         logger.info('Received {} for delivery tag: {}'.format(ack_type, frame.method.delivery_tag))
-        if ack_type == 'ack':
-            self._ack += 1
-        elif ack_type == 'nack':
-            self._nack += 1
+        with self._lock:
+            deliveries = self._inflight.confirm(frame.method.delivery_tag, frame.method.multiple)
+            if ack_type == 'ack':
+                self._ack += len(deliveries)
+                now = time.monotonic()
+                for delivery in deliveries:
+                    self._latency.observe(now - delivery.sent)
+                    self._metric_confirm.observe(now - delivery.sent)
+                    delivery.confirmed = True
+                self._commit_outbox()
+            elif ack_type == 'nack':
+                # Publish again ahead of anything waiting
+                self._nack += len(deliveries)
+                self._metric_nacks.inc(len(deliveries))
+                self._republished += len(deliveries)
+                self._resend.extendleft(reversed(deliveries))
+
+            self._send_backlog()
+            self._drain_outbox()
         self.print_stats()
 
+    def _commit_outbox(self):
+        ''' Commit the outbox up to the last message confirmed along with every message before it
+
+        :return:
+        '''
+        order = self._outbox_order
+        position = None
+        while order and order[0].confirmed:
+            position = order.popleft().position
+        if position is not None:
+            self._outbox.commit(position)
+
+    def _room(self):
+        ''' Number of messages that can be published before the confirm window is full
+
+        :return:
+        '''
+        return self._window - len(self._inflight) - len(self._resend)
+
+    def _send_backlog(self):
+        ''' Publish waiting deliveries while the confirm window has room
+
+        :return:
+        '''
+        while self._resend and self._ready and len(self._inflight) < self._window:
+            self._transmit(self._resend.popleft())
+
+    def _drain_outbox(self):
+        ''' Publish stored messages while the confirm window has room
+
+        :return:
+        '''
+        if self._outbox is None:
+            return
+
+        with self._lock:
+            room = self._room()
+            while self._ready and room > 0 and self._outbox.has_unread():
+                for position, content_type, body in self._outbox.read(room):
+                    properties = pika.BasicProperties(content_type=content_type, app_id=self._app_id)
+                    delivery = Delivery(body, properties, position)
+                    self._outbox_order.append(delivery)
+                    self._transmit(delivery)
+                room = self._room()
+
     def publish(self, data):
-        ''' Publish json to server.
+        ''' Hand data to the producer thread for publishing with the configured encoding. Never blocks, when
+        the queue is full a sample is dropped according to the queue policy. In batch mode the sample is held
+        until the batch is due, offline the producer thread batches or stores it.
 
         :param data:
         :return:
         '''
-        if not self._ready:
+        if not self._ready and self._batch is None and self._outbox is None:
             return self._ready
 
+        self._metric_samples.inc()
+        pending = self._pending
+        if len(pending) == pending.maxlen:
+            self._queue_dropped += 1
+            self._metric_dropped.inc()
+            if self._queue_policy == QUEUE_DROP_NEWEST:
+                return self._ready
+        pending.append(data)  # The deque discards the oldest when full
+        self._wake_ioloop()
+        return self._ready
+
+    def _wake_ioloop(self):
+        ''' Schedule a drain of the queue on the ioloop thread, at most one is scheduled at a time
+
+        :return:
+        '''
+        if self._drain_scheduled:
+            return
+
+        self._drain_scheduled = True
+        try:
+            self._call_threadsafe(self._drain_pending)
+        except Exception:
+            # No ioloop, the queue is drained by run() while it waits to reconnect
+            self._drain_scheduled = False
+
+    def _drain_pending(self, limit=DEFAULT_DRAIN_BATCH):
+        ''' Publish queued samples, or only batch or store them while offline. Runs on the producer thread.
+
+        :param limit: Maximum samples per call so the ioloop stays responsive, None for all
+        :return:
+        '''
+        self._drain_scheduled = False
+        online = self._ready
+
+        pending = self._pending
+        count = 0
+        with self._lock:
+            while pending and (limit is None or count < limit):
+                try:
+                    data = pending.popleft()
+                except IndexError:
+                    break
+                self._publish_sample(data, online)
+                count += 1
+
+        if pending:
+            self._wake_ioloop()
+
+    def _publish_sample(self, data, online):
+        ''' Encode a sample and publish it or add it to the batch
+
+        :param data: Sample
+        :param online: Channel may be used
+        :return:
+        '''
+        if self._batch is None:
+            body = self._codec.pack([self._codec.encode(data)], False)
+            properties = pika.BasicProperties(content_type=self._codec.content_type, app_id=self._app_id)
+            self._send_or_store(body, properties, online)
+            return
+
+        encoded = self._codec.encode(data)
+        if not self._batch.fits(encoded):
+            self._flush(online)
+        if self._batch.add(encoded):
+            self._flush(online)
+
+    def _flush(self, online):
+        ''' Publish pending batched samples as one message
+
+        :param online: Channel may be used
+        :return:
+        '''
+        if self._batch is None or len(self._batch) == 0:
+            return
+
+        body, count = self._batch.drain()
+        if not (online and self._ready) and self._outbox is None:
+            self._dropped += count
+            self._metric_dropped.inc(count)
+            logger.warning('Broker not ready, dropped batch of {} samples'.format(count))
+            return
+
+        properties = pika.BasicProperties(content_type=self._codec.content_type, app_id=self._app_id,
+                                          headers={'samples': count})
+        self._send_or_store(body, properties, online)
+
+    def _send_or_store(self, body, properties, online):
+        ''' Publish a message, or store it in the outbox while offline, while older messages are pending or
+        while the confirm window is full
+
+        :param body: Message body
+        :param properties: Message properties
+        :param online: Channel may be used
+        :return:
+        '''
+        connected = online and self._ready
+        with self._lock:
+            if self._outbox is not None and (not connected or not self._outbox.is_empty() or self._room() <= 0):
+                self._outbox.append(body, properties.content_type)
+                if connected:
+                    self._drain_outbox()
+                return
+
+            if not connected:
+                self._dropped += 1
+                self._metric_dropped.inc()
+                return
+
+            delivery = Delivery(body, properties)
+            if self._room() > 0:
+                self._transmit(delivery)
+            elif len(self._resend) < self._resend_limit:
+                self._resend.append(delivery)
+            else:
+                self._dropped += 1
+                self._metric_dropped.inc()
+
+    def _transmit(self, delivery):
+        ''' Publish a delivery to the exchange and track it until confirmed
+
+        :param delivery: Delivery
+        :return:
+        '''
         self._publish_count += 1
+        self._metric_messages.inc()
+        self._delivery_tag += 1
+        delivery.sent = time.monotonic()
+        delivery.attempts += 1
         logger.info('Publishing message #{}'.format(self._publish_count))
-        json_str = json.dumps(data)
-        self._channel.basic_publish(exchange=self._exchange, routing_key=self._route_key, body=json_str)
+        self._channel.basic_publish(exchange=self._exchange, routing_key=self._route_key, body=delivery.body,
+                                    properties=delivery.properties)
+        self._inflight.add(self._delivery_tag, delivery)
         self.print_stats()
-        return self._ready
+
+    def is_batching(self):
+        ''' Get batch mode status
+
+        :return:
+        '''
+        return self._batch is not None
+
+    def has_outbox(self):
+        ''' Get store and forward status
+
+        :return:
+        '''
+        return self._outbox is not None
 
     def reset_stats(self):
         ''' Reset message stats
@@ -583,14 +1037,37 @@ class RabbitMQProducer(RabbitMQBase):
         self._publish_count = 0
         self._ack = 0
         self._nack = 0
+        self._dropped = 0
+        self._queue_dropped = 0
+        self._republished = 0
+        self._latency = LatencyHistogram()
 
     def print_stats(self):
-        ''' Display message stats
+        ''' Display message stats at debug level, runs on every publish and confirm
+
+        :return:
+        '''
+        if not logger.isDebug():
+            return
+        logger.debug('Messages: publish={}, acked={} ({}% naked), queued={}, dropped={}, inflight={}, '
+                     'republished={}, confirm p50={} p99={}'.format(
+                         self._publish_count, self._ack, (self._nack / self._publish_count), len(self._pending),
+                         self._dropped + self._queue_dropped, len(self._inflight), self._republished,
+                         self._latency.percentile(50), self._latency.percentile(99)))
+
+    def get_confirm_latency(self):
+        ''' Get the publish to confirm latency histogram
 
         :return:
         '''
-        logger.debug('Messages: publish={}, acked={} ({}% naked)'.format(self._publish_count, self._ack,
-                                                                         (self._nack / self._publish_count)))
+        return self._latency
+
+    def get_queue_depth(self):
+        ''' Get the number of samples waiting for the ioloop thread
+
+        :return:
+        '''
+        return len(self._pending)
 
     def run(self):
         logger.info("---- Producer thread started")
@@ -600,6 +1077,9 @@ class RabbitMQProducer(RabbitMQBase):
 
             try:
                 self._connection = self.connect()
+                self._drain_scheduled = False
+                if self._pending:
+                    self._wake_ioloop()  # Samples queued while there was no ioloop
                 self._connection.ioloop.start()
             except Exception as e:
                 logger.info("Stopping producer ...")
@@ -610,21 +1090,57 @@ class RabbitMQProducer(RabbitMQBase):
 
                 if self._allow_reconnect:
                     logger.warning('Reconnecting in {}s ...'.format(DEFAULT_RETRY_TIMEOUT_SEC))
-                    time.sleep(DEFAULT_RETRY_TIMEOUT_SEC)
+                    self._wait_offline(DEFAULT_RETRY_TIMEOUT_SEC)
                 else:
                     self._shutdown = True
                     break
 
+        # Store what was published after the connection closed
+        with self._lock:
+            self._drain_pending(limit=None)
+            self._flush(False)
+            if self._outbox is not None:
+                self._outbox.close()
+
         logger.info("[z] Producer thread stopped")
 
+    def _wait_offline(self, timeout):
+        ''' Wait before reconnecting without an ioloop, batching or storing queued samples meanwhile
+
+        :param timeout: Seconds to wait
+        :return:
+        '''
+        deadline = time.monotonic() + timeout
+        while not self._shutdown:
+            self._drain_pending(limit=None)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, DEFAULT_OFFLINE_DRAIN_SEC))
+
     def stop(self):
-        ''' Stop the producer
+        ''' Stop the producer, samples not published are stored by the producer thread
 
         :return:
         '''
 
         logger.info("Stopping producer ...")
         self._shutdown = True
+        if self._ready:
+            # Publish what is pending and close from the ioloop thread
+            self._call_threadsafe(self._close_on_ioloop)
+        else:
+            self.close_channel()
+            self.close_connection()
+
+    def _close_on_ioloop(self):
+        ''' Publish pending samples and close the connection, runs on the ioloop thread
+
+        :return:
+        '''
+        self._drain_pending(limit=None)
+        with self._lock:
+            self._flush(True)
         self.close_channel()
         self.close_connection()
 
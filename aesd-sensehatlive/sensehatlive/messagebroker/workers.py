@@ -0,0 +1,212 @@
+"""
+------------------------------------------------------------------------------------------------------------------------
+File Name   : workers.py
+Author      : Kenneth A. Jones
+Email       : kenneth.jones@colorado.edu
+Platform    : Linux VM (32/64 Bit), Raspberry Pi 3B
+
+Description : Worker pool for the consumer. Message bodies are decoded and handed to the callback on a thread or
+              process pool while the ioloop keeps receiving. A delivery is acknowledged only once its callback
+              has finished, deliveries finished ahead of the oldest one still running are acknowledged with it.
+              A delivery whose callback raised is rejected without requeue so the broker dead letters it.
+              Messages with the same ordering key, the device ID, can be kept in order.
+
+Reference   : Python concurrent.futures (https://docs.python.org/3/library/concurrent.futures.html)
+
+------------------------------------------------------------------------------------------------------------------------
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import collections
+import concurrent.futures
+import functools
+import time
+import log.logger as logger
+from messagebroker.codec import decode_message
+from messagebroker.confirms import LatencyHistogram
+
+# Worker types
+WORKER_THREAD = 'thread'
+WORKER_PROCESS = 'process'
+
+# Default prefetch per worker so workers are not starved between deliveries
+DEFAULT_PREFETCH_PER_WORKER = 32
+
+
+def run_callback(callback, content_type, body, decode_payload):
+    ''' Decode a message body and run the callback, runs on a worker
+
+    :param callback: Message callback, must be a module level function for a process pool
+    :param content_type: Message content type
+    :param body: Message body
+    :param decode_payload: Pass the decoded payload instead of JSON text
+    :return: Callback result
+    '''
+    return callback(decode_message(content_type, body, decode_payload))
+
+
+class AckTracker(object):
+    ''' Tracks deliveries completed out of order on one channel
+
+    '''
+
+    def __init__(self):
+        self._next = 1
+        self._done = set()
+
+    def reset(self):
+        ''' Delivery tags restart at 1 on a new channel
+
+        '''
+        self._next = 1
+        self._done.clear()
+
+    def complete(self, delivery_tag):
+        ''' Mark a delivery complete
+
+        :param delivery_tag: Delivery tag
+        :return: Highest tag that can be acknowledged with multiple, None while an older delivery is running
+        '''
+        self._done.add(delivery_tag)
+        last = None
+        while self._next in self._done:
+            self._done.remove(self._next)
+            last = self._next
+            self._next += 1
+        return last
+
+
+class WorkerPool(object):
+    ''' Runs the message callback on a pool and acknowledges deliveries once their callback finished
+
+    '''
+
+    def __init__(self, callback, workers, worker_type=WORKER_THREAD, ordered=False, decode_payload=False):
+        ''' Class initialization
+
+        :param callback: Message callback, must be a module level function for a process pool
+        :param workers: Number of workers
+        :param worker_type: WORKER_THREAD or WORKER_PROCESS
+        :param ordered: Run messages with the same ordering key one at a time in delivery order
+        :param decode_payload: Pass the decoded payload instead of JSON text
+        '''
+        if worker_type == WORKER_PROCESS:
+            self._executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='consumer-worker')
+        self._callback = callback
+        self._ordered = ordered
+        self._decode_payload = decode_payload
+        self._schedule = None
+        self._ack = None
+        self._reject = None
+        self._generation = 0
+        self._tracker = AckTracker()
+        self._lanes = {}            # Ordering key to deliveries waiting behind the running one
+        self._running = 0
+        self._waiting = 0
+        self._completed = 0
+        self._failed = 0
+        self._last_rate = (time.monotonic(), 0)
+        self.latency = LatencyHistogram()
+
+    def attach(self, schedule, ack, reject):
+        ''' Attach to a new channel, deliveries of the previous channel are no longer acknowledged
+
+        :param schedule: Function that runs a callback on the ioloop thread from any thread
+        :param ack: Function taking a delivery tag that acknowledges it along with every delivery before it
+        :param reject: Function taking the delivery tag of a failed callback that rejects only that delivery
+        :return:
+        '''
+        self._schedule = schedule
+        self._ack = ack
+        self._reject = reject
+        self._generation += 1
+        self._tracker.reset()
+        self._lanes.clear()
+        self._waiting = 0
+
+    def submit(self, delivery_tag, properties, body):
+        ''' Queue a delivery, runs on the ioloop thread
+
+        :param delivery_tag: Delivery tag
+        :param properties: Message properties
+        :param body: Message body
+        :return:
+        '''
+        job = (delivery_tag, properties.content_type, body, time.monotonic())
+        key = properties.app_id if self._ordered else None
+        if key is not None:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                lane.append(job)  # Runs when the delivery ahead of it for this key completes
+                self._waiting += 1
+                return
+            self._lanes[key] = collections.deque()
+        self._start(key, job)
+
+    def _start(self, key, job):
+        self._running += 1
+        future = self._executor.submit(run_callback, self._callback, job[1], job[2], self._decode_payload)
+        future.add_done_callback(functools.partial(self._on_future_done, self._generation, key, job))
+
+    def _on_future_done(self, generation, key, job, future):
+        ''' Hand a finished callback back to the ioloop thread, runs on a worker or executor thread
+
+        '''
+        try:
+            self._schedule(functools.partial(self._on_done, generation, key, job, future))
+        except Exception:
+            pass  # Connection is gone, the message is delivered again
+
+    def _on_done(self, generation, key, job, future):
+        ''' Acknowledge a finished delivery or reject a failed one and start the next one for its key, runs on
+        the ioloop thread
+
+        '''
+        self._running -= 1
+        if generation != self._generation:
+            return  # Channel was replaced, the broker delivers the message again
+
+        self._completed += 1
+        self.latency.observe(time.monotonic() - job[3])
+        error = future.exception()
+        if error is not None:
+            self._failed += 1
+            logger.error('Message callback failed for tag = {}: {}'.format(job[0], error))
+            self._reject(job[0])  # Settled before any multiple ack covering its tag is sent
+
+        last = self._tracker.complete(job[0])
+        if last is not None:
+            self._ack(last)
+
+        if key is not None:
+            lane = self._lanes[key]
+            if lane:
+                self._waiting -= 1
+                self._start(key, lane.popleft())
+            else:
+                del self._lanes[key]
+
+    def get_stats(self):
+        ''' Get throughput and lag gauges
+
+        :return: Dictionary of running, waiting, completed, failed, rate in messages per second since the last
+                 call and p50/p99 receive to acknowledge latency in seconds
+        '''
+        now = time.monotonic()
+        since, completed = self._last_rate
+        self._last_rate = (now, self._completed)
+        return {'running': self._running, 'waiting': self._waiting, 'completed': self._completed,
+                'failed': self._failed, 'rate': (self._completed - completed) / max(now - since, 1e-9),
+                'p50': self.latency.percentile(50), 'p99': self.latency.percentile(99)}
+
+    def close(self):
+        ''' Stop the workers, queued callbacks are cancelled and delivered again by the broker
+
+        :return:
+        '''
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Metrics registry of counters, gauges and fixed bucket histograms with a Prometheus text exporter over
+    HTTP or to a file for the node exporter textfile collector.
+
+    Counters and histograms keep one shard per writing thread so updates take no lock, shards are summed
+    when the metrics are collected.
+
+@Reference
+    Prometheus exposition formats (https://prometheus.io/docs/instrumenting/exposition_formats/)
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import bisect
+import threading
+import log.logger as logger
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_INTERVAL = 15
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+JITTER_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def _format_value(val):
+    if val == float('inf'):
+        return '+Inf'
+    if isinstance(val, float) and val.is_integer():
+        return str(int(val))
+    return repr(val)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escape = lambda val: str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(key, escape(val)) for key, val in items) + '}'
+
+
+class Counter(object):
+    ''' Monotonic counter
+
+    '''
+    type = 'counter'
+
+    def __init__(self, labels=()):
+        self.labels = labels
+        self._shards = {}  # Thread ID to [value]
+
+    def inc(self, amount=1):
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._shards.setdefault(threading.get_ident(), [0])
+        shard[0] += amount
+
+    def get(self):
+        return sum(shard[0] for shard in list(self._shards.values()))
+
+    def samples(self, name):
+        yield name + '_total', self.labels, None, self.get()
+
+
+class Gauge(object):
+    ''' Value that goes up and down, set directly or read from a function when collected
+
+    '''
+    type = 'gauge'
+
+    def __init__(self, labels=()):
+        self.labels = labels
+        self._value = 0
+        self._function = None
+
+    def set(self, val):
+        self._value = val
+
+    def set_function(self, function):
+        ''' Read the value from function when collected
+
+        :param function: Function returning the value, None to go back to set()
+        '''
+        self._function = function
+
+    def get(self):
+        function = self._function
+        return function() if function is not None else self._value
+
+    def samples(self, name):
+        yield name, self.labels, None, self.get()
+
+
+class Histogram(object):
+    ''' Counts of observations in fixed buckets with their sum
+
+    '''
+    type = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS, labels=()):
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._shards = {}  # Thread ID to [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, val):
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._shards.setdefault(threading.get_ident(), [0] * (len(self.buckets) + 1) + [0.0])
+        shard[bisect.bisect_left(self.buckets, val)] += 1
+        shard[-1] += val
+
+    def get(self):
+        ''' Get the bucket counts and sum
+
+        :return: Tuple of counts per bucket, the last one above every bucket, and the sum
+        '''
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for shard in list(self._shards.values()):
+            for i in range(len(counts)):
+                counts[i] += shard[i]
+            total += shard[-1]
+        return counts, total
+
+    def samples(self, name):
+        counts, total = self.get()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield name + '_bucket', self.labels, ('le', _format_value(float(bound))), cumulative
+        yield name + '_sum', self.labels, None, total
+        yield name + '_count', self.labels, None, cumulative
+
+
+class Registry(object):
+    ''' Metrics by name and labels
+
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()  # Taken to create metrics and to snapshot them for render()
+        self._families = {}  # Name to (type, help, {labels: metric})
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = tuple(sorted((labels or {}).items()))
+        family = self._families.get(name)
+        if family is not None and key in family[2]:
+            return family[2][key]
+
+        with self._lock:
+            family = self._families.setdefault(name, (cls.type, help, {}))
+            if family[0] != cls.type:
+                raise Exception("Metric {} is a {}, not a {}".format(name, family[0], cls.type))
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = cls(labels=key, **kwargs)
+            return metric
+
+    def counter(self, name, help='', labels=None):
+        ''' Get or create a counter, exported as name_total
+
+        :param name: Metric name
+        :param help: Description
+        :param labels: Dictionary of label name to value
+        '''
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=None):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', labels=None, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        ''' Get every metric in the Prometheus text format
+
+        :return: Text
+        '''
+        with self._lock:
+            families = [(name, metric_type, help, list(metrics.values()))
+                        for name, (metric_type, help, metrics) in sorted(self._families.items())]
+
+        lines = []
+        for name, metric_type, help, metrics in families:
+            # Counter samples are name_total, the family is described under the same name
+            family = name + '_total' if metric_type == Counter.type else name
+            if help:
+                lines.append('# HELP {} {}'.format(family, help))
+            lines.append('# TYPE {} {}'.format(family, metric_type))
+            for metric in metrics:
+                try:
+                    for sample, labels, extra, val in metric.samples(name):
+                        lines.append('{}{} {}'.format(sample, _format_labels(labels, extra), _format_value(val)))
+                except Exception as e:
+                    logger.warning('Metric {} could not be collected: {}'.format(name, e))
+        return '\n'.join(lines) + '\n'
+
+
+# Registry used by the application
+REGISTRY = Registry()
+
+
+def counter(name, help='', labels=None):
+    return REGISTRY.counter(name, help, labels)
+
+
+def gauge(name, help='', labels=None):
+    return REGISTRY.gauge(name, help, labels)
+
+
+def histogram(name, help='', labels=None, buckets=LATENCY_BUCKETS):
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+class MetricsServer(threading.Thread):
+    ''' Serves the registry at /metrics over HTTP
+
+    '''
+
+    def __init__(self, port, host=DEFAULT_HOST, registry=REGISTRY):
+        ''' Class initialization
+
+        :param port: TCP port
+        :param host: Address to listen on, local only by default
+        :param registry: Metrics registry
+        '''
+        super(MetricsServer, self).__init__()  # Base class initialization
+        self.daemon = True
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+    def run(self):
+        ''' Override threading run method
+
+        '''
+        logger.info("---- Metrics server started on port {} ----".format(self.port))
+        self._server.serve_forever()
+        self._server.server_close()
+        logger.info("[z] Metrics server stopped")
+
+    def stop(self):
+        self._server.shutdown()
+
+
+class TextfileExporter(threading.Thread):
+    ''' Writes the registry to a file periodically, replaced atomically so readers never see a partial file
+
+    '''
+
+    def __init__(self, path, interval=DEFAULT_INTERVAL, registry=REGISTRY):
+        ''' Class initialization
+
+        :param path: File path, should end in .prom for the node exporter
+        :param interval: Seconds between writes
+        :param registry: Metrics registry
+        '''
+        super(TextfileExporter, self).__init__()  # Base class initialization
+        self.daemon = True
+        self._path = path
+        self._interval = interval
+        self._registry = registry
+        self._shutdown = threading.Event()
+
+    def write(self):
+        try:
+            tmp = self._path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(self._registry.render())
+            os.replace(tmp, self._path)
+        except Exception as e:
+            logger.warning('Metrics file {} could not be written: {}'.format(self._path, e))
+
+    def run(self):
+        ''' Override threading run method, the file is written once more when stopped
+
+        '''
+        logger.info("---- Metrics textfile exporter started, writing {} ----".format(self._path))
+        self.write()
+        while not self._shutdown.wait(self._interval):
+            self.write()
+        self.write()
+        logger.info("[z] Metrics textfile exporter stopped")
+
+    def stop(self):
+        self._shutdown.set()
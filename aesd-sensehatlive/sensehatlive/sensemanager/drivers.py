@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Sensor driver registry. Each sensor configuration entry is compiled into a bound driver with its
+    sense hat reader, unit converter and formatter resolved once at load time.
+
+@Reference
+    Sense HAT API Reference (https://pythonhosted.org/sense-hat/api/)
+
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import utils
+import log.logger as logger
+from sensehatlive.sensemanager.stats import AngleWindowStats, WindowStats
+
+# Registered driver classes by sensor name
+DRIVERS = {}
+
+
+def register_driver(name):
+    ''' Class decorator to register a sensor driver
+
+    :param name: Sensor name used in the sense hat configuration
+    '''
+    def decorator(cls):
+        DRIVERS[name] = cls
+        return cls
+    return decorator
+
+
+def make_formatter(cfg):
+    ''' Create the value formatter for a sensor configuration
+
+    :param cfg: Sensor configuration
+    :return: Function converting a raw value to the configured type
+    '''
+    if cfg.get('type') == 'float':
+        precision = cfg.get('precision', 0)
+        return lambda val: round(float(val), precision)
+    elif cfg.get('type') == 'int':
+        return int
+    return lambda val: val
+
+
+def compile_drivers(sh, config, imu=None):
+    ''' Compile sensor configurations into bound drivers
+
+    :param sh: Sense hat instance
+    :param config: List of sensor configurations
+    :param imu: IMU stream, IMU drivers read its latest sample instead of the sense hat
+    :return: List of drivers
+    '''
+    drivers = []
+    for cfg in config:
+        cls = DRIVERS.get(cfg.get('name'))
+        if cls is None:
+            logger.warning('No driver registered for sensor {}, skipping'.format(cfg.get('name')))
+            continue
+        source = imu if imu is not None and cls.imu else sh
+        drivers.append(cls(source, cfg))
+    return drivers
+
+
+class SensorDriver(object):
+    ''' Base class for a single value sensor driver
+
+    '''
+    key = None          # Payload key, defaults to the sensor name
+    getter = None       # Sense hat method used to read the sensor
+    converters = {}     # Unit converters keyed by configured units
+    imu = False         # Reads can be served by the IMU stream
+    angle = False       # Values are angles in degrees that wrap at 360
+
+    def __init__(self, sh, cfg):
+        ''' Class initialization
+
+        :param sh: Sense hat instance or IMU stream
+        :param cfg: Sensor configuration
+        '''
+        self.name = cfg['name']
+        self.key = self.key or self.name
+        self.units = cfg.get('units', '')
+        self.threshold = cfg.get('cos_threshold', 0)
+        self.rate = cfg.get('rate')
+        self.value = self.initial_value()
+        self.reported = self.value  # Last published value
+
+        self._sh = sh
+        self._format = make_formatter(cfg)
+        self._type = cfg.get('type')
+        self._precision = cfg.get('precision', 0)
+        self._round = lambda val: round(val, self._precision)
+        self._window = self.new_window()
+        self._convert = self.converters.get(self.units)
+        self.read = self.bind_reader(getattr(sh, self.getter))
+
+    def initial_value(self):
+        ''' Value reported before the first sample
+
+        '''
+        return 0
+
+    def new_window(self):
+        ''' Statistics of the samples since the last publish
+
+        '''
+        return AngleWindowStats() if self.angle else WindowStats()
+
+    def bind_reader(self, get):
+        ''' Bind the sense hat reader and unit converter into one function
+
+        :param get: Sense hat read method
+        :return: Function returning the value in the configured units before formatting
+        '''
+        convert = self._convert
+        if convert is None:
+            return get
+        return lambda: convert(get())
+
+    def format_batch(self, raw):
+        ''' Convert and format a batch of raw readings, such as a column of the IMU ring buffer
+
+        :param raw: NumPy array, array.array or memoryview of sense hat readings
+        :return: NumPy array of values as update() would report them
+        '''
+        return utils.format_batch(raw, self._convert, self._type, self._precision)
+
+    def update(self):
+        ''' Read the sensor and log values that changed by more than the threshold
+
+        :return: New sensor value
+        '''
+        raw = self.read()
+        self._window.add(raw)  # Statistics keep the precision the formatter drops
+        new_val = self._format(raw)
+        if abs(new_val - self.value) >= self.threshold:
+            logger.info("New {} value: {} {}".format(self.name, new_val, self.units))
+        self.value = new_val
+        return new_val
+
+    def is_changed(self):
+        ''' Check if the value moved by at least the threshold since it was last published
+
+        '''
+        return abs(self.value - self.reported) >= self.threshold
+
+    def mark_reported(self):
+        ''' Record the current value as published and start a new statistics window
+
+        '''
+        self.reported = self.value
+        self._window.reset()
+
+    def window_summary(self):
+        ''' Get min, max, mean, stddev and count of the samples since the last publish
+
+        :return: Dictionary of statistics, None before the first sample of the window
+        '''
+        return self._window.summary(self._round)
+
+    def window_mean(self):
+        ''' Get the mean of the samples since the last publish in the shape of the value
+
+        :return: Mean, the current value before the first sample of the window
+        '''
+        return self._round(self._window.mean) if self._window.count else self.value
+
+
+class AxesDriver(SensorDriver):
+    ''' Base class for an IMU driver reporting pitch, roll and yaw
+
+    '''
+    axes = (('pitch', 'pitch'), ('roll', 'roll'), ('yaw', 'yaw'))  # (payload axis, sense hat axis)
+    imu = True
+
+    def initial_value(self):
+        return {'pitch': 0, 'roll': 0, 'yaw': 0}
+
+    def new_window(self):
+        return {axis: AngleWindowStats() if self.angle else WindowStats() for axis, _ in self.axes}
+
+    def bind_reader(self, get):
+        convert, axes = self._convert or (lambda val: val), self.axes
+
+        def reader():
+            raw = get()
+            return {axis: convert(raw[src]) for axis, src in axes}
+        return reader
+
+    def update(self):
+        raw = self.read()
+        fmt = self._format
+        new_val = {}
+        for axis, window in self._window.items():
+            window.add(raw[axis])
+            new_val[axis] = fmt(raw[axis])
+
+        old_val = self.value
+        threshold = self.threshold
+        for axis, _ in self.axes:
+            if abs(new_val[axis] - old_val[axis]) >= threshold:
+                logger.info("New {} value: pitch: {}, roll: {}, yaw: {} {}".format(self.name,
+                                                                                   new_val['pitch'],
+                                                                                   new_val['roll'],
+                                                                                   new_val['yaw'],
+                                                                                   self.units))
+                break
+        self.value = new_val
+        return new_val
+
+    def is_changed(self):
+        value, reported, threshold = self.value, self.reported, self.threshold
+        for axis, _ in self.axes:
+            if abs(value[axis] - reported[axis]) >= threshold:
+                return True
+        return False
+
+    def mark_reported(self):
+        self.reported = self.value
+        for window in self._window.values():
+            window.reset()
+
+    def window_summary(self):
+        if self._window['pitch'].count == 0:
+            return None
+        return {axis: window.summary(self._round) for axis, window in self._window.items()}
+
+    def window_mean(self):
+        if self._window['pitch'].count == 0:
+            return self.value
+        return {axis: self._round(window.mean) for axis, window in self._window.items()}
+
+
+@register_driver('temperature')
+class TemperatureDriver(SensorDriver):
+    getter = 'get_temperature'
+    converters = {'F': utils.degree_c_to_degree_f}
+
+
+@register_driver('humidity')
+class HumidityDriver(SensorDriver):
+    getter = 'get_humidity'
+
+
+@register_driver('pressure')
+class PressureDriver(SensorDriver):
+    getter = 'get_pressure'
+    converters = {'inHg': utils.mbar_to_inhg}
+
+
+@register_driver('compass')
+class CompassDriver(SensorDriver):
+    getter = 'get_compass'
+    imu = True  # get_compass() reconfigures the IMU on the sense hat
+    angle = True
+
+
+@register_driver('orientation')
+class OrientationDriver(AxesDriver):
+    getter = 'get_orientation'
+    angle = True
+
+
+@register_driver('accelerometer')
+class AccelerometerDriver(AxesDriver):
+    key = 'acceleration'
+    getter = 'get_accelerometer_raw'
+    axes = (('pitch', 'x'), ('roll', 'y'), ('yaw', 'z'))
+
+    def bind_reader(self, get):
+        read = super(AccelerometerDriver, self).bind_reader(get)
+        set_imu_config = getattr(self._sh, 'set_imu_config', None)
+        if set_imu_config is None:
+            return read  # IMU stream is already configured
+
+        def reader():
+            set_imu_config(False, False, True)  # accelerometer only
+            return read()
+        return reader
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    High rate IMU capture into a preallocated ring buffer
+
+@Reference
+    Sense HAT API Reference (https://pythonhosted.org/sense-hat/api/)
+    RTIMULib (https://github.com/RPi-Distro/RTIMULib)
+
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import array
+import math
+import threading
+import time
+import log.logger as logger
+
+# Ring buffer row layout
+FIELDS = ('ts', 'accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z', 'pitch', 'roll', 'yaw')
+ROW_SIZE = len(FIELDS)
+TS, ACCEL_X, ACCEL_Y, ACCEL_Z, GYRO_X, GYRO_Y, GYRO_Z, PITCH, ROLL, YAW = range(ROW_SIZE)
+
+# Defaults
+DEFAULT_WINDOW = 1024
+DEFAULT_POLL_INTERVAL = 0.004
+
+
+class ImuRingBuffer(object):
+    ''' Fixed size ring buffer of IMU rows backed by a single array of doubles
+
+    There is a single writer. Readers get memoryviews into the backing array, so a window is only
+    stable until the writer wraps around to it. Compare written before and after reading to detect
+    an overrun.
+    '''
+
+    def __init__(self, capacity=DEFAULT_WINDOW):
+        ''' Class initialization
+
+        :param capacity: Number of rows to keep
+        '''
+        self.capacity = capacity
+        self.written = 0  # Total rows ever written
+        self._data = array.array('d', bytes(8 * capacity * ROW_SIZE))
+        self._view = memoryview(self._data)
+
+    def append(self, row):
+        ''' Write a row, overwriting the oldest when full
+
+        :param row: array('d') of ROW_SIZE values
+        '''
+        start = (self.written % self.capacity) * ROW_SIZE
+        self._data[start:start + ROW_SIZE] = row
+        self.written += 1
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def latest(self):
+        ''' Get a view of the most recent row
+
+        :return: memoryview of ROW_SIZE values or None when empty
+        '''
+        if self.written == 0:
+            return None
+        start = ((self.written - 1) % self.capacity) * ROW_SIZE
+        return self._view[start:start + ROW_SIZE]
+
+    def window(self, rows=None):
+        ''' Get the most recent rows, oldest first, without copying
+
+        The window may wrap the end of the buffer, so it is returned as up to two flat views of
+        doubles in ROW_SIZE strides. numpy.frombuffer(view).reshape(-1, ROW_SIZE) gives a 2D view.
+
+        :param rows: Number of rows, defaults to all buffered rows
+        :return: Tuple of memoryviews
+        '''
+        count = len(self) if rows is None else min(rows, len(self))
+        if count == 0:
+            return ()
+
+        end = self.written % self.capacity
+        begin = (self.written - count) % self.capacity
+        if begin < end:
+            return (self._view[begin * ROW_SIZE:end * ROW_SIZE],)
+        return (self._view[begin * ROW_SIZE:], self._view[:end * ROW_SIZE])
+
+
+class ImuStream(threading.Thread):
+    ''' Captures accelerometer, gyroscope and orientation at the IMU poll rate
+
+    '''
+
+    def __init__(self, sh, window=DEFAULT_WINDOW):
+        ''' Class initialization
+
+        :param sh: Sense hat instance
+        :param window: Number of samples kept in the ring buffer
+        '''
+        super(ImuStream, self).__init__()  # Base class initialization
+        self._sh = sh
+        self._shutdown = False
+        self.buffer = ImuRingBuffer(window)
+        self.dropped = 0
+
+    def run(self):
+        ''' Override threading run method
+
+        '''
+        logger.info("---- IMU stream thread started ----")
+
+        # Configure the IMU once, all sensors enabled for fusion
+        self._sh.set_imu_config(True, True, True)
+        imu = getattr(self._sh, '_imu', None)
+        if imu is not None:
+            self._run_rtimu(imu)
+        else:
+            self._run_api()
+
+        logger.info("[z] IMU stream thread stopped")
+
+    def _run_rtimu(self, imu):
+        ''' Read the RTIMU device directly, one read gives all sensors
+
+        The public sense hat getters each trigger their own IMU read and poll sleep.
+
+        :param imu: RTIMU instance
+        '''
+        interval = imu.IMUGetPollInterval() * 0.001 or DEFAULT_POLL_INTERVAL
+        logger.info('IMU poll interval {} ms'.format(interval * 1000))
+
+        append = self.buffer.append
+        row = array.array('d', bytes(8 * ROW_SIZE))
+        deadline = time.monotonic()
+        while not self._shutdown:
+            data = imu.getIMUData() if imu.IMURead() else None
+            if data is not None and data['fusionPoseValid']:
+                row[TS] = time.time()
+                row[ACCEL_X], row[ACCEL_Y], row[ACCEL_Z] = data['accel']
+                row[GYRO_X], row[GYRO_Y], row[GYRO_Z] = data['gyro']
+                roll, pitch, yaw = data['fusionPose']  # Same axes as sense hat, x is roll and y is pitch
+                row[PITCH] = math.degrees(pitch) % 360
+                row[ROLL] = math.degrees(roll) % 360
+                row[YAW] = math.degrees(yaw) % 360
+                append(row)
+            else:
+                self.dropped += 1
+
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def _run_api(self):
+        ''' Fallback using the public sense hat API when the IMU device is not exposed, paced to the default
+        poll interval so a getter that does not sleep cannot spin
+
+        '''
+        append = self.buffer.append
+        row = array.array('d', bytes(8 * ROW_SIZE))
+        while not self._shutdown:
+            accel = self._sh.get_accelerometer_raw()
+            gyro = self._sh.get_gyroscope_raw()
+            orientation = self._sh.get_orientation_degrees()
+            row[TS] = time.time()
+            row[ACCEL_X], row[ACCEL_Y], row[ACCEL_Z] = accel['x'], accel['y'], accel['z']
+            row[GYRO_X], row[GYRO_Y], row[GYRO_Z] = gyro['x'], gyro['y'], gyro['z']
+            row[PITCH], row[ROLL], row[YAW] = orientation['pitch'], orientation['roll'], orientation['yaw']
+            append(row)
+            time.sleep(DEFAULT_POLL_INTERVAL)
+
+    def stop(self):
+        ''' Stops the IMU stream thread
+
+        '''
+        self._shutdown = True
+
+    def get_orientation(self):
+        ''' Latest orientation in the sense hat API format
+
+        '''
+        row = self.buffer.latest() or (0.0,) * ROW_SIZE
+        return {'pitch': row[PITCH], 'roll': row[ROLL], 'yaw': row[YAW]}
+
+    def get_compass(self):
+        ''' Latest heading to north in the sense hat API format
+
+        '''
+        row = self.buffer.latest() or (0.0,) * ROW_SIZE
+        return row[YAW]
+
+    def get_accelerometer_raw(self):
+        ''' Latest accelerometer reading in the sense hat API format
+
+        '''
+        row = self.buffer.latest() or (0.0,) * ROW_SIZE
+        return {'x': row[ACCEL_X], 'y': row[ACCEL_Y], 'z': row[ACCEL_Z]}
+
+    def get_gyroscope_raw(self):
+        ''' Latest gyroscope reading in the sense hat API format
+
+        '''
+        row = self.buffer.latest() or (0.0,) * ROW_SIZE
+        return {'x': row[GYRO_X], 'y': row[GYRO_Y], 'z': row[GYRO_Z]}
@@ -22,13 +22,20 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 import json
 import time
+import asyncio
 import threading
-import utils
+import metrics
 import shutil
 import log.logger as logger
-from sense_hat import SenseHat
 from datetime import datetime
 from sensehatlive.messagebroker.rabbitmq import RabbitMQProducer
+from sensehatlive.messagebroker.aio import AsyncRabbitMQProducer
+from sensehatlive.messagebroker.codec import get_codec
+from sensehatlive.sensemanager.scheduler import SampleScheduler
+from sensehatlive.sensemanager.drivers import compile_drivers
+from sensehatlive.sensemanager.imu import ImuStream, DEFAULT_WINDOW
+from sensehatlive.sensemanager.simulator import SimulatedSenseHat, simulation_signals, DEFAULT_SEED
+from sensehatlive.sensemanager.profiler import SampleProfiler
 
 # LED colors
 LED_OFF = (0, 0, 0)
@@ -39,9 +46,20 @@ LED_BLUE = (0, 0, 255)
 # Defaults
 DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), 'default.json')
 SENSE_HAT_CONFIG = os.path.join(os.path.dirname(__file__), 'config.json')
-TICKS = .500
+HEARTBEAT_INTERVAL = .500
 SAMPLE_INTERVAL = 1
 PUBLISH_INTERVAL = 30
+STATS_INTERVAL = 60
+KEEPALIVE_INTERVAL = 300
+
+# Publish modes
+PUBLISH_MODE_INTERVAL = 'interval'  # Snapshot every PUBLISH_INTERVAL
+PUBLISH_MODE_COS = 'cos'            # Only on change of state, with a keepalive
+
+# Publish window statistics
+WINDOW_STATS_OFF = 'off'            # Last value only
+WINDOW_STATS_WITH = 'with'          # Last value with window statistics
+WINDOW_STATS_ONLY = 'only'          # Window mean as the value with window statistics
 
 
 class SenseHatManager(threading.Thread):
@@ -49,36 +67,85 @@ class SenseHatManager(threading.Thread):
 
     '''
 
-    def __init__(self, config_path=SENSE_HAT_CONFIG):
+    def __init__(self, config_path=SENSE_HAT_CONFIG, imu_stream=False, imu_window=DEFAULT_WINDOW,
+                 publish_mode=PUBLISH_MODE_INTERVAL, keepalive=KEEPALIVE_INTERVAL, event_loop=False,
+                 window_stats=WINDOW_STATS_OFF, simulate=False, sim_seed=DEFAULT_SEED, sim_latency=1.0, profile=False,
+                 **kwargs):
         ''' Class initialization
 
         :param config_path: Path to sense hat configuration
+        :param imu_stream: Capture the IMU continuously into a ring buffer
+        :param imu_window: Number of IMU samples kept by the stream
+        :param publish_mode: PUBLISH_MODE_INTERVAL or PUBLISH_MODE_COS
+        :param keepalive: Maximum seconds between messages in change of state mode
+        :param event_loop: Run the sampler and message broker on one asyncio event loop
+        :param window_stats: WINDOW_STATS_OFF, WINDOW_STATS_WITH or WINDOW_STATS_ONLY
+        :param simulate: Use a simulated sense hat instead of the board
+        :param sim_seed: Seed of the simulated signals
+        :param sim_latency: Scale of the simulated read latencies, 0 for none
+        :param profile: Time every sensor read, sensor update and sampler task, see dump_profile()
+        :param kwargs: Message broker options, see RabbitMQProducer
         '''
         super(SenseHatManager, self).__init__()  # Base class initialization
 
         # Set class defaults
         self._shutdown = False
-        self.temperature = 0
-        self.humidity = 0
-        self.pressure = 0
-        self.compass = 0
-        self.orientation = {'pitch': 0, 'roll': 0, 'yaw': 0}
-        self.accelerometer = {'pitch': 0, 'roll': 0, 'yaw': 0}
+        self._wakeup = threading.Event()
+        self._misses = {}
+        self._cos = publish_mode == PUBLISH_MODE_COS
+        self._keepalive = keepalive
+        self._event_loop = event_loop
+        self._loop = None
+        self._loop_wakeup = None
+        self._window_stats = window_stats
+
+        # Window statistics are nested in the payload, a fixed layout encoding would silently drop them
+        encoding = kwargs.get('encoding', 'json')
+        if window_stats != WINDOW_STATS_OFF and get_codec(encoding).fixed_layout:
+            raise Exception("Window statistics cannot be sent with the {} encoding".format(encoding))
 
         # Use mac address as unique Id
         self.mac_address = self._parse_mac_address()
 
-        # Get instance of sense hat
-        self._sh = SenseHat()
-
         # Load the sense hat config
         self._config = self._load_config(config_path)
 
+        # Get instance of sense hat
+        if simulate:
+            logger.info('Simulating sense hat with seed {}'.format(sim_seed))
+            self._sh = SimulatedSenseHat(sim_seed, sim_latency, simulation_signals(self._config))
+        else:
+            from sense_hat import SenseHat
+            self._sh = SenseHat()
+
+        # IMU capture runs on its own thread at the hardware rate
+        self.imu = ImuStream(self._sh, imu_window) if imu_stream else None
+
+        # Compile each configured sensor into a bound driver
+        self._drivers = compile_drivers(self._sh, self._config, self.imu)
+        self._sensor_metrics = {
+            driver.name: (metrics.counter('sensehatlive_samples_read', 'Sensor samples read', {'sensor': driver.name}),
+                          metrics.histogram('sensehatlive_sensor_read_seconds', 'Time to read and update a sensor',
+                                            {'sensor': driver.name}))
+            for driver in self._drivers}
+        self._jitter = metrics.histogram('sensehatlive_loop_jitter_seconds', 'Sampler lateness after a deadline',
+                                         buckets=metrics.JITTER_BUCKETS)
+
+        # Sensor reads are timed where the driver calls the sense hat
+        self.profiler = SampleProfiler() if profile else None
+        if self.profiler is not None:
+            for driver in self._drivers:
+                driver.read = self.profiler.wrap('sampler;{};read'.format(driver.name), driver.read)
+
         # Clear LEDs
         self._sh.clear()
 
         # Create instance of RabbitMQ producer to push data to server
-        self._broker = RabbitMQProducer('samples')
+        kwargs.setdefault('app_id', self.mac_address)
+        if event_loop:
+            self._broker = AsyncRabbitMQProducer('samples', **kwargs)
+        else:
+            self._broker = RabbitMQProducer('samples', **kwargs)
 
         logger.info('Device ID: {}'.format(self.mac_address))
 
@@ -89,41 +156,94 @@ class SenseHatManager(threading.Thread):
 
         logger.info("---- Sense hat manager thread started ----")
 
-        # Start the message broker
-        self._broker.start()
+        if self.imu is not None:
+            self.imu.start()
+
+        if self._event_loop:
+            asyncio.run(self._run_event_loop())
+        else:
+            # Start the message broker
+            self._broker.start()
+            self._schedule_tasks()
+
+            while not self._shutdown:
+                self._run_pending()
+
+                # Sleep until the next deadline, stop() sets the event to wake early
+                self._wakeup.wait(self._scheduler.time_until_next())
+
+        logger.info("[z] Sense hat manager thread stopped")
+
+    async def _run_event_loop(self):
+        ''' Run the scheduler and serve the message broker on one event loop
 
-        # Setup timers
-        current_time = time.monotonic()
-        sample_start = current_time - SAMPLE_INTERVAL
-        publish_start = current_time - PUBLISH_INTERVAL
+        '''
+        self._loop = asyncio.get_running_loop()
+        self._loop_wakeup = asyncio.Event()
+        broker = self._loop.create_task(self._broker.serve())
+        self._schedule_tasks()
 
         while not self._shutdown:
+            self._run_pending()
 
-            self._heartbeat()  # heartbeat
-            if self._broker.is_ready():
-                self._indicate_pub_enabled()
-            else:
-                self._indicate_pub_disabled()
+            # Sleep until the next deadline, stop() sets the event to wake early
+            try:
+                await asyncio.wait_for(self._loop_wakeup.wait(), self._scheduler.time_until_next())
+            except asyncio.TimeoutError:
+                pass
 
+        await broker
 
-            if utils.get_elasped_time(sample_start, current_time) >= SAMPLE_INTERVAL:
-                sample_start = current_time
+    def _run_pending(self):
+        ''' Run due tasks, recording how late the loop woke up for the first one
 
-                # update all configured sensors
-                for sensor in self._config:
-                    self._update_sensor(sensor)
+        '''
+        late = time.monotonic() - self._scheduler.next_deadline()
+        if late >= 0:
+            self._jitter.observe(late)
+        self._run_tasks()
 
-            if utils.get_elasped_time(publish_start, current_time) >= PUBLISH_INTERVAL:
+    def _schedule_tasks(self):
+        ''' Schedule each sensor at its own rate along with the housekeeping tasks
 
-                if self._broker.is_ready():
-                    # Publish sensor data to rabbitmq server
-                    self._broker.publish(self.get_json_payload())
-                    publish_start = current_time
+        '''
+        self._scheduler = SampleScheduler()
+        self._run_tasks = self._profiled('sampler', self._scheduler.run_pending)
+        for driver in self._drivers:
+            self._scheduler.add(driver.name, self._get_sample_interval(driver),
+                                self._profiled('sampler;' + driver.name, self._update_sensor), driver)
+        self._scheduler.add('heartbeat', HEARTBEAT_INTERVAL, self._profiled('sampler;heartbeat', self._heartbeat))
+        publish = self._profiled('sampler;publish', self._publish)
+        if self._cos:
+            # Sensors publish on change, this task only sends the keepalive
+            self._scheduler.add('publish', self._keepalive, publish)
+        elif self._broker.is_batching():
+            # A snapshot per sample of the fastest sensor goes into the batch, the broker decides when to send.
+            # Sensors were added first so their updates run before the publish due at the same time.
+            fastest = min([self._get_sample_interval(driver) for driver in self._drivers] or [SAMPLE_INTERVAL])
+            self._scheduler.add('publish', fastest, publish)
+        else:
+            self._scheduler.add('publish', PUBLISH_INTERVAL, publish)
+        self._scheduler.add('stats', STATS_INTERVAL, self._report_misses)
 
-            time.sleep(TICKS)
-            current_time = time.monotonic()
+    def _profiled(self, stack, func):
+        ''' Time a function under a profiler stack when profiling
 
-        logger.info("[z] Sense hat manager thread stopped")
+        :param stack: Stack name
+        :param func: Function
+        '''
+        return func if self.profiler is None else self.profiler.wrap(stack, func)
+
+    def dump_profile(self, directory):
+        ''' Write the sampler profile as folded stacks and log read percentiles
+
+        :param directory: Directory of the profile file
+        :return: Path of the profile file, None when not profiling
+        '''
+        if self.profiler is None:
+            logger.warning('Sampler profiling is not enabled')
+            return None
+        return self.profiler.dump(directory)
 
     def stop(self):
         ''' Stops the sense hat manager thread
@@ -132,7 +252,12 @@ class SenseHatManager(threading.Thread):
         logger.debug("Stopping ...")
         self._indicate_pub_disabled()
         self._broker.stop()
+        if self.imu is not None:
+            self.imu.stop()
         self._shutdown = True
+        self._wakeup.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop_wakeup.set)
 
     def get_json_payload(self):
         ''' Get the sense hat payload
@@ -141,15 +266,50 @@ class SenseHatManager(threading.Thread):
         payload = {
             "id": self.mac_address,  # mac address
             "ts": int(datetime.utcnow().timestamp()),
-            "temperature": self.temperature,
-            "humidity": self.humidity,
-            "pressure": self.pressure,
-            'compass': self.compass,
-            "orientation": self.orientation,
-            "acceleration": self.accelerometer
         }
+        for driver in self._drivers:
+            payload[driver.key] = driver.value
+
+        if self._window_stats != WINDOW_STATS_OFF:
+            # Statistics of every sample since the last publish
+            stats = {}
+            for driver in self._drivers:
+                summary = driver.window_summary()
+                if summary is None:
+                    continue
+                stats[driver.key] = summary
+                if self._window_stats == WINDOW_STATS_ONLY:
+                    payload[driver.key] = driver.window_mean()
+            payload['stats'] = stats
         return payload
 
+    def _publish(self):
+        ''' Publish sensor data to rabbitmq server
+
+        :return: Retry delay in seconds when the broker is not ready
+        '''
+        # Batches and the outbox accept samples while the broker is not ready
+        if not self._broker.is_ready() and not self._broker.is_batching() and not self._broker.has_outbox():
+            return HEARTBEAT_INTERVAL
+
+        self._broker.publish(self.get_json_payload())
+        for driver in self._drivers:
+            driver.mark_reported()
+
+        if self._cos:
+            # Restart the keepalive period
+            self._scheduler.reschedule('publish', self._keepalive)
+
+    def _report_misses(self):
+        ''' Log sensors that missed sample deadlines since the last report
+
+        '''
+        for name, (runs, misses) in self._scheduler.get_stats().items():
+            missed = misses - self._misses.get(name, 0)
+            if missed > 0:
+                logger.warning('{} missed {} deadlines ({} total, {} runs)'.format(name, missed, misses, runs))
+            self._misses[name] = misses
+
     def _indicate_pub_enabled(self):
         ''' Indicates publishing is enabled
 
@@ -181,6 +341,11 @@ class SenseHatManager(threading.Thread):
         color = LED_RED if color[0] == 0 else LED_OFF
         self._sh.set_pixel(0, 0, color)
 
+        if self._broker.is_ready():
+            self._indicate_pub_enabled()
+        else:
+            self._indicate_pub_disabled()
+
     def _load_config(self, path):
         ''' Loads the sense hat configuration from file
 
@@ -219,6 +384,19 @@ class SenseHatManager(threading.Thread):
 
         return True
 
+    def _get_sample_interval(self, driver):
+        ''' Get the sample interval for a sensor
+
+        :param driver: Sensor driver
+        :return: Interval in seconds from the configured rate in Hz
+        '''
+        rate = driver.rate
+        if rate is None:
+            return SAMPLE_INTERVAL
+        if rate <= 0:
+            raise Exception("Sensor {} rate must be greater than 0".format(driver.name))
+        return 1.0 / rate
+
     def _get_sensor_cfg(self, sensor_name):
         ''' Get the sensor config data
 
@@ -230,107 +408,15 @@ class SenseHatManager(threading.Thread):
 
         return cfg
 
-    def _format_val(self, cfg, val):
-        ''' Converts value to new type
-
-        :param cfg: Sensor configuration
-        :param val: Current value
-
-        :return Formated value
-        '''
-        if cfg['type'] == 'float':
-            return round(float(val), cfg['precision'])
-        elif cfg['type'] == 'int':
-            return int(val)
-        elif cfg['type'] == 'dict':
-            pass
-        else:
-            return val
-
-    def _update_sensor(self, cfg):
+    def _update_sensor(self, driver):
         ''' Handles updating sensor values
 
-        :param cfg: sensor configuration
+        :param driver: Sensor driver
         '''
-
-        if cfg['name'] == 'temperature':
-            val = utils.degree_c_to_degree_f(self._sh.get_temperature()) \
-                if cfg['units'] == 'F' else self._sh.get_temperature()
-            self.temperature = self._process_sensor_val(cfg, val, self.temperature)
-
-        elif cfg['name'] == 'humidity':
-            val = self._sh.get_humidity()
-            self.humidity = self._process_sensor_val(cfg, val, self.humidity)
-
-        elif cfg['name'] == 'pressure':
-            if cfg['units'] == 'inHg':
-                val = utils.mbar_to_inhg(self._sh.get_pressure())
-            else:
-                val = self._sh.get_pressure()
-            self.pressure = self._process_sensor_val(cfg, val, self.pressure)
-
-        elif cfg['name'] == 'orientation':
-            val = self._sh.get_orientation()
-            self.orientation = self._process_imu_vals(cfg, val, self.orientation)
-
-        elif cfg['name'] == 'compass':
-            val = self._sh.get_compass()
-            self.compass = self._process_sensor_val(cfg, val, self.compass)
-
-        elif cfg['name'] == 'accelerometer':
-            self._sh.set_imu_config(False, False, True)  # gyroscope only
-            val = self._sh.get_accelerometer_raw()
-            val['pitch'] = val.pop('x')
-            val['roll'] = val.pop('y')
-            val['yaw'] = val.pop('z')
-            self.accelerometer = self._process_imu_vals(cfg, val, self.accelerometer)
-
-        else:
-            return
-
-    def _process_sensor_val(self, cfg, new_val, old_val):
-        ''' Processes the sensors value
-
-        :param cfg: Sensor config
-        :param new_val: New sensor value
-        :param old_val: old sensor value
-
-        :return: New sensor value
-        '''
-
-        # Format value
-        new_val = self._format_val(cfg, new_val)
-
-        # Determine amount of change in value
-        delta = abs(new_val - old_val)
-        if delta >= cfg['cos_threshold']:
-            logger.info("New {} value: {} {}".format(cfg['name'], new_val, cfg['units']))
-        return new_val
-
-    def _process_imu_vals(self, cfg, new_val, old_val):
-        ''' Processes the imu sensors values
-
-        :param cfg: Sensor config
-        :param new_val: New sensor values
-        :param old_val: old sensor values
-
-        :return: New sensor values
-        '''
-
-        # Format value
-
-        delta = []
-        for k, v in new_val.items():
-            t = self._format_val(cfg, v)
-            new_val[k] = t
-            # Determine amount of change in value
-            delta.append(abs(new_val[k] - old_val[k]))
-
-        for d in delta:
-            if d >= cfg['cos_threshold']:
-                logger.info("New {} value: pitch: {}, roll: {}, yaw: {} {}".format(cfg['name'],
-                                                                                   new_val['pitch'],
-                                                                                   new_val['roll'],
-                                                                                   new_val['yaw'],
-                                                                                   cfg['units']))
-        return new_val
+        count, latency = self._sensor_metrics[driver.name]
+        start = time.perf_counter()
+        driver.update()
+        latency.observe(time.perf_counter() - start)
+        count.inc()
+        if self._cos and driver.is_changed():
+            self._publish()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Optional timing of the sampler. Wrapped functions are timed with perf_counter_ns under a stack name such
+    as "sampler;orientation;read". Each stack keeps its call count, total time and a ring of the latest
+    times for rolling percentiles. dump() writes the totals as folded stacks of self time, the input of
+    flamegraph.pl and speedscope, and logs the percentiles.
+
+@Reference
+    Brendan Gregg, FlameGraph (https://github.com/brendangregg/FlameGraph)
+
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import array
+import log.logger as logger
+
+DEFAULT_WINDOW = 1024
+PERCENTILES = (50, 90, 99)
+
+
+class StackTimes(object):
+    ''' Call count, total and latest times of one stack
+
+    '''
+    __slots__ = ('count', 'total', 'ring')
+
+    def __init__(self, window):
+        self.count = 0
+        self.total = 0
+        self.ring = array.array('q', bytes(8 * window))
+
+    def add(self, elapsed):
+        ring = self.ring
+        ring[self.count % len(ring)] = elapsed
+        self.count += 1
+        self.total += elapsed
+
+    def latest(self):
+        ''' Sorted times of the latest calls, up to the window size
+
+        '''
+        return sorted(self.ring[:min(self.count, len(self.ring))])
+
+
+class SampleProfiler(object):
+    ''' Times functions by stack name
+
+    '''
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        ''' Class initialization
+
+        :param window: Number of latest times kept per stack for percentiles
+        '''
+        self._window = window
+        self._stacks = {}
+        self.started = time.time()
+
+    def stack(self, name):
+        ''' Get the times of a stack, created when missing
+
+        :param name: Frames separated by ';', root first
+        '''
+        times = self._stacks.get(name)
+        if times is None:
+            times = self._stacks[name] = StackTimes(self._window)
+        return times
+
+    def wrap(self, name, func):
+        ''' Time every call of func under a stack
+
+        :param name: Stack name
+        :param func: Function to time
+        :return: Timed function
+        '''
+        add = self.stack(name).add
+        clock = time.perf_counter_ns
+
+        def timed(*args):
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                add(clock() - start)
+        return timed
+
+    def percentiles(self):
+        ''' Rolling percentiles of every stack
+
+        :return: Dictionary of stack to dictionary of count, mean and percentiles in ns
+        '''
+        result = {}
+        for name, times in sorted(self._stacks.items()):
+            latest = times.latest()
+            if not latest:
+                continue
+            stats = {'count': times.count, 'mean': times.total // times.count, 'max': latest[-1]}
+            for pct in PERCENTILES:
+                stats['p{}'.format(pct)] = latest[min(len(latest) - 1, len(latest) * pct // 100)]
+            result[name] = stats
+        return result
+
+    def folded(self):
+        ''' Total self time of every stack in ns, the time of its children removed
+
+        :return: List of (stack, ns)
+        '''
+        totals = {name: times.total for name, times in self._stacks.items()}
+        self_times = dict(totals)
+        for name, total in totals.items():
+            parent = name.rpartition(';')[0]
+            if parent in self_times:
+                self_times[parent] -= total
+        return sorted((name, max(total, 0)) for name, total in self_times.items())
+
+    def dump(self, directory):
+        ''' Write the folded stacks and log the percentiles
+
+        :param directory: Directory of the profile file
+        :return: Path of the profile file
+        '''
+        path = os.path.join(directory, 'sensehatlive-{}-{}.folded'.format(os.getpid(), int(time.time())))
+        with open(path, 'w') as f:
+            for name, total in self.folded():
+                f.write('{} {}\n'.format(name, total))
+
+        logger.info('Sampler profile over {:.0f}s written to {}'.format(time.time() - self.started, path))
+        for name, stats in self.percentiles().items():
+            logger.info('{:<32} n={:<8} mean={:>9.1f}us p50={:>9.1f}us p90={:>9.1f}us p99={:>9.1f}us '
+                        'max={:>9.1f}us'.format(name, stats['count'], stats['mean'] / 1e3, stats['p50'] / 1e3,
+                                                stats['p90'] / 1e3, stats['p99'] / 1e3, stats['max'] / 1e3))
+        return path
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Heap based scheduler for running periodic tasks at independent rates
+
+@Reference
+    Python heapq (https://docs.python.org/3/library/heapq.html)
+
+"""
+
+import heapq
+import itertools
+import time
+
+
+class ScheduledTask(object):
+    ''' Periodic task tracked by the scheduler
+
+    '''
+
+    def __init__(self, name, interval, callback, args=()):
+        ''' Class initialization
+
+        :param name: Task name
+        :param interval: Period in seconds
+        :param callback: Function to call when task is due
+        :param args: Arguments passed to callback
+        '''
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.deadline = 0
+        self.runs = 0
+        self.misses = 0
+
+
+class SampleScheduler(object):
+    ''' Schedules periodic tasks on a min-heap ordered by next deadline
+
+    '''
+
+    def __init__(self, clock=time.monotonic):
+        ''' Class initialization
+
+        :param clock: Monotonic clock function returning seconds
+        '''
+        self._clock = clock
+        self._heap = []
+        self._tasks = {}
+        self._seq = itertools.count()  # Tie breaker for equal deadlines
+
+    def add(self, name, interval, callback, *args):
+        ''' Add a periodic task, the first run is due immediately
+
+        :param name: Unique task name
+        :param interval: Period in seconds
+        :param callback: Function to call when task is due
+        :param args: Arguments passed to callback
+        '''
+        if interval <= 0:
+            raise ValueError("Task {} interval must be greater than 0".format(name))
+
+        task = ScheduledTask(name, interval, callback, args)
+        task.deadline = self._clock()
+        self._tasks[name] = task
+        heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+        return task
+
+    def next_deadline(self):
+        ''' Get the deadline of the next due task
+
+        :return: Deadline in clock seconds or None if no tasks
+        '''
+        while self._heap and self._heap[0][0] != self._heap[0][2].deadline:
+            heapq.heappop(self._heap)  # Drop stale entries
+        return self._heap[0][0] if self._heap else None
+
+    def time_until_next(self):
+        ''' Get the time until the next task is due
+
+        :return: Seconds until next deadline, never negative
+        '''
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(0, deadline - self._clock())
+
+    def run_pending(self):
+        ''' Runs all tasks whose deadline has passed
+
+        A callback may return a number of seconds to retry after instead of waiting a full period.
+        Periods skipped because the task ran late are counted as deadline misses.
+
+        :return: Number of tasks run
+        '''
+        count = 0
+        now = self._clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, task = heapq.heappop(self._heap)
+            if deadline != task.deadline:
+                continue  # Stale entry left by reschedule()
+
+            retry = task.callback(*task.args)
+            task.runs += 1
+            count += 1
+
+            if task.deadline != deadline:
+                now = self._clock()
+                continue  # Callback rescheduled its own task
+
+            if retry is not None:
+                task.deadline = now + retry
+            else:
+                # Keep deadlines on the original grid to avoid drift
+                late = now - task.deadline
+                missed = int(late // task.interval)
+                task.misses += missed
+                task.deadline += (missed + 1) * task.interval
+
+            heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+            now = self._clock()
+
+        return count
+
+    def reschedule(self, name, delay):
+        ''' Move the next run of a task
+
+        :param name: Task name
+        :param delay: Seconds from now until the task is due
+        '''
+        task = self._tasks[name]
+        task.deadline = self._clock() + delay
+        heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+
+    def get_stats(self):
+        ''' Get run and deadline miss counts per task
+
+        :return: Dictionary of task name to (runs, misses)
+        '''
+        return {name: (task.runs, task.misses) for name, task in self._tasks.items()}
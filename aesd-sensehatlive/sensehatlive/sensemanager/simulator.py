@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Simulated sense hat for running without a board. Every sensor channel is a seeded signal: a sine wave
+    around a base value with gaussian noise and random step changes, so a run with the same seed and read
+    times gives the same samples. Reads sleep for a configurable latency while holding a shared bus lock to
+    reproduce the I2C cost and contention of the real board. The LED matrix keeps its pixels in memory.
+
+@Reference
+    Sense HAT API Reference (https://pythonhosted.org/sense-hat/api/)
+
+"""
+
+import math
+import time
+import random
+import threading
+
+DEFAULT_SEED = 0
+
+# Read latency in seconds of each sense hat device, scaled by the simulator latency. The IMU getters sleep
+# for the poll interval after every read.
+DEFAULT_LATENCY = {
+    'humidity': 0.0015,     # HTS221, temperature and humidity
+    'pressure': 0.0015,     # LPS25H, temperature and pressure
+    'imu': 0.004,           # LSM9DS1 poll interval
+    'led': 0.0002,          # Frame buffer write
+}
+
+# Signal parameters of each channel in sense hat units
+DEFAULT_SIGNALS = {
+    'temperature': {'base': 22.0, 'amplitude': 2.0, 'period': 600, 'noise': 0.05, 'step': 1.5},
+    'humidity': {'base': 45.0, 'amplitude': 5.0, 'period': 900, 'noise': 0.3, 'step': 4.0},
+    'pressure': {'base': 1013.0, 'amplitude': 1.5, 'period': 1800, 'noise': 0.05, 'step': 1.0},
+    'pitch': {'base': 5.0, 'amplitude': 3.0, 'period': 20, 'noise': 0.2, 'step': 10.0, 'wrap': 360},
+    'roll': {'base': 2.0, 'amplitude': 3.0, 'period': 30, 'noise': 0.2, 'step': 10.0, 'wrap': 360},
+    'yaw': {'base': 90.0, 'amplitude': 45.0, 'period': 120, 'noise': 0.5, 'step': 30.0, 'wrap': 360},
+    'compass': {'base': 90.0, 'amplitude': 45.0, 'period': 120, 'noise': 1.0, 'step': 30.0, 'wrap': 360},
+    'accel_noise': {'noise': 0.01},
+    'gyro_x': {'amplitude': 0.05, 'period': 20, 'noise': 0.01},
+    'gyro_y': {'amplitude': 0.05, 'period': 30, 'noise': 0.01},
+    'gyro_z': {'amplitude': 0.1, 'period': 120, 'noise': 0.01},
+    'mag_x': {'base': 20.0, 'amplitude': 5.0, 'period': 120, 'noise': 0.5},
+    'mag_y': {'base': -5.0, 'amplitude': 5.0, 'period': 120, 'noise': 0.5},
+    'mag_z': {'base': -40.0, 'amplitude': 2.0, 'period': 120, 'noise': 0.5},
+}
+
+# Channels of each sensor configuration name, see simulation_signals()
+SENSOR_CHANNELS = {
+    'temperature': ('temperature',),
+    'humidity': ('humidity',),
+    'pressure': ('pressure',),
+    'orientation': ('pitch', 'roll', 'yaw'),
+    'compass': ('compass',),
+    'accelerometer': ('accel_noise',),
+    'gyroscope': ('gyro_x', 'gyro_y', 'gyro_z'),
+}
+
+
+def simulation_signals(config):
+    ''' Get signal overrides from a sense hat configuration
+
+    A sensor entry may have a "simulation" object with signal parameters, applied to every channel of the
+    sensor.
+
+    :param config: List of sensor configurations
+    :return: Dictionary of channel to signal parameters
+    '''
+    signals = {}
+    for cfg in config:
+        params = cfg.get('simulation')
+        if params:
+            for channel in SENSOR_CHANNELS.get(cfg.get('name'), ()):
+                signals[channel] = params
+    return signals
+
+
+class Signal(object):
+    ''' base + amplitude * sin(2 pi t / period + phase) + steps + noise
+
+    Steps happen on average every step_interval seconds and move the level by up to +/- step. Step times
+    and sizes come from their own generator so they only depend on the seed, noise depends on the seed and
+    the number of reads.
+    '''
+
+    def __init__(self, seed, base=0.0, amplitude=0.0, period=60, phase=None, noise=0.0, step=0.0,
+                 step_interval=300, wrap=None):
+        ''' Class initialization
+
+        :param seed: Seed of the signal
+        :param base: Value the signal oscillates around
+        :param amplitude: Sine amplitude
+        :param period: Sine period in seconds
+        :param phase: Sine phase in radians, random when None
+        :param noise: Standard deviation of the gaussian noise
+        :param step: Maximum size of a step change
+        :param step_interval: Mean seconds between step changes
+        :param wrap: Values are taken modulo wrap when set, e.g. 360 for angles
+        '''
+        self._noise_rng = random.Random('{}:noise'.format(seed))
+        self._step_rng = random.Random('{}:step'.format(seed))
+        self.base = base
+        self.amplitude = amplitude
+        self.omega = 2 * math.pi / period
+        self.phase = self._step_rng.uniform(0, 2 * math.pi) if phase is None else phase
+        self.noise = noise
+        self.step = step
+        self.step_interval = step_interval
+        self.wrap = wrap
+
+        self.offset = 0.0
+        self._next_step = self._step_rng.expovariate(1.0 / step_interval) if step else None
+
+    def value(self, t):
+        ''' Get the value at t
+
+        :param t: Seconds since the start of the simulation
+        '''
+        while self._next_step is not None and t >= self._next_step:
+            self.offset += self._step_rng.uniform(-self.step, self.step)
+            self._next_step += self._step_rng.expovariate(1.0 / self.step_interval)
+
+        val = self.base + self.offset + self.amplitude * math.sin(self.omega * t + self.phase)
+        if self.noise:
+            val += self._noise_rng.gauss(0.0, self.noise)
+        return val % self.wrap if self.wrap else val
+
+
+class SimulatedSenseHat(object):
+    ''' Drop in replacement for sense_hat.SenseHat
+
+    '''
+
+    def __init__(self, seed=DEFAULT_SEED, latency=1.0, signals=None, clock=time.monotonic):
+        ''' Class initialization
+
+        :param seed: Seed of every signal
+        :param latency: Scale of DEFAULT_LATENCY, or a dictionary of device to seconds, 0 for no latency
+        :param signals: Dictionary of channel to signal parameters merged over DEFAULT_SIGNALS
+        :param clock: Time source in seconds, signals start at its value on creation
+        '''
+        if isinstance(latency, dict):
+            self._latency = dict(DEFAULT_LATENCY, **latency)
+        else:
+            self._latency = {device: delay * latency for device, delay in DEFAULT_LATENCY.items()}
+
+        params = {channel: dict(p, **(signals or {}).get(channel, {})) for channel, p in DEFAULT_SIGNALS.items()}
+        self._signals = {channel: Signal('{}:{}'.format(seed, channel), **p) for channel, p in params.items()}
+        self._clock = clock
+        self._start = clock()
+        self._bus = threading.Lock()
+        self._pixels = [[0, 0, 0] for _ in range(64)]
+        self._imu_config = (True, True, True)
+        self.rotation = 0
+        self.low_light = False
+        self.calls = {device: 0 for device in DEFAULT_LATENCY}  # Reads or LED writes of each device
+
+    def _read(self, device, *channels):
+        ''' Sample channels on the bus, sleeping for the device latency
+
+        :param device: Key of the device latency
+        :param channels: Channel names
+        :return: List of values
+        '''
+        with self._bus:
+            delay = self._latency[device]
+            if delay:
+                time.sleep(delay)
+            self.calls[device] += 1
+            t = self._clock() - self._start
+            return [self._signals[channel].value(t) for channel in channels]
+
+    # Environmental sensors
+
+    def get_humidity(self):
+        return self._read('humidity', 'humidity')[0]
+
+    def get_temperature_from_humidity(self):
+        return self._read('humidity', 'temperature')[0]
+
+    def get_temperature_from_pressure(self):
+        return self._read('pressure', 'temperature')[0] - 0.2
+
+    def get_temperature(self):
+        return self.get_temperature_from_humidity()
+
+    def get_pressure(self):
+        return self._read('pressure', 'pressure')[0]
+
+    # IMU
+
+    def set_imu_config(self, compass_enabled, gyro_enabled, accel_enabled):
+        self._imu_config = (compass_enabled, gyro_enabled, accel_enabled)
+
+    def get_orientation_degrees(self):
+        pitch, roll, yaw = self._read('imu', 'pitch', 'roll', 'yaw')
+        return {'pitch': pitch, 'roll': roll, 'yaw': yaw}
+
+    def get_orientation_radians(self):
+        return {axis: math.radians(val) for axis, val in self.get_orientation_degrees().items()}
+
+    def get_orientation(self):
+        return self.get_orientation_degrees()
+
+    def get_compass(self):
+        return self._read('imu', 'compass')[0]
+
+    def get_compass_raw(self):
+        x, y, z = self._read('imu', 'mag_x', 'mag_y', 'mag_z')
+        return {'x': x, 'y': y, 'z': z}
+
+    def get_gyroscope_raw(self):
+        x, y, z = self._read('imu', 'gyro_x', 'gyro_y', 'gyro_z')
+        return {'x': x, 'y': y, 'z': z}
+
+    def get_gyroscope(self):
+        return self.get_orientation_degrees()
+
+    def get_accelerometer_raw(self):
+        ''' Gravity in G rotated by the simulated pitch and roll, with noise
+
+        '''
+        pitch, roll, nx, ny, nz = self._read('imu', 'pitch', 'roll', 'accel_noise', 'accel_noise', 'accel_noise')
+        pitch, roll = math.radians(pitch), math.radians(roll)
+        return {'x': -math.sin(pitch) + nx,
+                'y': math.sin(roll) * math.cos(pitch) + ny,
+                'z': math.cos(roll) * math.cos(pitch) + nz}
+
+    def get_accelerometer(self):
+        return self.get_orientation_degrees()
+
+    # LED matrix, pixels are stored as RGB565 like the frame buffer
+
+    def _write_led(self):
+        self.calls['led'] += 1
+        delay = self._latency['led']
+        if delay:
+            time.sleep(delay)
+
+    @staticmethod
+    def _rgb565(pixel):
+        r, g, b = pixel
+        if not all(0 <= val <= 255 for val in (r, g, b)):
+            raise ValueError('Pixel elements must be between 0 and 255')
+        return [r & 0xF8, g & 0xFC, b & 0xF8]
+
+    def set_pixel(self, x, y, *args):
+        pixel = args[0] if len(args) == 1 else args
+        if not (0 <= x <= 7 and 0 <= y <= 7):
+            raise ValueError('X and Y position must be between 0 and 7')
+        self._pixels[y * 8 + x] = self._rgb565(pixel)
+        self._write_led()
+
+    def get_pixel(self, x, y):
+        if not (0 <= x <= 7 and 0 <= y <= 7):
+            raise ValueError('X and Y position must be between 0 and 7')
+        return list(self._pixels[y * 8 + x])
+
+    def set_pixels(self, pixel_list):
+        if len(pixel_list) != 64:
+            raise ValueError('Pixel lists must have 64 elements')
+        self._pixels = [self._rgb565(pixel) for pixel in pixel_list]
+        self._write_led()
+
+    def get_pixels(self):
+        return [list(pixel) for pixel in self._pixels]
+
+    def clear(self, *args):
+        color = (args[0] if len(args) == 1 else args) if args else (0, 0, 0)
+        self.set_pixels([color] * 64)
+
+    def set_rotation(self, r=0, redraw=True):
+        if r not in (0, 90, 180, 270):
+            raise ValueError('Rotation must be 0, 90, 180 or 270 degrees')
+        self.rotation = r
+
+    def show_letter(self, s, text_colour=(255, 255, 255), back_colour=(0, 0, 0)):
+        self.clear(back_colour)
+
+    def show_message(self, text_string, scroll_speed=.1, text_colour=(255, 255, 255), back_colour=(0, 0, 0)):
+        ''' Takes as long as scrolling the text on the board when latency is enabled
+
+        '''
+        if self._latency['led']:
+            time.sleep(scroll_speed * (len(text_string) * 6 + 8))
+        self.clear(back_colour)
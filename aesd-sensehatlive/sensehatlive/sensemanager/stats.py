@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Streaming statistics over a publish window in constant memory
+
+@Reference
+    Welford, Note on a Method for Calculating Corrected Sums of Squares and Products, Technometrics 1962
+    Mardia and Jupp, Directional Statistics, Wiley 2000
+
+"""
+
+import math
+
+
+class WindowStats(object):
+    ''' Running min, max, mean and standard deviation of the samples since the last reset
+
+    '''
+    __slots__ = ('count', 'mean', 'min', 'max', '_m2')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        ''' Start a new window
+
+        '''
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+
+    def add(self, val):
+        ''' Add a sample
+
+        :param val: Sample value
+        '''
+        self.count += 1
+        delta = val - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (val - self.mean)
+        if self.min is None or val < self.min:
+            self.min = val
+        if self.max is None or val > self.max:
+            self.max = val
+
+    def stddev(self):
+        ''' Population standard deviation of the window
+
+        '''
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+    def summary(self, fmt):
+        ''' Get the window statistics
+
+        :param fmt: Function formatting each statistic
+        :return: Dictionary of min, max, mean, stddev and count, None for an empty window
+        '''
+        if self.count == 0:
+            return None
+        return {'min': fmt(self.min), 'max': fmt(self.max), 'mean': fmt(self.mean), 'stddev': fmt(self.stddev()),
+                'count': self.count}
+
+
+class AngleWindowStats(WindowStats):
+    ''' Window statistics of angles in degrees that wrap at 360. The mean and deviation are circular, from
+    running sums of the sines and cosines, so a window around north averages near 0 instead of 180. Min and max
+    are the smallest and largest readings.
+
+    '''
+    __slots__ = ('_sin', '_cos')
+
+    def reset(self):
+        ''' Start a new window
+
+        '''
+        super(AngleWindowStats, self).reset()
+        self._sin = 0.0
+        self._cos = 0.0
+
+    def add(self, val):
+        ''' Add a sample
+
+        :param val: Angle in degrees
+        '''
+        self.count += 1
+        rad = math.radians(val)
+        self._sin += math.sin(rad)
+        self._cos += math.cos(rad)
+        self.mean = math.degrees(math.atan2(self._sin, self._cos)) % 360
+        if self.min is None or val < self.min:
+            self.min = val
+        if self.max is None or val > self.max:
+            self.max = val
+
+    def stddev(self):
+        ''' Angular deviation of the window in degrees, from 0 when every sample agrees to about 81 when they
+        cancel out
+
+        '''
+        if not self.count:
+            return 0.0
+        length = min(1.0, math.hypot(self._sin, self._cos) / self.count)  # Mean resultant length
+        return math.degrees(math.sqrt(2 * (1 - length)))
@@ -17,6 +17,8 @@
 """
 
 import time
+import array
+import numpy as np
 
 def get_elasped_time(start_time, current_time):
     ''' Get the elapsed amount of time
@@ -37,4 +39,39 @@ def mbar_to_inhg(mbars):
     ''' Converts millibars to inHg
 
     '''
-    return mbars * 0.029530
\ No newline at end of file
+    return mbars * 0.029530
+
+def as_array(values, dtype=np.float64):
+    ''' View a batch of samples as a NumPy array, buffers are not copied
+
+    :param values: NumPy array, array.array, memoryview or sequence of numbers
+    :param dtype: Type for a sequence of numbers
+    '''
+    if isinstance(values, np.ndarray):
+        return values
+    if isinstance(values, array.array):
+        return np.frombuffer(values, dtype=values.typecode)
+    if isinstance(values, memoryview):
+        return np.asarray(values)
+    return np.asarray(values, dtype=dtype)
+
+def format_batch(values, convert=None, value_type=None, precision=0):
+    ''' Convert units, round and cast a batch of samples in one vectorized pass. With precision 0 results match
+    the scalar converters followed by the sensor formatter. Above 0 NumPy rounds the value scaled by a power of
+    ten while round() rounds the exact binary value, so values close to a half can differ in the last place,
+    e.g. np.round(2.675, 2) is 2.68 and round(2.675, 2) is 2.67.
+
+    :param values: Batch, see as_array()
+    :param convert: Unit converter such as degree_c_to_degree_f, applied to the whole array
+    :param value_type: Configured sensor type, 'float' rounds to precision and 'int' truncates like int()
+    :param precision: Decimal places for 'float'
+    :return: NumPy array
+    '''
+    batch = as_array(values)
+    if convert is not None:
+        batch = convert(batch)
+    if value_type == 'float':
+        return np.round(batch.astype(np.float64, copy=False), precision)
+    if value_type == 'int':
+        return batch.astype(np.int64)
+    return batch
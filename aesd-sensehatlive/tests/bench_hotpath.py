@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Micro benchmarks of the per sample hot path against the simulated sense hat without read latency: sensor
+    reads, formatting, driver updates, the payload and its encodings. Each case reports ns/op as the best and
+    median of several timed runs with the call overhead removed, the peak memory allocated by one op and the
+    memory it leaves allocated. Results are written as JSON, the exit code is 1 when a case is slower
+    than the baseline by more than the tolerance.
+
+@Reference
+    Python tracemalloc (https://docs.python.org/3/library/tracemalloc.html)
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import sensehatlive.log.logger as logger
+from sensehatlive.sensemanager.manager import SenseHatManager, DEFAULT_CONFIG, WINDOW_STATS_WITH
+from sensehatlive.sensemanager.stats import WindowStats
+from sensehatlive.messagebroker.codec import CODECS, get_codec
+
+BATCH_ROWS = 1024
+ALLOC_OPS = 200
+
+
+def build_cases(args):
+    ''' Create the benchmark cases
+
+    :return: List of (name, function, samples per op)
+    '''
+    manager = SenseHatManager(DEFAULT_CONFIG, simulate=True, sim_seed=args.seed, sim_latency=0)
+    stats_manager = SenseHatManager(DEFAULT_CONFIG, simulate=True, sim_seed=args.seed, sim_latency=0,
+                                    window_stats=WINDOW_STATS_WITH)
+    drivers = manager._drivers
+    for driver in drivers + stats_manager._drivers:
+        driver.update()
+    payload = manager.get_json_payload()
+
+    cases = []
+    for driver in drivers:
+        raw = driver.read()
+        cases.append(('read.' + driver.name, driver.read, 1))
+        if not isinstance(raw, dict):
+            cases.append(('format.' + driver.name, lambda fmt=driver._format, raw=raw: fmt(raw), 1))
+        cases.append(('update.' + driver.name, lambda driver=driver: manager._update_sensor(driver), 1))
+
+    window = WindowStats()
+    cases.append(('window.add', lambda: window.add(21.5), 1))
+    cases.append(('get_json_payload', manager.get_json_payload, 1))
+    cases.append(('get_json_payload.stats', stats_manager.get_json_payload, 1))
+    cases.append(('json.dumps', lambda: json.dumps(payload), 1))
+
+    for name in sorted(CODECS):
+        codec = get_codec(name)
+        cases.append(('encode.' + name, lambda codec=codec: codec.pack([codec.encode(payload)], False), 1))
+
+    column = np.random.default_rng(args.seed).normal(22.0, 2.0, BATCH_ROWS)
+    temperature = next(driver for driver in drivers if driver.name == 'temperature')
+    cases.append(('format_batch.temperature', lambda: temperature.format_batch(column), BATCH_ROWS))
+
+    codec = get_codec('json')
+    update = manager._update_sensor
+
+    def sample():
+        for driver in drivers:
+            update(driver)
+        codec.pack([codec.encode(manager.get_json_payload())], False)
+    cases.append(('sample', sample, 1))
+
+    if args.keyword:
+        cases = [case for case in cases if any(word in case[0] for word in args.keyword)]
+    return cases
+
+
+def time_ops(func, loops):
+    ''' Time loops calls of func
+
+    :return: Nanoseconds
+    '''
+    start = time.perf_counter_ns()
+    for _ in range(loops):
+        func()
+    return time.perf_counter_ns() - start
+
+
+def calibrate(func, min_time):
+    ''' Number of loops taking at least min_time seconds
+
+    '''
+    loops = 1
+    while True:
+        if time_ops(func, loops) >= min_time * 1e9:
+            return loops
+        loops *= 2
+
+
+def measure(func, args, overhead=0.0):
+    ''' Time a function
+
+    :param func: Function to benchmark
+    :param overhead: ns per call of an empty function, subtracted from the result
+    :return: Tuple of best and median ns/op
+    '''
+    loops = calibrate(func, args.min_time)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        runs = [time_ops(func, loops) / loops - overhead for _ in range(args.repeat)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return max(min(runs), 0.0), max(statistics.median(runs), 0.0)
+
+
+def allocations(func):
+    ''' Measure memory allocated by func with tracemalloc
+
+    :return: Tuple of peak bytes allocated by one op and bytes left allocated per op
+    '''
+    func()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+        peak -= before
+
+        for _ in range(ALLOC_OPS):
+            func()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        retained = (current - before) / (ALLOC_OPS + 1)
+    finally:
+        tracemalloc.stop()
+    return peak, retained
+
+
+def check(results, args):
+    ''' Compare results with the baseline
+
+    :return: List of failure messages
+    '''
+    if not args.baseline:
+        return []
+
+    with open(args.baseline) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+
+    failures = []
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is not None and result['ns_per_op'] > base['ns_per_op'] * (1 + args.tolerance):
+            failures.append('{}: {} ns/op regressed from {}'.format(result['name'], result['ns_per_op'],
+                                                                   base['ns_per_op']))
+    return failures
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    logger.initLogger(console=False, log_dir=False, verbose=args.verbose)
+
+    overhead, _ = measure(lambda: None, args)
+    results = []
+    print('{:<28} {:>12} {:>12} {:>12} {:>14}'.format('case', 'ns/op', 'median', 'peak B/op', 'retained B/op'))
+    for name, func, samples in build_cases(args):
+        best, median = measure(func, args, overhead)
+        peak, retained = allocations(func)
+        result = {
+            'name': name,
+            'ns_per_op': round(best, 1),
+            'ns_per_op_median': round(median, 1),
+            'ns_per_sample': round(best / samples, 1),
+            'alloc_peak_bytes': peak,
+            'alloc_retained_bytes': round(retained, 1),
+        }
+        results.append(result)
+        print('{:<28} {:>12.1f} {:>12.1f} {:>12} {:>14.1f}'.format(name, best, median, peak, retained))
+
+    failures = check(results, args)
+    report = {
+        'benchmark': 'hotpath',
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()},
+        'config': {'min_time': args.min_time, 'repeat': args.repeat, 'call_overhead_ns': round(overhead, 1)},
+        'results': results,
+        'failures': failures,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for failure in failures:
+        print('FAIL {}'.format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Hot path benchmark')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Increase logging verbosity')
+    parser.add_argument('-k', '--keyword', nargs='+',
+                        help='Only run cases with one of these words in their name')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='Minimum seconds of each timed run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timed runs per case')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the simulated sensor signals')
+    parser.add_argument('-o', '--output',
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--baseline',
+                        help='Results file of an earlier run, slower cases fail')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed ns/op regression from the baseline as a fraction')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,601 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    End to end benchmark of the sample pipeline without a board or a RabbitMQ server. A simulated sense hat
+    manager publishes through RabbitMQProducer to RabbitMQConsumer over an in process broker that stands in
+    for the AMQP connection, channel and ioloop. Every encoding and batch size combination is measured for
+    samples/s, publish to consume latency, CPU per sample and message and memory growth. Results are written
+    as JSON, the exit code is 1 when a threshold or the baseline comparison fails.
+
+    Without --rate the pipeline is saturated and latency is mostly time spent in the window, use a rate
+    below the saturated throughput to measure latency under load.
+
+    Each sample carries its sequence number in ts so the consumer can match it to its publish time.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import collections
+import gc
+import heapq
+import itertools
+import json
+import platform
+import resource
+import threading
+import time
+from types import SimpleNamespace
+
+import sensehatlive.log.logger as logger
+from sensehatlive.sensemanager.manager import SenseHatManager, DEFAULT_CONFIG
+from sensehatlive.messagebroker.rabbitmq import RabbitMQConsumer
+
+ENCODINGS = ('json', 'struct', 'gorilla')
+BATCH_SIZES = (0, 10, 100)
+PERCENTILES = (50, 90, 99)
+READY_TIMEOUT_SEC = 10
+DRAIN_TIMEOUT_SEC = 60
+
+
+class LocalIOLoop(object):
+    ''' Stand in for the pika ioloop, callbacks and timers run on the thread calling start()
+
+    '''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._callbacks = collections.deque()
+        self._timers = []
+        self._seq = itertools.count()
+        self._stopping = False
+
+    def add_callback_threadsafe(self, callback):
+        with self._cond:
+            self._callbacks.append(callback)
+            self._cond.notify()
+
+    def call_later(self, delay, callback):
+        timer = [time.monotonic() + delay, next(self._seq), callback]
+        with self._cond:
+            heapq.heappush(self._timers, timer)
+            self._cond.notify()
+        return timer
+
+    def remove_timeout(self, timer):
+        timer[2] = None
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+    def start(self):
+        while True:
+            with self._cond:
+                while not self._callbacks and not self._stopping:
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    self._stopping = False
+                    return
+
+                ready = list(self._callbacks)
+                self._callbacks.clear()
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    ready.append(heapq.heappop(self._timers)[2])
+
+            for callback in ready:
+                if callback is not None:
+                    callback()
+
+
+class LocalConnection(object):
+    ''' Stand in for pika.SelectConnection
+
+    '''
+
+    def __init__(self, broker, on_open_callback, on_close_callback):
+        self.ioloop = LocalIOLoop()
+        self.is_closing = False
+        self.is_closed = False
+        self._broker = broker
+        self._on_close = on_close_callback
+        self._channels = []
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def channel(self, on_open_callback):
+        channel = LocalChannel(self._broker, self, len(self._channels) + 1)
+        self._channels.append(channel)
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(channel))
+
+    def close(self):
+        if self.is_closing or self.is_closed:
+            return
+        self.is_closing = True
+        for channel in self._channels:
+            channel.close()
+
+        def closed():
+            self.is_closing = False
+            self.is_closed = True
+            self._on_close(self, 'Normal shutdown')
+        self.ioloop.add_callback_threadsafe(closed)
+
+
+class LocalChannel(object):
+    ''' Stand in for a pika channel on the default exchange. Publisher confirms are coalesced into multiple
+    acks like the broker does.
+
+    '''
+
+    def __init__(self, broker, connection, number):
+        self.channel_number = number
+        self._broker = broker
+        self._ioloop = connection.ioloop
+        self._on_close = []
+        self._open = True
+        self._on_confirm = None
+        self._published = 0
+        self._confirm_scheduled = False
+        self.prefetch = 0
+        self.unacked = collections.OrderedDict()
+        self.next_tag = 0
+        self.on_message = None
+        self.queue = None
+
+    def add_on_close_callback(self, callback):
+        self._on_close.append(callback)
+
+    def add_on_cancel_callback(self, callback):
+        pass
+
+    def queue_declare(self, queue, callback):
+        self._broker.declare(queue)
+        frame = SimpleNamespace(method=SimpleNamespace(queue=queue))
+        self._ioloop.add_callback_threadsafe(lambda: callback(frame))
+
+    def basic_qos(self, prefetch_count, callback):
+        self.prefetch = prefetch_count
+        self._ioloop.add_callback_threadsafe(lambda: callback(None))
+
+    def confirm_delivery(self, callback):
+        self._on_confirm = callback
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self._published += 1
+        self._broker.publish(routing_key, body, properties)
+        if self._on_confirm is not None and not self._confirm_scheduled:
+            self._confirm_scheduled = True
+            self._ioloop.add_callback_threadsafe(self._confirm)
+
+    def _confirm(self):
+        self._confirm_scheduled = False
+        method = SimpleNamespace(NAME='Basic.Ack', delivery_tag=self._published, multiple=True)
+        self._on_confirm(SimpleNamespace(method=method))
+
+    def basic_consume(self, queue, on_message_callback):
+        self.on_message = on_message_callback
+        self.queue = queue
+        self._broker.consume(queue, self)
+        return 'ctag{}'.format(self.channel_number)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self._broker.ack(self, delivery_tag, multiple)
+
+    def basic_cancel(self, consumer_tag, callback):
+        self._broker.cancel(self)
+        self._ioloop.add_callback_threadsafe(lambda: callback(None, consumer_tag))
+
+    def deliver(self, messages):
+        ''' Deliver messages on the ioloop, called by the broker with its lock held
+
+        :param messages: List of (delivery tag, body, properties)
+        '''
+        def run():
+            for tag, body, properties in messages:
+                if self._open:
+                    deliver = SimpleNamespace(exchange='', routing_key=self.queue, delivery_tag=tag)
+                    self.on_message(self, deliver, properties, body)
+        self._ioloop.add_callback_threadsafe(run)
+
+    def close(self):
+        if not self._open:
+            return
+        self._open = False
+        self._broker.cancel(self)
+        for callback in self._on_close:
+            self._ioloop.add_callback_threadsafe(lambda callback=callback: callback(self, 'Normal shutdown'))
+
+
+class LocalBroker(object):
+    ''' In process broker with one consumer per queue and prefetch limited delivery
+
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._consumers = {}  # Queue name to channel
+        self.published = 0
+
+    def attach(self, client):
+        ''' Make a producer or consumer connect to this broker
+
+        :param client: RabbitMQ producer or consumer
+        '''
+        client.connect = lambda: LocalConnection(self, client.on_connection_open, client.on_connection_closed)
+
+    def declare(self, queue):
+        with self._lock:
+            self._queues.setdefault(queue, collections.deque())
+
+    def publish(self, queue, body, properties):
+        with self._lock:
+            self.published += 1
+            self._queues.setdefault(queue, collections.deque()).append((body, properties))
+            self._dispatch(queue)
+
+    def consume(self, queue, channel):
+        with self._lock:
+            self._consumers[queue] = channel
+            self._dispatch(queue)
+
+    def cancel(self, channel):
+        with self._lock:
+            for queue, consumer in list(self._consumers.items()):
+                if consumer is channel:
+                    del self._consumers[queue]
+                    # Unacknowledged messages go back to the front of the queue
+                    pending = self._queues[queue]
+                    pending.extendleft(reversed(list(channel.unacked.values())))
+                    channel.unacked.clear()
+
+    def ack(self, channel, tag, multiple):
+        with self._lock:
+            unacked = channel.unacked
+            if multiple:
+                while unacked and next(iter(unacked)) <= tag:
+                    unacked.popitem(last=False)
+            else:
+                unacked.pop(tag, None)
+            if self._consumers.get(channel.queue) is channel:
+                self._dispatch(channel.queue)
+
+    def _dispatch(self, queue):
+        channel = self._consumers.get(queue)
+        if channel is None:
+            return
+
+        pending = self._queues[queue]
+        room = channel.prefetch - len(channel.unacked) if channel.prefetch else len(pending)
+        messages = []
+        while pending and room > 0:
+            body, properties = pending.popleft()
+            channel.next_tag += 1
+            channel.unacked[channel.next_tag] = (body, properties)
+            messages.append((channel.next_tag, body, properties))
+            room -= 1
+        if messages:
+            channel.deliver(messages)
+
+
+def rss_kb():
+    ''' Current resident set size in KiB, the peak where /proc is not available
+
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, pct):
+    ''' Nearest rank percentile of sorted values
+
+    '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+class PipelineCase(object):
+    ''' One benchmark run of an encoding and batch size
+
+    '''
+
+    def __init__(self, args, encoding, batch_size):
+        self.encoding = encoding
+        self.batch_size = batch_size
+        self._args = args
+        self._batch = max(batch_size, 1)
+        self._window = max(args.window, 4 * self._batch)
+        self._published = 0
+        self._consumed = 0
+        self._messages = 0
+        self._measure_from = None
+        self._sent = []
+        self._latency = []
+
+        self._broker = LocalBroker()
+        self._manager = SenseHatManager(DEFAULT_CONFIG, simulate=True, sim_seed=args.seed,
+                                        sim_latency=args.sim_latency, encoding=encoding, batch_size=batch_size,
+                                        queue_size=max(args.queue_size, self._window),
+                                        confirm_window=args.confirm_window)
+        self._manager.get_json_payload = self._stamp(self._manager.get_json_payload)
+        self._producer = self._manager._broker
+        self._consumer = RabbitMQConsumer('samples', self._on_message, decode_payload=True, workers=args.workers,
+                                          ack_batch=args.ack_batch)
+        self._broker.attach(self._producer)
+        self._broker.attach(self._consumer)
+
+    def _stamp(self, get_payload):
+        ''' Replace ts with the sequence number and record the publish time
+
+        '''
+        def payload():
+            data = get_payload()
+            data['ts'] = len(self._sent)
+            self._sent.append(time.perf_counter())
+            return data
+        return payload
+
+    def _on_message(self, message):
+        now = time.perf_counter()
+        payloads = message if isinstance(message, list) else [message]
+        sent, measure_from = self._sent, self._measure_from
+        for payload in payloads:
+            seq = payload['ts']
+            if measure_from is not None and seq >= measure_from:
+                self._latency.append(now - sent[seq])
+        self._messages += 1
+        self._consumed += len(payloads)
+
+    def _publish(self, count):
+        drivers = self._manager._drivers
+        update = self._manager._update_sensor
+        publish = self._manager._publish
+        interval = 1.0 / self._args.rate if self._args.rate else 0
+        start = time.perf_counter()
+        for i in range(count):
+            while self._published - self._consumed >= self._window:
+                time.sleep(0.0005)
+            if interval:
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            for driver in drivers:
+                update(driver)
+            publish()
+            self._published += 1
+
+    def _flush_batch(self):
+        ''' Publish a partial batch from the producer ioloop
+
+        '''
+        producer = self._producer
+
+        def flush():
+            with producer._lock:
+                producer._flush(True)
+        producer._connection.ioloop.add_callback_threadsafe(flush)
+
+    def _drain(self):
+        deadline = time.monotonic() + DRAIN_TIMEOUT_SEC
+        self._flush_batch()
+        while self._consumed < self._published and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self._published - self._consumed
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + READY_TIMEOUT_SEC
+        while not (self._producer.is_ready() and self._consumer._consuming):
+            if time.monotonic() > deadline:
+                raise Exception('Pipeline not ready after {}s'.format(READY_TIMEOUT_SEC))
+            time.sleep(0.001)
+
+    def run(self):
+        ''' Run the warmup and the measured samples
+
+        :return: Result dictionary
+        '''
+        args = self._args
+        warmup = -(-args.warmup // self._batch) * self._batch
+        samples = -(-args.samples // self._batch) * self._batch
+
+        self._consumer.start()
+        self._producer.start()
+        try:
+            self._wait_ready()
+            self._publish(warmup)
+            lost = self._drain()
+
+            gc.collect()
+            rss = rss_kb()
+            consumed, messages = self._consumed, self._messages
+            cpu = time.process_time()
+            start = time.perf_counter()
+            self._measure_from = self._published
+
+            self._publish(samples)
+            lost += self._drain()
+
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            consumed = self._consumed - consumed
+            messages = self._messages - messages
+            gc.collect()
+            rss = rss_kb() - rss
+        finally:
+            self._producer.stop()
+            self._producer.join(READY_TIMEOUT_SEC)
+            self._consumer.stop()
+            self._consumer.join(READY_TIMEOUT_SEC)
+
+        latency = sorted(self._latency)
+        result = {
+            'encoding': self.encoding,
+            'batch_size': self.batch_size,
+            'samples': consumed,
+            'messages': messages,
+            'lost': lost,
+            'duration_s': round(elapsed, 4),
+            'samples_per_sec': round(consumed / elapsed, 1) if elapsed else None,
+            'cpu_us_per_sample': round(cpu * 1e6 / consumed, 2) if consumed else None,
+            'cpu_us_per_message': round(cpu * 1e6 / messages, 2) if messages else None,
+            'rss_growth_kb': rss,
+        }
+        result['latency_ms'] = {'p{}'.format(pct): round(percentile(latency, pct) * 1e3, 3)
+                                for pct in PERCENTILES if latency}
+        if latency:
+            result['latency_ms']['max'] = round(latency[-1] * 1e3, 3)
+        return result
+
+
+def case_name(result):
+    return '{}/{}'.format(result['encoding'], result['batch_size'])
+
+
+def check(results, args):
+    ''' Compare results with the thresholds and the baseline
+
+    :return: List of failure messages
+    '''
+    failures = []
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {case_name(result): result for result in json.load(f)['results']}
+
+    for result in results:
+        name = case_name(result)
+        rate, p99, cpu = result['samples_per_sec'], result['latency_ms'].get('p99'), result['cpu_us_per_sample']
+        if result['lost']:
+            failures.append('{}: {} samples not consumed'.format(name, result['lost']))
+        if args.min_rate and rate < args.min_rate:
+            failures.append('{}: {} samples/s below {}'.format(name, rate, args.min_rate))
+        if args.max_p99_ms and p99 > args.max_p99_ms:
+            failures.append('{}: p99 latency {} ms above {}'.format(name, p99, args.max_p99_ms))
+        if args.max_cpu_us and cpu > args.max_cpu_us:
+            failures.append('{}: {} CPU us/sample above {}'.format(name, cpu, args.max_cpu_us))
+        if args.max_rss_kb and result['rss_growth_kb'] > args.max_rss_kb:
+            failures.append('{}: memory grew {} KiB, above {}'.format(name, result['rss_growth_kb'],
+                                                                       args.max_rss_kb))
+
+        base = baseline.get(name)
+        if base is None:
+            continue
+        tolerance = args.tolerance
+        if rate < base['samples_per_sec'] * (1 - tolerance):
+            failures.append('{}: {} samples/s regressed from {}'.format(name, rate, base['samples_per_sec']))
+        if p99 > base['latency_ms']['p99'] * (1 + tolerance):
+            failures.append('{}: p99 latency {} ms regressed from {}'.format(name, p99, base['latency_ms']['p99']))
+        if cpu > base['cpu_us_per_sample'] * (1 + tolerance):
+            failures.append('{}: {} CPU us/sample regressed from {}'.format(name, cpu, base['cpu_us_per_sample']))
+    return failures
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    logger.initLogger(console=False, log_dir=args.log_dir, verbose=args.verbose)
+
+    results = []
+    for encoding in args.encodings:
+        for batch_size in args.batch_sizes:
+            result = PipelineCase(args, encoding, batch_size).run()
+            results.append(result)
+            print('{:>12} {:>10.1f} samples/s  p50 {:>8} ms  p99 {:>8} ms  {:>8} CPU us/sample  {:>6} KiB'.format(
+                case_name(result), result['samples_per_sec'], result['latency_ms'].get('p50'),
+                result['latency_ms'].get('p99'), result['cpu_us_per_sample'], result['rss_growth_kb']))
+
+    failures = check(results, args)
+    report = {
+        'benchmark': 'pipeline',
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()},
+        'config': {'samples': args.samples, 'warmup': args.warmup, 'rate': args.rate, 'window': args.window,
+                   'workers': args.workers,
+                   'ack_batch': args.ack_batch, 'confirm_window': args.confirm_window,
+                   'sim_latency': args.sim_latency, 'seed': args.seed},
+        'results': results,
+        'failures': failures,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for failure in failures:
+        print('FAIL {}'.format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Pipeline benchmark')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Increase logging verbosity')
+    parser.add_argument('--log-dir',
+                        help='Write the application log to this directory to include its cost')
+    parser.add_argument('--encodings', nargs='+', choices=ENCODINGS, default=list(ENCODINGS),
+                        help='Payload encodings to measure')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=list(BATCH_SIZES),
+                        help='Producer batch sizes to measure, 0 publishes every sample on its own')
+    parser.add_argument('--samples', type=int, default=20000,
+                        help='Measured samples per case, rounded up to a whole batch')
+    parser.add_argument('--warmup', type=int, default=1000,
+                        help='Samples published before measuring')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Offered samples/s, 0 publishes as fast as the window allows')
+    parser.add_argument('--window', type=int, default=500,
+                        help='Maximum samples published but not consumed')
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help='Producer queue size')
+    parser.add_argument('--confirm-window', type=int, default=256,
+                        help='Producer confirm window')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Consumer worker threads, 0 consumes on the ioloop thread')
+    parser.add_argument('--ack-batch', type=int, default=1,
+                        help='Consumer acknowledgements per multiple ack')
+    parser.add_argument('--sim-latency', type=float, default=0,
+                        help='Scale of the simulated sensor read latencies')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the simulated sensor signals')
+    parser.add_argument('-o', '--output',
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--baseline',
+                        help='Results file of an earlier run, slower cases fail')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed regression from the baseline as a fraction')
+    parser.add_argument('--min-rate', type=float, default=0,
+                        help='Fail below this many samples/s')
+    parser.add_argument('--max-p99-ms', type=float, default=0,
+                        help='Fail above this p99 publish to consume latency')
+    parser.add_argument('--max-cpu-us', type=float, default=0,
+                        help='Fail above this CPU time per sample')
+    parser.add_argument('--max-rss-kb', type=int, default=0,
+                        help='Fail when memory grows more than this during a case')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    IMU stream checks against fake devices: the RTIMU fusion pose is mapped
+    to roll, pitch and yaw like the sense hat API, rows without a valid
+    fusion pose are skipped and the API fallback is paced. Runs as a script
+    or under pytest.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import math
+import time
+import traceback
+
+from sensehatlive.sensemanager.imu import ImuStream, DEFAULT_POLL_INTERVAL
+
+RUN_SEC = 0.2
+
+
+class FakeRTIMU(object):
+    ''' RTIMU device returning a fixed fusion pose of roll 10, pitch 20 and yaw 30 degrees
+
+    '''
+
+    def __init__(self, valid):
+        self.valid = valid
+        self.reads = 0
+
+    def IMUGetPollInterval(self):
+        return 1
+
+    def IMURead(self):
+        self.reads += 1
+        return True
+
+    def getIMUData(self):
+        return {'accel': (0.1, 0.2, 1.0), 'gyro': (0.01, 0.02, 0.03),
+                'fusionPose': (math.radians(10), math.radians(20), math.radians(30)),
+                'fusionPoseValid': self.valid(self.reads)}
+
+
+class FakeSenseHat(object):
+    ''' Sense hat whose getters return at once, like the simulator with no latency
+
+    '''
+
+    def __init__(self, imu=None):
+        if imu is not None:
+            self._imu = imu
+        self.reads = 0
+
+    def set_imu_config(self, compass, gyro, accel):
+        pass
+
+    def get_accelerometer_raw(self):
+        self.reads += 1
+        return {'x': 0.1, 'y': 0.2, 'z': 1.0}
+
+    def get_gyroscope_raw(self):
+        return {'x': 0.01, 'y': 0.02, 'z': 0.03}
+
+    def get_orientation_degrees(self):
+        return {'pitch': 20.0, 'roll': 10.0, 'yaw': 30.0}
+
+
+def _run(sh):
+    stream = ImuStream(sh)
+    stream.start()
+    time.sleep(RUN_SEC)
+    stream.stop()
+    stream.join()
+    return stream
+
+
+def test_rtimu_axis_mapping():
+    ''' Fusion pose x is roll and y is pitch
+
+    '''
+    stream = _run(FakeSenseHat(FakeRTIMU(lambda reads: True)))
+    orientation = stream.get_orientation()
+    assert math.isclose(orientation['roll'], 10)
+    assert math.isclose(orientation['pitch'], 20)
+    assert math.isclose(orientation['yaw'], 30)
+    assert math.isclose(stream.get_compass(), 30)
+
+
+def test_rtimu_invalid_pose_skipped():
+    ''' Reads without a valid fusion pose are not written to the ring buffer
+
+    '''
+    imu = FakeRTIMU(lambda reads: reads % 2 == 0)
+    stream = _run(FakeSenseHat(imu))
+    assert stream.buffer.written > 0
+    assert stream.buffer.written + stream.dropped == imu.reads
+    assert abs(stream.buffer.written - stream.dropped) <= 1
+
+
+def test_api_fallback_paced():
+    ''' The API fallback reads at most once per poll interval
+
+    '''
+    sh = FakeSenseHat()
+    stream = _run(sh)
+    assert 0 < sh.reads <= RUN_SEC / DEFAULT_POLL_INTERVAL + 1
+    assert stream.get_orientation() == {'pitch': 20.0, 'roll': 10.0, 'yaw': 30.0}
+
+
+TESTS = [test_rtimu_axis_mapping, test_rtimu_invalid_pose_skipped, test_api_fallback_paced]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - IMU stream test')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Shutdown checks of the buffered rotating log file: a process that logs
+    with the buffered handler exits at interpreter shutdown with its records
+    written, a staged file is rotated on a clean exit and a forked process
+    closing the handler leaves the staged file alone. Runs as a script or
+    under pytest.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import gzip
+import logging
+import subprocess
+import tempfile
+import traceback
+
+from sensehatlive.log.rotating import BufferedRotatingFileHandler
+
+# Logs one record and exits without stopping the logger
+SCRIPT = '''
+import os
+import sys
+sys.path.insert(0, os.path.join({root!r}, 'lib'))
+sys.path.insert(0, {root!r})
+import sensehatlive.log.logger as logger
+logger.initLogger(log_dir={log_dir!r}, buffered=True, staging_dir={staging_dir!r})
+logger.info('logged before exit')
+'''
+
+EXIT_TIMEOUT_SEC = 20
+
+
+def _run_and_exit(log_dir, staging_dir=None):
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    script = SCRIPT.format(root=root, log_dir=log_dir, staging_dir=staging_dir)
+    result = subprocess.run([sys.executable, '-c', script], timeout=EXIT_TIMEOUT_SEC)
+    assert result.returncode == 0
+
+
+def test_exit_with_buffered_log():
+    ''' Interpreter shutdown closes the handler without waiting on its writer thread
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        _run_and_exit(path)
+        with open(os.path.join(path, 'sensehatlive.log')) as f:
+            assert 'logged before exit' in f.read()
+
+
+def test_exit_with_staging_dir():
+    ''' The staged file is rotated into the log directory on a clean exit
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        staging = os.path.join(path, 'staging')
+        _run_and_exit(path, staging)
+        assert os.path.getsize(os.path.join(staging, 'sensehatlive.log')) == 0
+        with gzip.open(os.path.join(path, 'sensehatlive.log.1.gz'), 'rt') as f:
+            assert 'logged before exit' in f.read()
+
+
+def test_forked_close_keeps_staged_file():
+    ''' Closing the handler in a forked process does not rotate the file of the parent
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        staging = os.path.join(path, 'staging')
+        filename = os.path.join(path, 'test.log')
+        handler = BufferedRotatingFileHandler(filename, maxBytes=1000000, backupCount=2, stagingDir=staging)
+        handler.emit(logging.makeLogRecord({'msg': 'before fork', 'levelno': logging.INFO}))
+        handler.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            handler.close()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert not os.path.exists(filename + '.1.gz')
+        assert os.path.exists(os.path.join(staging, 'test.log'))
+
+        handler.close()
+        with gzip.open(filename + '.1.gz', 'rt') as f:
+            assert f.read() == 'before fork\n'
+
+
+TESTS = [test_exit_with_buffered_log, test_exit_with_staging_dir, test_forked_close_keeps_staged_file]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Log file shutdown test')
+    args = parser.parse_args()
+    main(args)
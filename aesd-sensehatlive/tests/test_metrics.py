@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Prometheus text format checks of the metrics registry: every sample
+    belongs to a family described by HELP and TYPE lines under the same
+    name, counters are exposed as name_total, labels are escaped and
+    histogram buckets are cumulative. Runs as a script or under pytest.
+
+@Reference
+    Prometheus exposition formats (https://prometheus.io/docs/instrumenting/exposition_formats/)
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensehatlive'))
+
+import argparse
+import threading
+import traceback
+
+import metrics
+
+
+def _parse(text):
+    ''' Parse the text format into family types and samples
+
+    :param text: Rendered registry
+    :return: Tuple of dictionary of family name to type and list of (family, sample line)
+    '''
+    types = {}
+    samples = []
+    family = None
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family, metric_type = line[len('# TYPE '):].split(' ')
+            types[family] = metric_type
+        elif line and not line.startswith('#'):
+            samples.append((family, line))
+    return types, samples
+
+
+def _registry():
+    registry = metrics.Registry()
+    registry.counter('app_samples_read', 'Samples read', {'sensor': 'temperature'}).inc(3)
+    registry.counter('app_samples_read', 'Samples read', {'sensor': 'hum"id\\ity'}).inc()
+    registry.gauge('app_queue_depth', 'Queued samples').set(7)
+    histogram = registry.histogram('app_latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for val in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(val)
+    return registry
+
+
+def test_counter_family_name():
+    ''' Counter samples and their HELP and TYPE lines use the name_total family
+
+    '''
+    text = _registry().render()
+    assert '# HELP app_samples_read_total Samples read' in text
+    assert '# TYPE app_samples_read_total counter' in text
+    assert 'app_samples_read_total{sensor="temperature"} 3' in text
+    assert '# TYPE app_samples_read ' not in text
+
+
+def test_samples_belong_to_typed_family():
+    ''' Every sample name is its family or a histogram suffix of it, so no family parses as untyped
+
+    '''
+    types, samples = _parse(_registry().render())
+    assert types == {'app_latency_seconds': 'histogram', 'app_queue_depth': 'gauge',
+                     'app_samples_read_total': 'counter'}
+    for family, line in samples:
+        name = line.split('{')[0].split(' ')[0]
+        suffixes = ('_bucket', '_sum', '_count') if types[family] == 'histogram' else ('',)
+        assert name in [family + suffix for suffix in suffixes]
+
+
+def test_values_and_labels():
+    ''' Label values are escaped and histogram buckets are cumulative
+
+    '''
+    text = _registry().render()
+    assert 'app_samples_read_total{sensor="hum\\"id\\\\ity"} 1' in text
+    assert 'app_queue_depth 7' in text
+    assert 'app_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'app_latency_seconds_bucket{le="1"} 3' in text
+    assert 'app_latency_seconds_bucket{le="+Inf"} 4' in text
+    assert 'app_latency_seconds_count 4' in text
+    assert 'app_latency_seconds_sum 6.05' in text
+
+
+def test_render_while_creating():
+    ''' Rendering while other threads create metrics does not fail
+
+    '''
+    registry = metrics.Registry()
+    errors = []
+
+    def create():
+        try:
+            for i in range(2000):
+                registry.counter('app_c{}'.format(i % 20), labels={'k': str(i % 100)}).inc()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=create)
+    thread.start()
+    while thread.is_alive():
+        registry.render()
+    thread.join()
+    assert not errors
+    assert len(_parse(registry.render())[1]) == 20 * 5
+
+
+TESTS = [test_counter_family_name, test_samples_belong_to_typed_family, test_values_and_labels,
+         test_render_while_creating]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Metrics format test')
+    args = parser.parse_args()
+    main(args)
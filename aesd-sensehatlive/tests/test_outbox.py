@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Crash recovery checks of the store and forward outbox: a torn record at the tail of the last segment is
+    truncated on open, the committed position survives a restart through the cursor file, and confirms of
+    records dropped by the size limit never move the cursor back. Runs as a script or under pytest.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import tempfile
+import traceback
+
+import sensehatlive.log.logger as logger
+from sensehatlive.messagebroker.outbox import Outbox, HEADER, SEGMENT_EXT
+
+
+def _bodies(outbox, count=100):
+    return [body for _, _, body in outbox.read(count)]
+
+
+def _last_segment(path):
+    return os.path.join(path, sorted(f for f in os.listdir(path) if f.endswith(SEGMENT_EXT))[-1])
+
+
+def test_torn_tail_truncated():
+    ''' A record cut short by a crash is removed, the records before it are kept
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path)
+        for i in range(3):
+            outbox.append('m{}'.format(i))
+        outbox.close()
+
+        segment = _last_segment(path)
+        size = os.path.getsize(segment)
+        with open(segment, 'ab') as f:
+            f.write(HEADER.pack(100, 0, 16) + b'application/js')  # Header and part of a record
+        assert os.path.getsize(segment) > size
+
+        outbox = Outbox(path)
+        assert os.path.getsize(segment) == size
+        assert _bodies(outbox) == [b'm0', b'm1', b'm2']
+
+        # New records follow the last complete one
+        outbox.append('m3')
+        assert _bodies(outbox) == [b'm3']
+        outbox.close()
+
+
+def test_corrupt_tail_truncated():
+    ''' A complete record with a bad checksum at the tail is removed
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path)
+        outbox.append('m0')
+        outbox.append('m1')
+        outbox.close()
+
+        segment = _last_segment(path)
+        with open(segment, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'X')
+
+        outbox = Outbox(path)
+        assert _bodies(outbox) == [b'm0']
+        outbox.close()
+
+
+def test_cursor_survives_restart():
+    ''' Committed records are not read again after reopening, uncommitted ones are
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path)
+        for i in range(5):
+            outbox.append('m{}'.format(i))
+        records = outbox.read(5)
+        outbox.commit(records[2][0])
+        outbox.close()
+
+        outbox = Outbox(path)
+        assert _bodies(outbox) == [b'm3', b'm4']
+        outbox.close()
+
+
+def test_cursor_across_segments():
+    ''' Fully committed segments are removed and the cursor points into the next one
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path, segment_bytes=64)
+        for i in range(10):
+            outbox.append('message {}'.format(i))
+        segments = len(os.listdir(path))
+        records = outbox.read(10)
+        outbox.commit(records[6][0])
+        outbox.close()
+        assert len(os.listdir(path)) < segments
+
+        outbox = Outbox(path, segment_bytes=64)
+        assert _bodies(outbox) == [b'message 7', b'message 8', b'message 9']
+        outbox.close()
+
+
+def test_missing_cursor_reads_everything():
+    ''' Without a cursor file delivery restarts from the oldest segment
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path)
+        outbox.append('m0')
+        outbox.append('m1')
+        outbox.commit(outbox.read(1)[0][0])
+        outbox.close()
+
+        os.remove(os.path.join(path, 'cursor'))
+        outbox = Outbox(path)
+        assert _bodies(outbox) == [b'm0', b'm1']
+        outbox.close()
+
+
+def test_stale_commit_ignored():
+    ''' Confirms of in flight records in a segment dropped by the size limit do not move the cursor back
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path, max_bytes=200, segment_bytes=64)
+        outbox.append('message 0')
+        outbox.append('message 1')
+        inflight = outbox.read(2)  # Read but not confirmed
+
+        oldest = _last_segment(path)
+        appended = 2
+        while os.path.exists(oldest):
+            outbox.append('message {}'.format(appended))
+            appended += 1
+        assert outbox.dropped == 0
+
+        # A later record is confirmed before the confirm of the dropped one arrives
+        records = outbox.read(2)
+        outbox.commit(records[1][0])
+        outbox.commit(inflight[1][0])
+        outbox.close()
+
+        outbox = Outbox(path, max_bytes=200, segment_bytes=64)
+        bodies = _bodies(outbox)
+        assert bodies == ['message {}'.format(i).encode() for i in range(4, appended)]
+        outbox.close()
+
+
+def test_inflight_not_counted_dropped():
+    ''' Only records never read count as dropped by the size limit
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        outbox = Outbox(path, max_bytes=200, segment_bytes=64)
+        outbox.append('message 0')
+        outbox.append('message 1')
+        outbox.append('message 2')
+        outbox.read(1)  # Only the first record in flight
+
+        appended = 3
+        while not outbox.dropped:
+            outbox.append('message {}'.format(appended))
+            appended += 1
+        assert outbox.dropped == 1  # message 1, message 0 is in flight
+        assert _bodies(outbox)[0] == b'message 2'
+        outbox.close()
+
+
+TESTS = [test_torn_tail_truncated, test_corrupt_tail_truncated, test_cursor_survives_restart,
+         test_cursor_across_segments, test_missing_cursor_reads_everything, test_stale_commit_ignored,
+         test_inflight_not_counted_dropped]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    logger.initLogger(console=args.verbose, log_dir=False, verbose=args.verbose)
+
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Outbox recovery test')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show outbox log messages')
+    args = parser.parse_args()
+    main(args)
@@ -29,7 +29,7 @@ import sys
 import time
 
 import sensehatlive.log.logger as logger
-from sense_hat import SenseHat
+from sensehatlive.sensemanager.simulator import SimulatedSenseHat
 
 
 def sig_handler(signum=None, frame=None):
@@ -62,7 +62,11 @@ def main(args):
     rc = 0
     try:
         logger.info('Sense Hat Live!: Test')
-        sh = SenseHat()
+        if args.simulate:
+            sh = SimulatedSenseHat(args.seed)
+        else:
+            from sense_hat import SenseHat
+            sh = SenseHat()
         while True:
             logger.info('Temperature = {:.1f} °C'.format(sh.get_temperature()))
             logger.info('Humidity = {} %rH'.format(int(sh.get_humidity())))
@@ -84,5 +88,9 @@ if __name__ == '__main__':
                         help='Increase console logging verbosity')
     parser.add_argument('-q', '--quiet', action='store_true',
                         help='Turn off console logging')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Use a simulated sense hat instead of the board')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the simulated sensor signals')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Window statistics checks: linear statistics of plain readings, circular
+    mean and deviation of angles that wrap at 360 and the drivers using the
+    circular statistics for orientation and compass only. Runs as a script
+    or under pytest.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import math
+import traceback
+
+from sensehatlive.sensemanager.stats import AngleWindowStats, WindowStats
+from sensehatlive.sensemanager.drivers import compile_drivers
+
+
+def _angle_diff(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+def _window(cls, samples):
+    stats = cls()
+    for val in samples:
+        stats.add(val)
+    return stats
+
+
+def test_linear_stats():
+    ''' Plain readings keep the arithmetic mean and population standard deviation
+
+    '''
+    stats = _window(WindowStats, [2, 4, 4, 4, 5, 5, 7, 9])
+    assert stats.mean == 5
+    assert stats.stddev() == 2
+    assert (stats.min, stats.max, stats.count) == (2, 9, 8)
+
+
+def test_angle_mean_around_north():
+    ''' Angles either side of north average to north, not south
+
+    '''
+    stats = _window(AngleWindowStats, [359, 1, 358, 2])
+    assert _angle_diff(stats.mean, 0) < 1e-9
+    assert stats.stddev() < 2
+    assert (stats.min, stats.max) == (1, 359)
+
+
+def test_angle_deviation_bounded():
+    ''' Samples that cancel out give a finite deviation
+
+    '''
+    stats = _window(AngleWindowStats, [90, 270])
+    assert math.isfinite(stats.stddev())
+    assert math.isclose(stats.stddev(), math.degrees(math.sqrt(2)))
+    assert stats.summary(lambda val: round(val, 1))['count'] == 2
+
+    stats.reset()
+    assert stats.count == 0 and stats.stddev() == 0.0
+    stats.add(45)
+    assert math.isclose(stats.mean, 45)
+
+
+class FakeSenseHat(object):
+    ''' Sense hat reporting headings either side of north
+
+    '''
+
+    def __init__(self):
+        self.reads = {}
+
+    def _heading(self, getter):
+        self.reads[getter] = self.reads.get(getter, 0) + 1
+        return 359.0 if self.reads[getter] % 2 else 1.0
+
+    def get_compass(self):
+        return self._heading('compass')
+
+    def get_orientation(self):
+        heading = self._heading('orientation')
+        return {'pitch': heading, 'roll': 10.0, 'yaw': heading}
+
+    def get_accelerometer_raw(self):
+        return {'x': self._heading('accelerometer'), 'y': 0.0, 'z': 1.0}
+
+
+def test_drivers_use_circular_mean():
+    ''' Orientation and compass windows are circular, accelerometer windows are linear
+
+    '''
+    config = [{'name': 'compass', 'type': 'float', 'precision': 1},
+              {'name': 'orientation', 'type': 'float', 'precision': 1},
+              {'name': 'accelerometer', 'type': 'float', 'precision': 1}]
+    compass, orientation, accelerometer = compile_drivers(FakeSenseHat(), config)
+    for _ in range(4):
+        compass.update()
+        orientation.update()
+        accelerometer.update()
+
+    assert _angle_diff(compass.window_mean(), 0) < 0.1
+    mean = orientation.window_mean()
+    assert _angle_diff(mean['yaw'], 0) < 0.1 and _angle_diff(mean['pitch'], 0) < 0.1
+    assert math.isclose(mean['roll'], 10)
+    assert accelerometer.window_mean()['pitch'] == 180
+
+
+TESTS = [test_linear_stats, test_angle_mean_around_north, test_angle_deviation_bounded,
+         test_drivers_use_circular_mean]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Window statistics test')
+    args = parser.parse_args()
+    main(args)
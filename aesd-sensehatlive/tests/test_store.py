@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Durability checks of the columnar ingest store: flush() syncs every
+    chunk appended to since the last flush, also chunks that filled up in
+    between, and reopened stores return the same rows. Runs as a script or
+    under pytest.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensehatlive'))
+
+import argparse
+import tempfile
+import traceback
+
+import numpy as np
+
+from ingest.store import ColumnStore, Chunk
+
+CHUNK_ROWS = 4
+
+
+def _payloads(device_id, first, count):
+    return [{'id': device_id, 'ts': ts, 'temperature': float(ts), 'orientation': {'yaw': ts / 2}}
+            for ts in range(first, first + count)]
+
+
+def test_flush_across_chunks():
+    ''' An append that crosses a chunk boundary syncs the full chunk and the new one
+
+    '''
+    flushed = []
+    flush = Chunk.flush
+    Chunk.flush = lambda chunk: (flushed.append(chunk.path), flush(chunk))
+    try:
+        with tempfile.TemporaryDirectory() as path:
+            store = ColumnStore(path, chunk_rows=CHUNK_ROWS)
+            store.append(_payloads('pi-1', 0, 3))
+            store.flush()
+            assert len(flushed) == 1
+
+            del flushed[:]
+            store.append(_payloads('pi-1', 3, 4))  # Fills the first chunk and starts the next one
+            store.flush()
+            assert sorted(os.path.basename(chunk) for chunk in flushed) == ['00000000', '00000001']
+
+            del flushed[:]
+            store.flush()
+            assert flushed == []
+    finally:
+        Chunk.flush = flush
+
+
+def test_reopen_after_flush():
+    ''' Rows of every chunk are returned by a reopened store
+
+    '''
+    with tempfile.TemporaryDirectory() as path:
+        store = ColumnStore(path, chunk_rows=CHUNK_ROWS)
+        store.append(_payloads('pi-1', 0, 3))
+        store.append(_payloads('pi-1', 3, 6))
+        store.append(_payloads('pi-2', 100, 2))
+        store.close()
+
+        store = ColumnStore(path, chunk_rows=CHUNK_ROWS)
+        assert sorted(store.devices()) == ['pi-1', 'pi-2']
+        rows = store.query('pi-1', 2, 7, fields=('temperature', 'orientation.yaw'))
+        assert rows['ts'].tolist() == [2, 3, 4, 5, 6, 7]
+        assert rows['temperature'].tolist() == [2, 3, 4, 5, 6, 7]
+        assert rows['orientation.yaw'].tolist() == [1, 1.5, 2, 2.5, 3, 3.5]
+        assert np.isnan(store.query('pi-2', 0, 200)['humidity']).all()
+
+        # Appends continue in the partly filled chunk
+        store.append(_payloads('pi-1', 9, 2))
+        assert store.query('pi-1', 0, 20)['ts'].tolist() == list(range(11))
+        store.close()
+
+
+TESTS = [test_flush_across_chunks, test_reopen_after_flush]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Ingest store test')
+    args = parser.parse_args()
+    main(args)
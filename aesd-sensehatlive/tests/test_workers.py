@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+ @Programmer(s)
+    Kenneth A. Jones II
+    kejo1166@colorado.edu
+
+ @Company
+    University of Colorado Boulder
+
+@Description
+    Consumer worker pool checks: deliveries finished out of order are only
+    acknowledged up to the oldest one still running, a failed callback is
+    rejected before any acknowledgement covers its tag and ordering lanes
+    run messages of one device one at a time in delivery order. Runs as a
+    script or under pytest.
+
+@Reference
+    None
+
+"""
+
+import os
+import sys
+
+# Ensure lib added to path, before any other imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensehatlive'))
+
+import argparse
+import json
+import queue
+import random
+import threading
+import time
+import traceback
+from types import SimpleNamespace
+
+from messagebroker.workers import AckTracker, WorkerPool
+
+DONE_TIMEOUT_SEC = 10
+
+
+class Channel(object):
+    ''' Records acknowledgements and rejections in the order they are sent
+
+    '''
+
+    def __init__(self):
+        self.events = []
+
+    def ack(self, delivery_tag):
+        self.events.append(('ack', delivery_tag))
+
+    def reject(self, delivery_tag):
+        self.events.append(('nack', delivery_tag))
+
+
+def _run_pool(pool, messages):
+    ''' Submit messages and run scheduled callbacks on this thread like the ioloop
+
+    :param pool: Worker pool
+    :param messages: List of (ordering key, payload dict)
+    :return: Channel with the acknowledgements and rejections
+    '''
+    scheduled = queue.Queue()
+    channel = Channel()
+    pool.attach(scheduled.put, channel.ack, channel.reject)
+    for tag, (key, payload) in enumerate(messages, 1):
+        properties = SimpleNamespace(content_type='application/json', app_id=key)
+        pool.submit(tag, properties, json.dumps(payload).encode())
+
+    deadline = time.monotonic() + DONE_TIMEOUT_SEC
+    while pool.get_stats()['completed'] < len(messages):
+        assert time.monotonic() < deadline
+        try:
+            scheduled.get(timeout=0.1)()
+        except queue.Empty:
+            pass
+    pool.close()
+    return channel
+
+
+def test_tracker_in_order():
+    ''' Every delivery completed in order can be acknowledged at once
+
+    '''
+    tracker = AckTracker()
+    assert [tracker.complete(tag) for tag in (1, 2, 3)] == [1, 2, 3]
+
+
+def test_tracker_out_of_order():
+    ''' Deliveries finished ahead of a running one wait for it
+
+    '''
+    tracker = AckTracker()
+    assert tracker.complete(2) is None
+    assert tracker.complete(4) is None
+    assert tracker.complete(1) == 2
+    assert tracker.complete(3) == 4
+    assert tracker.complete(5) == 5
+
+
+def test_tracker_reset():
+    ''' Delivery tags restart at 1 on a new channel
+
+    '''
+    tracker = AckTracker()
+    tracker.complete(1)
+    tracker.complete(3)
+    tracker.reset()
+    assert tracker.complete(1) == 1
+    assert tracker.complete(2) == 2
+
+
+def _fail_on_three(message):
+    if json.loads(message)['n'] == 3:
+        raise ValueError('bad sample')
+
+
+def test_failed_callback_rejected():
+    ''' A failed delivery is rejected before an acknowledgement covers its tag
+
+    '''
+    pool = WorkerPool(_fail_on_three, 1)
+    channel = _run_pool(pool, [(None, {'n': n}) for n in range(1, 6)])
+
+    assert channel.events.index(('nack', 3)) < min(i for i, (kind, tag) in enumerate(channel.events)
+                                                   if kind == 'ack' and tag >= 3)
+    assert [tag for kind, tag in channel.events if kind == 'nack'] == [3]
+    assert max(tag for kind, tag in channel.events if kind == 'ack') == 5
+    assert pool.get_stats()['failed'] == 1
+
+
+def test_ordered_lanes():
+    ''' Messages of one device run one at a time in delivery order, devices run in parallel
+
+    '''
+    lock = threading.Lock()
+    running = {}
+    seen = {}
+    overlap = []
+
+    def callback(message):
+        payload = json.loads(message)
+        with lock:
+            running[payload['id']] = running.get(payload['id'], 0) + 1
+            overlap.append(running[payload['id']] > 1)
+        time.sleep(random.random() * 0.002)
+        with lock:
+            running[payload['id']] -= 1
+            seen.setdefault(payload['id'], []).append(payload['n'])
+
+    pool = WorkerPool(callback, 4, ordered=True)
+    messages = [('pi-{}'.format(n % 3), {'id': 'pi-{}'.format(n % 3), 'n': n}) for n in range(90)]
+    channel = _run_pool(pool, messages)
+
+    assert not any(overlap)
+    for device, numbers in seen.items():
+        assert numbers == sorted(numbers)
+        assert len(numbers) == 30
+    assert max(tag for kind, tag in channel.events if kind == 'ack') == 90
+    assert pool.get_stats()['waiting'] == 0
+
+
+TESTS = [test_tracker_in_order, test_tracker_out_of_order, test_tracker_reset, test_failed_callback_rejected,
+         test_ordered_lanes]
+
+
+def main(args):
+    ''' Main function
+
+    :param args: Command line arguments
+    :return:
+    '''
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print('PASS {}'.format(test.__name__))
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(test.__name__))
+            traceback.print_exc()
+
+    print('{} passed, {} failed'.format(len(TESTS) - failed, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sense HAT Live! - Consumer worker pool test')
+    args = parser.parse_args()
+    main(args)